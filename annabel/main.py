@@ -1,6 +1,7 @@
 # userbot/main.py
 
 from telethon import TelegramClient, events
+from telethon.sessions import StringSession
 from supabase import create_client, Client
 import asyncio
 import os
@@ -24,12 +25,14 @@ API_ID = int(os.getenv("API_ID"))
 API_HASH = os.getenv("API_HASH")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# A session exported as a string keeps the session in memory instead of in userbot.session.
+SESSION_STRING = os.getenv("SESSION_STRING")
 
 # Initialize Supabase client
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 # Initialize Telethon client.
-client = TelegramClient("userbot", api_id=API_ID, api_hash=API_HASH)
+client = TelegramClient(StringSession(SESSION_STRING) if SESSION_STRING else "userbot", api_id=API_ID, api_hash=API_HASH)
 
 # Global variables to store the fetched configuration for the current userbot instance.
 current_user_id = None
@@ -0,0 +1,123 @@
+# bench_startup.py
+#
+# Startup benchmark for the entry point next to this file (main.py of the bot or the userbot).
+# Reports, each as the best of a few fresh interpreters:
+#   - the bare interpreter start, as a baseline;
+#   - `main.py --check`, which validates the environment without importing the network stacks;
+#   - importing the network stacks the full start needs, with the heaviest modules by `-X importtime`.
+# With --live it also starts main.py for real (a configured .env and, for the userbot, a logged-in
+# session are required) and reports the "... after start" timings it logs, up to the first
+# update; send the bot or the account a message to produce one.
+# This file is kept identical in telegram_bot/ and userbot/.
+# Run from the bot or userbot directory: python3 bench_startup.py [--live] [--service telegram_bot|userbot]
+# The service is told by the directory's name, or by its files when the directory was renamed.
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RUNS = 5
+LIVE_TIMEOUT = 120
+# Modules main.py pulls in after the `--check` gate, per entry point.
+HEAVY_IMPORTS = {
+    "telegram_bot": ["telegram.ext", "supabase"],
+    "userbot": ["telethon", "supabase"],
+}
+_IMPORTTIME = re.compile(r"import time:\s+\d+ \|\s+(\d+) \|(\s*)(\S+)")
+# Startup timings logged by main.py, e.g. "First update received 2.41s after start." or "Userbot started in 1.90s."
+_TIMING = re.compile(r"(?:after start|started in \d)")
+# The log prefix: "INFO:root:" for the bot, "<asctime> - INFO - " for the userbot.
+_LOG_PREFIX = re.compile(r"^(?:\w+:[\w.]+:|.*? - \w+ - )")
+
+
+def run(args, env=None):
+    """Wall time of a fresh interpreter running `args`, and its stderr."""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, *args], cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    return time.perf_counter() - start, result.stderr
+
+
+def best(args, env=None):
+    return min(run(args, env)[0] for _ in range(RUNS))
+
+
+def _importtime(code):
+    """(cumulative seconds, nesting depth, module) for every import of `code`, per -X importtime."""
+    _, stderr = run(["-X", "importtime", "-c", code])
+    entries = []
+    for line in stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if match:
+            entries.append((int(match.group(1)) / 1e6, len(match.group(2)) // 2, match.group(3)))
+    return entries
+
+
+def heaviest_imports(modules, top=10):
+    """The slowest of `modules` and of the modules they import directly, interpreter start-up excluded."""
+    startup = {module for _, _, module in _importtime("pass")}
+    entries = _importtime("; ".join(f"import {module}" for module in modules))
+    # Deeper imports are included in their parent's cumulative time.
+    return sorted((seconds, module) for seconds, depth, module in entries if depth <= 1 and module not in startup)[::-1][:top]
+
+
+def live():
+    """Starts main.py and prints its startup timings until the first update or LIVE_TIMEOUT."""
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    process = subprocess.Popen(
+        [sys.executable, "main.py"], cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    deadline = time.monotonic() + LIVE_TIMEOUT
+    try:
+        for line in process.stderr:
+            if _TIMING.search(line):
+                print(f"  {_LOG_PREFIX.sub('', line.strip())}")
+                if "First update" in line:
+                    return
+            if time.monotonic() > deadline:
+                print(f"  no update within {LIVE_TIMEOUT}s")
+                return
+        print(f"  main.py exited with code {process.wait()}")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def detect_service():
+    """The entry point next to this file: the directory's name, or the bot or userbot by their files."""
+    name = os.path.basename(HERE)
+    if name in HEAVY_IMPORTS:
+        return name
+    return "userbot" if os.path.exists(os.path.join(HERE, "settings.py")) else "telegram_bot"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark for the main.py next to this file.")
+    parser.add_argument("--live", action="store_true", help="also start main.py for real and report its startup timings")
+    parser.add_argument("--service", choices=sorted(HEAVY_IMPORTS), default=detect_service(), help="which entry point main.py is")
+    args = parser.parse_args()
+    heavy = HEAVY_IMPORTS[args.service]
+    # --check must not depend on the real environment to stay comparable between runs.
+    env = dict(os.environ, PAUSE="")
+
+    baseline = best(["-c", "pass"])
+    check = best(["main.py", "--check"], env)
+    imports = best(["-c", "; ".join(f"import {module}" for module in heavy)])
+    print(f"{'interpreter':<40} {baseline * 1e3:>8.0f}ms")
+    print(f"{'main.py --check':<40} {check * 1e3:>8.0f}ms")
+    print(f"{'import ' + ', '.join(heavy):<40} {imports * 1e3:>8.0f}ms")
+    for seconds, module in heaviest_imports(heavy):
+        print(f"  {module:<38} {seconds * 1e3:>8.0f}ms")
+
+    if args.live:
+        print("main.py")
+        live()
+
+
+if __name__ == "__main__":
+    main()
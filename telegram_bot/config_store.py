@@ -0,0 +1,118 @@
+# telegram_bot/config_store.py
+
+import asyncio
+import logging
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Cached marker for "this user has no configuration row".
+_MISSING = object()
+
+
+class ConfigStore:
+    """
+    Buffers the bot's writes to 'user_configs' and serves reads from what it last wrote.
+
+    Field updates for a user are merged into one pending upsert. The upsert is sent when a
+    setup flow completes (`flush`) or `delay` seconds after the last update, whichever comes first.
+    Rows read from or returned by Supabase are kept in a bounded LRU cache with a TTL, so
+    `/status` right after a write (or repeated `/status` calls) don't select the row again.
+    Call `invalidate` when another process reports a change to a user's row.
+    `on_flush(user_id)` is awaited after every write that reached the database.
+    A failed write keeps its fields pending and is retried after `retry_delay` seconds,
+    doubling up to `retry_max` while it keeps failing.
+    """
+
+    def __init__(self, database, on_flush=None, delay=5.0, cache_size=10000, cache_ttl=300.0, retry_delay=5.0, retry_max=300.0):
+        self._database = database
+        self._on_flush = on_flush
+        self._delay = delay
+        self._retry_delay = retry_delay
+        self._retry_max = retry_max
+        self._pending = {}
+        self._timers = {}
+        # user_id -> seconds until the next retry of a write that failed.
+        self._retries = {}
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    def _schedule(self, user_id, delay):
+        timer = self._timers.pop(user_id, None)
+        if timer is not None:
+            timer.cancel()
+        self._timers[user_id] = asyncio.get_running_loop().call_later(
+            delay, lambda: asyncio.ensure_future(self._flush_logged(user_id))
+        )
+
+    def update(self, user_id, fields):
+        """Merges `fields` into the user's pending write and (re)starts its debounce timer."""
+        self._pending.setdefault(user_id, {}).update(fields)
+        self._schedule(user_id, self._delay)
+
+    async def flush(self, user_id):
+        """Sends the user's pending fields as a single upsert, if there are any."""
+        timer = self._timers.pop(user_id, None)
+        if timer is not None:
+            timer.cancel()
+        fields = self._pending.pop(user_id, None)
+        if not fields:
+            return
+        try:
+            row = await self._database.upsert_config(user_id, fields)
+        except Exception:
+            # Put the fields back unless newer ones arrived meanwhile, and retry them with a backoff.
+            self._pending[user_id] = {**fields, **self._pending.get(user_id, {})}
+            delay = self._retries.get(user_id, self._retry_delay)
+            self._retries[user_id] = min(delay * 2, self._retry_max)
+            self._schedule(user_id, delay)
+            raise
+        self._retries.pop(user_id, None)
+        if row is not None:
+            self.cache.set(user_id, row)
+        else:
+            self.cache.invalidate(user_id)
+        if self._on_flush is not None:
+            await self._on_flush(user_id)
+
+    async def _flush_logged(self, user_id):
+        try:
+            await self.flush(user_id)
+        except Exception as e:
+            logger.error(f"Error saving configuration for User ID {user_id}: {e}")
+
+    async def flush_all(self):
+        for user_id in list(self._pending):
+            await self._flush_logged(user_id)
+
+    async def get(self, user_id):
+        """
+        Returns the user's configuration including writes that are still pending,
+        or None if the user has no configuration.
+        """
+        row = self.cache.get(user_id)
+        if row is None:
+            row = await self._database.get_config(user_id)
+            self.cache.set(user_id, row if row is not None else _MISSING)
+        elif row is _MISSING:
+            row = None
+        pending = self._pending.get(user_id)
+        if pending:
+            return {**(row or {"user_id": user_id}), **pending}
+        return row
+
+    def invalidate(self, user_id):
+        """Forgets the cached row of `user_id`, e.g. after another process changed it."""
+        self.cache.invalidate(user_id)
+
+    async def delete(self, user_id):
+        """Drops any pending write and deletes the user's configuration."""
+        timer = self._timers.pop(user_id, None)
+        if timer is not None:
+            timer.cancel()
+        self._pending.pop(user_id, None)
+        self._retries.pop(user_id, None)
+        await self._database.delete_config(user_id)
+        self.cache.set(user_id, _MISSING)
+        if self._on_flush is not None:
+            await self._on_flush(user_id)
@@ -0,0 +1,105 @@
+# db.py
+#
+# Async Supabase access shared by the bot and the userbot.
+# Every query is awaited on the async PostgREST client, so a slow database round trip
+# never blocks the event loop that handles Telegram updates.
+# This file is kept identical in telegram_bot/ and userbot/ since each is deployed on its own.
+
+import asyncio
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Database:
+    """
+    Async repository over the Supabase tables used by the services.
+
+    One AsyncClient is created per process and reused for every query; its HTTP client keeps
+    connections to Supabase alive between queries. Each query is bounded by `timeout` seconds.
+    """
+
+    def __init__(self, url, key, timeout=10.0):
+        self._url = url
+        self._key = key
+        self._timeout = timeout
+        self._client = None
+        self._lock = asyncio.Lock()
+
+    async def connect(self):
+        """Creates the async client on first use and returns it."""
+        if self._client is None:
+            async with self._lock:
+                if self._client is None:
+                    from supabase import AsyncClientOptions, acreate_client
+
+                    options = AsyncClientOptions(postgrest_client_timeout=self._timeout)
+                    self._client = await acreate_client(self._url, self._key, options=options)
+        return self._client
+
+    async def table(self, name):
+        """Returns a query builder for table `name`. Run it with `execute()`."""
+        client = await self.connect()
+        return client.table(name)
+
+    async def execute(self, query):
+        """Runs a query built from `table()` and returns its rows."""
+        response = await asyncio.wait_for(query.execute(), timeout=self._timeout)
+        return response.data or []
+
+    async def get_config(self, user_id):
+        """Returns the 'user_configs' row for `user_id`, or None if the user has no configuration."""
+        table = await self.table("user_configs")
+        rows = await self.execute(table.select("*").eq("user_id", user_id))
+        return rows[0] if rows else None
+
+    async def upsert_config(self, user_id, fields):
+        """Inserts or updates `fields` on the user's 'user_configs' row and returns the full row."""
+        table = await self.table("user_configs")
+        rows = await self.execute(table.upsert({"user_id": user_id, **fields}))
+        return rows[0] if rows else None
+
+    async def delete_config(self, user_id):
+        """Deletes the user's 'user_configs' row."""
+        table = await self.table("user_configs")
+        await self.execute(table.delete().eq("user_id", user_id))
+
+    async def create_backfill_job(self, user_id, source_id, destination_id, max_messages=None):
+        """Records a pending history backfill in 'backfill_jobs' and returns the new row."""
+        table = await self.table("backfill_jobs")
+        rows = await self.execute(table.insert({
+            "user_id": user_id,
+            "source_id": source_id,
+            "destination_id": destination_id,
+            "max_messages": max_messages,
+            "status": "pending",
+        }))
+        return rows[0] if rows else None
+
+    async def get_backfill_jobs(self, user_id, statuses=None, limit=None):
+        """Returns the user's backfill jobs, newest first, optionally only those in `statuses`."""
+        table = await self.table("backfill_jobs")
+        query = table.select("*").eq("user_id", user_id)
+        if statuses:
+            query = query.in_("status", list(statuses))
+        query = query.order("id", desc=True)
+        if limit:
+            query = query.limit(limit)
+        return await self.execute(query)
+
+    async def update_backfill_job(self, job_id, fields):
+        """Updates `fields` on one 'backfill_jobs' row."""
+        table = await self.table("backfill_jobs")
+        await self.execute(table.update(fields).eq("id", job_id))
+
+    async def get_session(self, name):
+        """Returns the saved Telethon session snapshot called `name` from 'userbot_sessions', or None."""
+        table = await self.table("userbot_sessions")
+        rows = await self.execute(table.select("data").eq("name", name))
+        return rows[0]["data"] if rows else None
+
+    async def save_session(self, name, data):
+        """Saves a Telethon session snapshot as the 'userbot_sessions' row called `name`."""
+        table = await self.table("userbot_sessions")
+        await self.execute(table.upsert({"name": name, "data": data, "updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat()}))
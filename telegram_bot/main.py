@@ -1,9 +1,105 @@
 import logging
-# Set up logging to DEBUG for detailed output in the console.
-# This helps in tracking the bot's execution flow and API calls.
-logging.basicConfig(level=logging.DEBUG) 
+import os # For accessing environment variables
+import re
+import sys # sys import added at the top
+import time
+# Reference point for the startup timings in the logs.
+STARTED = time.monotonic()
+from dotenv import load_dotenv # To load environment variables from .env file
+
+#To pause Service on railway
+if os.getenv("PAUSE") == "true":
+    print("🚧 Application is paused. Exiting now.")
+    sys.exit(0)
+
+
+# Load environment variables from the .env file in the current directory
+load_dotenv()
+
+# Malformed numeric settings, reported by validate(); each of them keeps its default meanwhile.
+_NUMBER_PROBLEMS = []
+
+def _number(name, default, kind=int):
+    """Reads a numeric environment variable, falling back to `default` when it is unset or malformed."""
+    value = (os.getenv(name) or "").strip()
+    if not value:
+        return default
+    try:
+        return kind(value)
+    except ValueError:
+        _NUMBER_PROBLEMS.append(f"{name} {value!r} is not {'a whole number' if kind is int else 'a number'}")
+        return default
+
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Log level of the bot (DEBUG, INFO, WARNING, ...). DEBUG also shows every Telegram API request.
+LOG_LEVELS = ("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Webhook mode: set WEBHOOK_URL to the bot's public base URL to receive updates there instead of polling.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip()
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_PATH = "/" + os.getenv("WEBHOOK_PATH", "/telegram").strip("/")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+# Railway and similar platforms tell the service which port to listen on in PORT.
+WEBHOOK_PORT = _number("WEBHOOK_PORT" if os.getenv("WEBHOOK_PORT") else "PORT", 8080)
+# Most updates handled at once, in both modes. A user's own updates are always handled in order.
+CONCURRENT_UPDATES = _number("CONCURRENT_UPDATES", 16)
+# Where the setup flow's per-user state lives: "sqlite" (BOT_STATE_PATH), "supabase" (shared by replicas) or "none".
+BOT_STATE = os.getenv("BOT_STATE", "sqlite").strip().lower()
+BOT_STATE_PATH = os.getenv("BOT_STATE_PATH", "bot_state.db")
+# Seconds between batched writes of changed user state.
+BOT_STATE_FLUSH_INTERVAL = _number("BOT_STATE_FLUSH_INTERVAL", 1.0, float)
+# Seconds before a Supabase query is abandoned, so a slow database can't hang a handler.
+DB_TIMEOUT = _number("DB_TIMEOUT", 10.0, float)
+# Seconds an unfinished setup flow's changes wait to be merged with the next ones before they're saved.
+CONFIG_WRITE_DELAY = _number("CONFIG_WRITE_DELAY", 5.0, float)
+# Bounded in-process cache of user configurations: most users kept, and for how many seconds.
+CONFIG_CACHE_SIZE = _number("CONFIG_CACHE_SIZE", 10000)
+CONFIG_CACHE_TTL = _number("CONFIG_CACHE_TTL", 300.0, float)
+# How often the cache's hit/miss/eviction counters are logged, in seconds (0 disables).
+CONFIG_CACHE_STATS_INTERVAL = _number("CONFIG_CACHE_STATS_INTERVAL", 900.0, float)
+
+# An unknown LOG_LEVEL logs at INFO until validate() reports it.
+logging.basicConfig(level=LOG_LEVEL if LOG_LEVEL in LOG_LEVELS else "INFO")
+# httpx logs every request at INFO, including each getUpdates poll. Keep it to warnings unless debugging.
+if LOG_LEVEL != "DEBUG":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
 print("Telegram bot is starting...")
 
+def validate():
+    """Returns a list of problems with the environment; empty if the bot can start."""
+    problems = list(_NUMBER_PROBLEMS)
+    problems += [f"{name} is missing" for name in ("BOT_TOKEN", "SUPABASE_URL", "SUPABASE_KEY") if not os.getenv(name)]
+    if LOG_LEVEL not in LOG_LEVELS:
+        problems.append(f"LOG_LEVEL {LOG_LEVEL!r} is not a log level")
+    if WEBHOOK_URL:
+        if not WEBHOOK_URL.startswith("https://"):
+            problems.append("WEBHOOK_URL must start with https://")
+        # Telegram allows 1-256 characters A-Z, a-z, 0-9, _ and - in a secret token.
+        if not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET):
+            problems.append("WEBHOOK_SECRET must be 1-256 characters of A-Z, a-z, 0-9, _ and -")
+    if CONCURRENT_UPDATES < 1:
+        problems.append("CONCURRENT_UPDATES must be at least 1")
+    if BOT_STATE not in ("sqlite", "supabase", "none"):
+        problems.append(f"BOT_STATE {BOT_STATE!r} must be sqlite, supabase or none")
+    return problems
+
+def check():
+    """
+    Validates the environment without touching the network. Returns the process exit code.
+    """
+    problems = validate()
+    for problem in problems:
+        logging.critical(f"Invalid configuration: {problem}.")
+    if not problems:
+        logging.info("Configuration OK.")
+    return 1 if problems else 0
+
+# `--check` and a bad environment are answered before the Telegram and Supabase libraries are imported.
+if __name__ == "__main__" and ("--check" in sys.argv[1:] or validate()):
+    sys.exit(check())
+
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -11,29 +107,132 @@ from telegram.ext import (
     CommandHandler,
     ContextTypes,
     MessageHandler,
+    TypeHandler,
     filters,
     CallbackQueryHandler # Ensure CallbackQueryHandler is imported for inline keyboard interactions
 )
-from supabase import create_client, Client # Supabase client for database operations
-import os # For accessing environment variables
-from dotenv import load_dotenv # To load environment variables from .env file
-import sys # sys import added at the top
+import asyncio
+from db import Database # Async Supabase access for database operations
+from config_store import ConfigStore # Coalesced config writes with read-your-writes caching
+from notify import NullNotifier, create_notifier # Config change notifications for the userbots
+from rules import FilterSyntaxError, parse as parse_filter # Filter rule syntax shared with the userbot
+from prefilter import PrefilterSyntaxError, describe as describe_prefilter, parse as parse_prefilter # Prefilter syntax shared with the userbot
+from webhook import PerUserUpdateProcessor, serve_webhook # Webhook mode and per-user ordered concurrency
+from persistence import SQLiteStateStore, SupabaseStateStore, UserStatePersistence # Setup flow state outside the process
 
-#To pause Service on railway
-if os.getenv("PAUSE") == "true":
-    print("🚧 Application is paused. Exiting now.")
-    sys.exit(0)
+# Backfill jobs the userbot still has to finish, and how many of the latest jobs /status shows.
+BACKFILL_ACTIVE_STATUSES = ("pending", "running")
+BACKFILL_STATUS_JOBS = 3
+# Backoff between attempts to connect Supabase and the config change notifier, in seconds.
+CONNECT_RETRY_MIN = 5
+CONNECT_RETRY_MAX = 300
+# Shortest digest interval /setdigest accepts, in minutes.
+DIGEST_MIN_INTERVAL = 1
 
+# Initialize the async Supabase access layer.
+# It stores and retrieves configurations without blocking the bot's event loop.
+db = Database(SUPABASE_URL, SUPABASE_KEY, timeout=DB_TIMEOUT)
 
-# Load environment variables from the .env file in the current directory
-load_dotenv()
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Notifier used to tell userbots their configuration changed, so they reload immediately
+# instead of waiting for their next poll. Connected in post_init once the event loop is running.
+notifier = create_notifier(db)
+
+async def publish_config_change(user_id):
+    """
+    Tells the user's userbot that its configuration changed in Supabase.
+    Called by the config store after every write to the user's 'user_configs' row.
+    """
+    await notifier.publish(user_id)
+
+# All handlers read and write configurations through this store. It merges the field
+# updates of a setup flow into one upsert and remembers the rows it wrote.
+configs = ConfigStore(
+    db,
+    on_flush=publish_config_change,
+    delay=CONFIG_WRITE_DELAY,
+    cache_size=CONFIG_CACHE_SIZE,
+    cache_ttl=CONFIG_CACHE_TTL,
+)
+
+async def log_cache_stats():
+    """
+    Periodically logs the config cache counters, to help size CONFIG_CACHE_SIZE and CONFIG_CACHE_TTL.
+    """
+    while True:
+        await asyncio.sleep(CONFIG_CACHE_STATS_INTERVAL)
+        stats = configs.cache.stats()
+        logging.info(
+            f"Config cache: {stats['size']}/{stats['maxsize']} entries, "
+            f"{stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+            f"{stats['evictions']} evictions, {stats['expirations']} expirations"
+        )
+
+async def connect_backends():
+    """
+    Connects to Supabase and the config change notifier. Runs in the background, so polling
+    starts without waiting for the Supabase import and connection; handlers that need the
+    database before it is done simply wait for the same connection.
+
+    Until the notifier is live, userbots that rely on it only see config changes at their safety
+    poll (up to 15 minutes), so both are retried with a backoff and every failure is logged as an error.
+    """
+    delay = CONNECT_RETRY_MIN
+    connected = False
+    while True:
+        try:
+            if not connected:
+                await db.connect()
+                connected = True
+                logging.info(f"Connected to Supabase {time.monotonic() - STARTED:.2f}s after start.")
+            if await notifier.start() or isinstance(notifier, NullNotifier):
+                return
+            logging.error(f"Config change notifications are not being published; userbots only see changes at their next poll. Retrying in {delay}s.")
+        except Exception as e:
+            logging.error(f"Could not connect to Supabase: {e}. Config change notifications are not being published; retrying in {delay}s.")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, CONNECT_RETRY_MAX)
+
+async def post_init(application: Application):
+    """
+    Runs once after the Application is initialized. Starts connecting to Supabase and the config change notifier.
+    """
+    # Changes published by other bot replicas make our cached copy of that row stale.
+    notifier.subscribe(configs.invalidate)
+    application.create_task(connect_backends())
+    if CONFIG_CACHE_STATS_INTERVAL > 0:
+        application.create_task(log_cache_stats())
+    logging.info(f"Bot initialized {time.monotonic() - STARTED:.2f}s after start.")
 
-# Initialize Supabase client
-# This client will interact with your Supabase database to store and retrieve configurations.
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+first_update_seen = False
+
+async def log_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Logs the time to the first update once, for the startup budget. Runs before all other handlers.
+    """
+    global first_update_seen
+    if not first_update_seen:
+        first_update_seen = True
+        logging.info(f"First update received {time.monotonic() - STARTED:.2f}s after start.")
+
+async def post_shutdown(application: Application):
+    """
+    Runs once when the Application shuts down. Saves pending config changes and disconnects the notifier.
+    """
+    await configs.flush_all()
+    await notifier.close()
+
+async def save_config(message, user_id):
+    """
+    Writes the user's pending config changes now, before a handler confirms them.
+    Returns False after telling the user the write failed; the store keeps retrying it in the background.
+    """
+    try:
+        await configs.flush(user_id)
+        return True
+    except Exception as e:
+        logging.error(f"Error saving configuration for User ID {user_id}: {e}")
+        await message.reply_text("❌ Could not save your change right now. It will be retried automatically; check /status in a minute.")
+        return False
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -72,11 +271,14 @@ async def set_destination(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def set_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Handles the /setmode command.
-    Provides inline buttons for the user to choose between "Forward All Messages" or "Forward by Keywords".
+    Provides inline buttons for the user to choose between "Forward All Messages", "Forward by Keywords",
+    "Forward by Filter" or "Digest of Matches".
     """
     keyboard = [
         [InlineKeyboardButton("Forward All Messages", callback_data="set_mode_all")],
-        [InlineKeyboardButton("Forward by Keywords", callback_data="set_mode_keywords")]
+        [InlineKeyboardButton("Forward by Keywords", callback_data="set_mode_keywords")],
+        [InlineKeyboardButton("Forward by Filter", callback_data="set_mode_filter")],
+        [InlineKeyboardButton("Digest of Matches", callback_data="set_mode_digest")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("Choose a forwarding mode:", reply_markup=reply_markup)
@@ -90,6 +292,96 @@ async def set_keywords(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["awaiting"] = "keywords"
     await update.message.reply_text("Please send your keywords, separated by commas (e.g., keyword1, keyword2, phrase three).")
 
+async def set_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Handles the /setfilter command.
+    Saves the filter given after the command, or prompts the user to send one.
+    """
+    if context.args:
+        await save_filter(update, " ".join(context.args))
+        return
+    context.user_data["awaiting"] = "filter"
+    await update.message.reply_text(
+        "Please send your filter, e.g.:\n"
+        "crypto AND NOT airdrop\n"
+        "(btc OR eth) AND word:buy\n"
+        "\"bitcoin price\" OR /\\bbtc\\s*\\d+k\\b/\n\n"
+        "Terms match anywhere in the message, word:term only as a whole word, /.../ is a regex. "
+        "Combine them with AND, OR, NOT and parentheses."
+    )
+
+async def set_digest(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Handles the /setdigest command.
+    Saves how often digests are posted (in minutes) and, optionally, after how many messages
+    one is posted early, and switches to mode 'digest'.
+    """
+    user_id = update.effective_user.id
+    try:
+        minutes = int(context.args[0])
+        max_messages = int(context.args[1]) if len(context.args) > 1 else None
+    except (IndexError, ValueError):
+        minutes = max_messages = None
+    if minutes is None or minutes < DIGEST_MIN_INTERVAL or (max_messages is not None and max_messages < 1):
+        await update.message.reply_text("Usage: /setdigest 60 for a digest every 60 minutes, /setdigest 60 50 to also post one as soon as 50 messages are waiting.")
+        return
+    fields = {"digest_interval": minutes * 60, "mode": "digest"}
+    if max_messages is not None:
+        fields["digest_max"] = max_messages
+    configs.update(user_id, fields)
+    if not await save_config(update.message, user_id):
+        return
+    await update.message.reply_text(
+        f"Digest set: every {minutes} minute(s)" + (f" or {max_messages} message(s)" if max_messages else "") + ". Mode set to 'digest'."
+    )
+
+async def set_prefilter(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Handles the /setprefilter command.
+    Saves conditions on a message's media, size, sender and forward header that it must meet
+    before any mode looks at its text, or removes them with `/setprefilter off`.
+    """
+    user_id = update.effective_user.id
+    if not context.args:
+        await update.message.reply_text(
+            "Usage: /setprefilter media:document,video max_size:20MB from:12345 forwarded:no album:no\n\n"
+            "media: takes text, photo, video, gif, audio, voice, sticker, document or other; "
+            "max_size:/min_size: a size in B, KB, MB or GB; from: sender ids; "
+            "forwarded: and album: 'no' or 'only'. All conditions must hold. /setprefilter off removes it."
+        )
+        return
+    if len(context.args) == 1 and context.args[0].lower() == "off":
+        configs.update(user_id, {"prefilter": None})
+        if await save_config(update.message, user_id):
+            await update.message.reply_text("Prefilter removed.")
+        return
+    try:
+        # Saved in the normalized form, so the userbot sees the same text /status shows.
+        text = describe_prefilter(parse_prefilter(" ".join(context.args)))
+    except PrefilterSyntaxError as e:
+        await update.message.reply_text(f"❌ Invalid prefilter: {e}. Please try again.")
+        return
+    configs.update(user_id, {"prefilter": text})
+    if await save_config(update.message, user_id):
+        await update.message.reply_text(f"Prefilter set: {text}")
+
+async def save_filter(update: Update, text):
+    """
+    Validates a filter rule and saves it together with mode 'filter'.
+    Invalid rules are rejected with the parse error, so the userbot only ever sees valid ones.
+    """
+    user_id = update.effective_user.id
+    try:
+        parse_filter(text)
+    except FilterSyntaxError as e:
+        await update.message.reply_text(f"❌ Invalid filter: {e}. Please try again.")
+        return False
+    configs.update(user_id, {"filter": text.strip(), "mode": "filter"})
+    # The fields stay queued if the write fails, so the filter input is done either way.
+    if await save_config(update.message, user_id):
+        await update.message.reply_text(f"Filter set: {text.strip()}. Mode set to 'filter'.")
+    return True
+
 async def handle_mode_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Handles callbacks from the 'set_mode' inline keyboard buttons.
@@ -97,25 +389,55 @@ async def handle_mode_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     """
     query = update.callback_query
     user_id = query.from_user.id
-    mode = query.data.replace("set_mode_", "") # Extracts 'all' or 'keywords' from the callback_data
+    mode = query.data.replace("set_mode_", "") # Extracts 'all', 'keywords', 'filter' or 'digest' from the callback_data
+
+    # Queue the mode for the user's row in the 'user_configs' table in Supabase.
+    # The upsert will insert a new row if user_id doesn't exist, or update it if it does.
+    configs.update(user_id, {"mode": mode})
+
+    # If "keywords" or "filter" mode is chosen, prompt the user to set keywords or the filter next.
+    # The mode is saved together with them, or after CONFIG_WRITE_DELAY seconds; the others are saved now.
+    if mode not in ("keywords", "filter") and not await save_config(query.message, user_id):
+        return
 
-    # Update the user's configuration in the 'user_configs' table in Supabase.
-    # The 'upsert' method will insert a new row if user_id doesn't exist, or update it if it does.
-    supabase.table("user_configs").upsert(
-        {"user_id": user_id, "mode": mode}
-    ).execute()
-    
     # Edit the original message to show the selected mode.
     await query.edit_message_text(f"Forwarding mode set to: '{mode}'.")
-    
-    # If "keywords" mode is chosen, prompt the user to set keywords next.
+
     if mode == "keywords":
         await context.bot.send_message(user_id, "Now, use /setkeywords to define your keywords.")
+    elif mode == "filter":
+        await context.bot.send_message(user_id, "Now, use /setfilter to define your filter.")
+    elif mode == "digest":
+        await context.bot.send_message(
+            user_id,
+            "Matching messages are now collected and posted as one summary with links. "
+            "Use /setkeywords to choose which messages go in (without keywords all do) and /setdigest to change how often it's posted."
+        )
+
+async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Handles text messages that are not commands, according to what the bot is awaiting.
+    """
+    if context.user_data.get("awaiting") == "filter":
+        await handle_filter_input(update, context)
+    else:
+        await handle_keywords_input(update, context)
+
+async def handle_filter_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Handles text messages when the bot is awaiting a filter rule.
+    The awaiting flag stays set until a valid rule arrives.
+    """
+    if update.message and update.message.text:
+        if await save_filter(update, update.message.text):
+            context.user_data["awaiting"] = None # Clear the awaiting flag as input has been received.
+    else:
+        await update.message.reply_text("Please send text for the filter.")
 
 async def handle_keywords_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Handles text messages specifically when the bot is awaiting keyword input.
-    Parses the input, stores keywords in Supabase, and ensures the mode is 'keywords'.
+    Parses the input, stores keywords in Supabase, and ensures the mode is 'keywords' (or stays 'digest').
     """
     user_id = update.effective_user.id
     
@@ -125,16 +447,15 @@ async def handle_keywords_input(update: Update, context: ContextTypes.DEFAULT_TY
         # Clean and split keywords: strip whitespace, convert to lowercase, and filter out empty strings.
         keywords_list = [k.strip().lower() for k in keywords_raw.split(',') if k.strip()]
         
-        # Update the keywords in Supabase for the current user.
-        supabase.table("user_configs").upsert(
-            {"user_id": user_id, "keywords": keywords_list}
-        ).execute()
-        
-        await update.message.reply_text(f"Keywords set: {', '.join(keywords_list)}. Mode set to 'keywords'.")
+        # Update the keywords for the current user, and explicitly ensure the mode is set to
+        # 'keywords' if keywords are provided this way. Both go to Supabase in one upsert.
+        # Digests pick their messages by keywords too, so a digest stays a digest.
+        config = await configs.get(user_id)
+        mode = "digest" if config and config.get("mode") == "digest" else "keywords"
+        configs.update(user_id, {"keywords": keywords_list, "mode": mode})
         context.user_data["awaiting"] = None # Clear the awaiting flag as input has been received.
-        
-        # Explicitly ensure the mode is set to 'keywords' if keywords are provided this way.
-        supabase.table("user_configs").upsert({"user_id": user_id, "mode": "keywords"}).execute()
+        if await save_config(update.message, user_id):
+            await update.message.reply_text(f"Keywords set: {', '.join(keywords_list)}. Mode set to '{mode}'.")
     
     # If awaiting keywords but a non-text message or empty text message is received.
     elif context.user_data.get("awaiting") == "keywords" and (not update.message or not update.message.text):
@@ -176,18 +497,16 @@ async def handle_forwarded_message(update: Update, context: ContextTypes.DEFAULT
     # Check the 'awaiting' flag to determine if the chat_id is for source or destination.
     if context.user_data.get("awaiting") == "source":
         # Store the source_id in Supabase for the current user.
-        supabase.table("user_configs").upsert(
-            {"user_id": user_id, "source_id": chat_id}
-        ).execute()
-        await message.reply_text("✅ Source chat set! Now use /setdestination.")
+        configs.update(user_id, {"source_id": chat_id})
         context.user_data["awaiting"] = None # Clear the awaiting flag.
+        if await save_config(message, user_id):
+            await message.reply_text("✅ Source chat set! Now use /setdestination.")
     elif context.user_data.get("awaiting") == "destination":
         # Store the destination_id in Supabase for the current user.
-        supabase.table("user_configs").upsert(
-            {"user_id": user_id, "destination_id": chat_id}
-        ).execute()
-        await message.reply_text("✅ Destination chat set! Your bot is now active.")
+        configs.update(user_id, {"destination_id": chat_id})
         context.user_data["awaiting"] = None # Clear the awaiting flag.
+        if await save_config(message, user_id):
+            await message.reply_text("✅ Destination chat set! Your bot is now active.")
     else:
         # If a forwarded message is received but the bot isn't expecting one for setup.
         await message.reply_text("Use /setsource or /setdestination first to tell me what to do with forwarded messages.")
@@ -201,32 +520,108 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     user_id = update.effective_user.id
     # Fetch the user's configuration from Supabase.
-    response = supabase.table("user_configs").select("*").eq("user_id", user_id).execute()
+    # Served from the row we last wrote when possible, including changes not saved yet.
+    config = await configs.get(user_id)
     
-    if response.data:
-        config = response.data[0] # Get the first (and only) configuration row for the user.
+    if config:
         mode = config.get('mode', 'all') # Get mode, default to 'all' if not set.
         # Format keywords for display: join them with commas or show "None" if empty.
         keywords = ", ".join(config.get('keywords', [])) if config.get('keywords') else "None"
+        # Additional routes beyond the primary source/destination pair, if any are configured.
+        extra_routes = config.get('routes') if isinstance(config.get('routes'), list) else []
+        # The latest backfills, with their progress as last saved by the userbot.
+        try:
+            jobs = await db.get_backfill_jobs(user_id, limit=BACKFILL_STATUS_JOBS)
+        except Exception as e:
+            logging.warning(f"Could not load backfill jobs for {user_id}: {e}")
+            jobs = []
         
         await update.message.reply_text(
             f"Current config:\n"
             f"Source Chat: {config.get('source_id', 'Not set')}\n"
             f"Destination Chat: {config.get('destination_id', 'Not set')}\n"
             f"Forwarding Mode: {mode}\n"
-            f"Keywords (if mode is 'keywords'): {keywords}"
+            f"Keywords (if mode is 'keywords'): {keywords}\n"
+            f"Filter (if mode is 'filter'): {config.get('filter') or 'None'}\n"
+            + (f"{describe_digest(config)}\n" if mode == "digest" else "") +
+            f"Prefilter: {config.get('prefilter') or 'None'}\n"
+            f"Additional Routes: {len(extra_routes)}"
+            + "".join(f"\n{describe_backfill(job)}" for job in jobs)
         )
     else:
         await update.message.reply_text("No configuration set. Use /setsource, /setdestination, /setmode.")
 
 
+async def backfill(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Handles the /backfill command.
+    Records a job in the 'backfill_jobs' table for the userbot to copy the source's existing messages
+    (all of them, or the latest N) to the destination. `/backfill cancel` stops the user's backfills.
+    """
+    user_id = update.effective_user.id
+    if context.args and context.args[0].lower() == "cancel":
+        jobs = await db.get_backfill_jobs(user_id, statuses=BACKFILL_ACTIVE_STATUSES)
+        for job in jobs:
+            await db.update_backfill_job(job["id"], {"status": "cancelled"})
+        if jobs:
+            # The userbot checks its jobs whenever it is told about a change.
+            await notifier.publish(user_id)
+        await update.message.reply_text(f"Cancelled {len(jobs)} backfill(s)." if jobs else "No backfill is running.")
+        return
+
+    max_messages = None
+    if context.args:
+        try:
+            max_messages = int(context.args[0])
+        except ValueError:
+            max_messages = 0
+        if max_messages <= 0:
+            await update.message.reply_text("Usage: /backfill to copy the whole history, /backfill 500 for the latest 500 messages, /backfill cancel to stop.")
+            return
+
+    config = await configs.get(user_id)
+    if not config or not config.get("source_id") or not config.get("destination_id"):
+        await update.message.reply_text("Set a source and destination first with /setsource and /setdestination.")
+        return
+    # The userbot filters the history with the saved mode, so save any pending change first.
+    if not await save_config(update.message, user_id):
+        return
+    source_id, destination_id = int(config["source_id"]), int(config["destination_id"])
+    active = await db.get_backfill_jobs(user_id, statuses=BACKFILL_ACTIVE_STATUSES)
+    if any(int(job["source_id"]) == source_id and int(job["destination_id"]) == destination_id for job in active):
+        await update.message.reply_text("A backfill from this source to this destination is already running. Check it with /status.")
+        return
+    await db.create_backfill_job(user_id, source_id, destination_id, max_messages)
+    await notifier.publish(user_id)
+    await update.message.reply_text(
+        f"Backfill queued: the userbot will copy {'the latest ' + str(max_messages) if max_messages else 'all'} message(s) "
+        f"from {source_id} to {destination_id}, oldest first, using your current mode.\n"
+        "Check progress with /status and stop it with /backfill cancel."
+    )
+
+def describe_digest(config):
+    """One /status line for the digest settings; unset values are the userbot's defaults."""
+    text = "Digest: " + (f"every {int(config['digest_interval']) // 60} minute(s)" if config.get("digest_interval") else "default interval")
+    if config.get("digest_max"):
+        text += f" or {config['digest_max']} message(s)"
+    return text
+
+def describe_backfill(job):
+    """One /status line for a backfill job."""
+    text = f"Backfill #{job['id']}: {job['status']}, {job.get('forwarded') or 0} of {job.get('scanned') or 0} scanned message(s) copied"
+    if job["status"] == "running" and job.get("rate"):
+        text += f" ({float(job['rate']):.1f} msg/s)"
+    if job["status"] == "failed" and job.get("error"):
+        text += f" - {job['error']}"
+    return text
+
 async def reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Handles the /reset command.
     Deletes the user's entire configuration from the 'user_configs' table in Supabase.
     """
     user_id = update.effective_user.id
-    supabase.table("user_configs").delete().eq("user_id", user_id).execute()
+    await configs.delete(user_id)
     await update.message.reply_text("Configuration reset. Start fresh with /setsource, /setdestination, /setmode.")
 
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -239,9 +634,13 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/start - Get started with the bot\n"
         "/setsource - Forward a message from the source chat (where messages will be copied from)\n"
         "/setdestination - Forward a message from the target chat (where messages will be sent to)\n"
-        "/setmode - Choose 'all' to forward all messages or 'keywords' to filter by keywords\n"
+        "/setmode - Choose 'all' to forward all messages, 'keywords' to filter by keywords, 'filter' for a filter rule or 'digest' for periodic summaries\n"
         "/setkeywords - Set keywords for 'keywords' mode (comma-separated)\n"
-        "/status - View your current forwarding configuration\n"
+        "/setfilter - Set a filter rule for 'filter' mode, e.g. crypto AND NOT airdrop\n"
+        "/setprefilter - Only consider messages with this media, size, sender or forward header, e.g. /setprefilter media:document max_size:20MB\n"
+        "/setdigest - Post matches as one summary every N minutes in 'digest' mode, e.g. /setdigest 60 50\n"
+        "/backfill - Copy the source's existing messages to the destination (/backfill 500 for the latest 500, /backfill cancel to stop)\n"
+        "/status - View your current forwarding configuration and backfill progress\n"
         "/reset - Clear all your configuration and start fresh\n"
         "/help - Show this guide"
     )
@@ -253,15 +652,34 @@ def main():
     """
     print("Initializing bot application...")
     # Create the Application instance using your bot token.
-    app = Application.builder().token(BOT_TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    # Keep what each user's setup flow is awaiting across restarts (and replicas, with Supabase).
+    if BOT_STATE == "sqlite":
+        builder.persistence(UserStatePersistence(SQLiteStateStore(BOT_STATE_PATH), update_interval=BOT_STATE_FLUSH_INTERVAL))
+    elif BOT_STATE == "supabase":
+        builder.persistence(UserStatePersistence(SupabaseStateStore(db), update_interval=BOT_STATE_FLUSH_INTERVAL))
+    app = builder.build()
     print("Adding handlers...")
 
+    # Group -1 runs before the other handlers without stopping them.
+    app.add_handler(TypeHandler(Update, log_first_update), group=-1)
+
     # Register Command Handlers: These respond to specific /commands.
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("setsource", set_source))
     app.add_handler(CommandHandler("setdestination", set_destination))
     app.add_handler(CommandHandler("setmode", set_mode))
     app.add_handler(CommandHandler("setkeywords", set_keywords))
+    app.add_handler(CommandHandler("setfilter", set_filter))
+    app.add_handler(CommandHandler("setdigest", set_digest))
+    app.add_handler(CommandHandler("setprefilter", set_prefilter))
+    app.add_handler(CommandHandler("backfill", backfill))
     app.add_handler(CommandHandler("status", status))
     app.add_handler(CommandHandler("reset", reset))
     app.add_handler(CommandHandler("help", help_cmd))
@@ -274,16 +692,20 @@ def main():
     app.add_handler(MessageHandler(filters.FORWARDED, handle_forwarded_message))
     
     # This handler processes text messages that are NOT commands.
-    # It's primarily used for capturing keyword input after /setkeywords.
-    app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), handle_keywords_input))
+    # It's used for capturing keyword input after /setkeywords and filter input after /setfilter.
+    app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), handle_text_input))
     
     # Register CallbackQueryHandler: This responds to interactions with inline keyboard buttons.
     # The pattern filters for callbacks that start with "set_mode_".
     app.add_handler(CallbackQueryHandler(handle_mode_callback, pattern="^set_mode_"))
     
     print("Bot is running. Waiting for messages...")
-    # Start the bot by polling for updates. This method will block and keep the bot running indefinitely.
-    app.run_polling()
+    if WEBHOOK_URL:
+        # Telegram delivers updates to our webhook server. Runs until the process is stopped.
+        asyncio.run(serve_webhook(app, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT))
+    else:
+        # Start the bot by polling for updates. This method will block and keep the bot running indefinitely.
+        app.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,131 @@
+# notify.py
+#
+# Config change notifications shared by the bot and the userbot.
+# The bot publishes a change after writing user_configs; the userbot subscribes and
+# reloads its config only when notified, instead of polling Supabase every minute.
+# This file is kept identical in telegram_bot/ and userbot/ since each is deployed on its own.
+
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_TOPIC = "user_configs"
+CHANGE_EVENT = "config_changed"
+
+
+class ConfigNotifier:
+    """
+    Interface for config change notifications.
+    Subscribers get called with the user_id whose configuration changed.
+    """
+
+    async def start(self):
+        """Connects the notifier. Returns True if change notifications are live."""
+        return True
+
+    async def publish(self, user_id):
+        raise NotImplementedError
+
+    def subscribe(self, callback):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class NullNotifier(ConfigNotifier):
+    """Disables notifications; the userbot falls back to polling."""
+
+    async def start(self):
+        return False
+
+    async def publish(self, user_id):
+        pass
+
+    def subscribe(self, callback):
+        pass
+
+
+class LocalNotifier(ConfigNotifier):
+    """
+    In-process notifier. Delivers changes to subscribers in the same process,
+    which is enough for tests, benchmarks and running both services in one process.
+    """
+
+    def __init__(self):
+        self._callbacks = []
+
+    async def publish(self, user_id):
+        for callback in list(self._callbacks):
+            callback(user_id)
+
+    def subscribe(self, callback):
+        self._callbacks.append(callback)
+
+
+class SupabaseNotifier(ConfigNotifier):
+    """
+    Notifier backed by a Supabase Realtime broadcast channel.
+    Broadcast messages never touch the database, so an idle userbot costs no queries.
+    """
+
+    def __init__(self, database):
+        self._database = database
+        self._channel = None
+        self._callbacks = []
+
+    async def start(self):
+        try:
+            client = await self._database.connect()
+            self._channel = client.channel(CHANNEL_TOPIC)
+            self._channel.on_broadcast(CHANGE_EVENT, self._on_broadcast)
+            await self._channel.subscribe()
+            logger.info(f"Subscribed to config change notifications on '{CHANNEL_TOPIC}'.")
+            return True
+        except Exception as e:
+            logger.warning(f"Could not subscribe to config change notifications: {e}. Falling back to polling.")
+            self._channel = None
+            return False
+
+    def _on_broadcast(self, message):
+        # Realtime wraps the broadcast body in an envelope: {"event": ..., "payload": {...}}
+        payload = message.get("payload", message) if isinstance(message, dict) else {}
+        user_id = payload.get("user_id")
+        if user_id is None:
+            return
+        for callback in list(self._callbacks):
+            callback(user_id)
+
+    async def publish(self, user_id):
+        if self._channel is None:
+            return
+        try:
+            await self._channel.send_broadcast(CHANGE_EVENT, {"user_id": user_id})
+        except Exception as e:
+            # Publishing is best effort: the userbot's safety poll still picks the change up.
+            logger.warning(f"Could not publish config change for User ID {user_id}: {e}")
+
+    def subscribe(self, callback):
+        self._callbacks.append(callback)
+
+    async def close(self):
+        if self._channel is not None:
+            try:
+                await self._channel.unsubscribe()
+            except Exception:
+                pass
+        self._channel = None
+
+
+def create_notifier(database):
+    """
+    Builds the notifier selected by the CONFIG_NOTIFIER env variable:
+    'supabase' (default), 'local' or 'none'. The Supabase notifier shares `database`'s client.
+    """
+    kind = os.getenv("CONFIG_NOTIFIER", "supabase").lower()
+    if kind == "supabase":
+        return SupabaseNotifier(database)
+    if kind == "local":
+        return LocalNotifier()
+    return NullNotifier()
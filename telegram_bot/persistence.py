@@ -0,0 +1,212 @@
+# telegram_bot/persistence.py
+#
+# Keeps the per-user state of the setup flow (what the bot is awaiting) outside the process,
+# so a restart doesn't lose a half-finished /setsource and several bot replicas can take
+# turns handling one user's updates.
+
+import asyncio
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStateStore:
+    """
+    User state in a local SQLite file. Only this process writes it, so a user's state
+    is read once and then served from memory.
+    """
+
+    shared = False
+
+    def __init__(self, path):
+        self._path = path
+        # sqlite3 connections must stay on one thread, so all disk work goes through this executor.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bot-state")
+        self._db = None
+
+    def _open(self):
+        self._db = sqlite3.connect(self._path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS user_state (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+        self._db.commit()
+
+    def _load(self, user_id):
+        if self._db is None:
+            self._open()
+        row = self._db.execute("SELECT data FROM user_state WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _save(self, rows):
+        if self._db is None:
+            self._open()
+        self._db.executemany(
+            "INSERT INTO user_state (user_id, data) VALUES (?, ?) ON CONFLICT (user_id) DO UPDATE SET data = excluded.data",
+            [(user_id, data) for user_id, data in rows.items() if data is not None],
+        )
+        self._db.executemany("DELETE FROM user_state WHERE user_id = ?", [(user_id,) for user_id, data in rows.items() if data is None])
+        self._db.commit()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def load(self, user_id):
+        """Returns the stored state of `user_id` as a dict, or None if there is none."""
+        return await self._run(self._load, user_id)
+
+    async def save(self, rows):
+        """Writes {user_id: JSON text, or None to delete} in one transaction."""
+        await self._run(self._save, rows)
+
+    async def close(self):
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+
+
+class SupabaseStateStore:
+    """
+    User state in the Supabase 'bot_state' table (user_id bigint primary key, data jsonb),
+    shared by all bot replicas. A user's state is read again before each of their updates,
+    since another replica may have changed it.
+    """
+
+    shared = True
+
+    def __init__(self, database):
+        self._database = database
+
+    async def load(self, user_id):
+        table = await self._database.table("bot_state")
+        rows = await self._database.execute(table.select("data").eq("user_id", user_id))
+        return rows[0]["data"] if rows else None
+
+    async def save(self, rows):
+        table = await self._database.table("bot_state")
+        upserts = [{"user_id": user_id, "data": json.loads(data)} for user_id, data in rows.items() if data is not None]
+        if upserts:
+            await self._database.execute(table.upsert(upserts))
+        deletes = [user_id for user_id, data in rows.items() if data is None]
+        if deletes:
+            table = await self._database.table("bot_state")
+            await self._database.execute(table.delete().in_("user_id", deletes))
+
+    async def close(self):
+        pass
+
+
+class UserStatePersistence(BasePersistence):
+    """
+    PTB persistence for user_data only, over a SQLite or Supabase store.
+
+    Nothing is loaded up front: a user's state is fetched right before their update is
+    handled (once, or every time for a shared store). PTB hands over changed user_data
+    every `update_interval` seconds; the changes are buffered and written in one batch per
+    interval, so handlers never wait on a write, and users whose state didn't change aren't
+    written at all. A crash loses at most one interval of state changes.
+    """
+
+    def __init__(self, store, update_interval=1.0, cache_size=10000):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False), update_interval=update_interval)
+        self._store = store
+        # user_id -> JSON text of the state last read or written, to skip unchanged writes.
+        self._known = TTLCache(maxsize=cache_size, ttl=float("inf") if not store.shared else 3600.0)
+        # user_id -> JSON text to write, or None to delete.
+        self._dirty = {}
+        self._flush_task = None
+
+    async def get_user_data(self):
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        # Unwritten local changes are newer than anything in the store.
+        if user_id in self._dirty or (not self._store.shared and user_id in self._known):
+            return
+        try:
+            data = await self._store.load(user_id)
+        except Exception as e:
+            logger.warning(f"Could not load state of user {user_id}: {e}. Using the state in memory.")
+            return
+        self._known.set(user_id, json.dumps(data or {}, sort_keys=True))
+        if data is not None:
+            user_data.clear()
+            user_data.update(data)
+
+    async def update_user_data(self, user_id, data):
+        text = json.dumps(data, sort_keys=True, default=str)
+        if self._known.get(user_id) == text:
+            return
+        self._known.set(user_id, text)
+        self._dirty[user_id] = text
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        self._known.invalidate(user_id)
+        self._dirty[user_id] = None
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        # PTB hands over all changed users of an interval back to back; they're written together.
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._write())
+
+    async def _write(self):
+        try:
+            while self._dirty:
+                dirty, self._dirty = self._dirty, {}
+                try:
+                    await self._store.save(dirty)
+                except Exception as e:
+                    logger.error(f"Could not save state of {len(dirty)} user(s): {e}. Retrying with the next changes.")
+                    for user_id, text in dirty.items():
+                        self._dirty.setdefault(user_id, text)
+                    return
+        finally:
+            self._flush_task = None
+
+    async def flush(self):
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._write()
+        await self._store.close()
+
+    # Only user_data is persisted; PTB doesn't call the rest with the store_data above.
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
@@ -0,0 +1,117 @@
+# telegram_bot/test_webhook.py
+#
+# Tests of the webhook server and the per-user update processor, without Telegram.
+# Run from the telegram_bot directory: python3 -m unittest test_webhook (or pytest)
+
+import asyncio
+import json
+import time
+import unittest
+from types import SimpleNamespace
+
+from telegram import Update
+
+from webhook import SECRET_HEADER, PerUserUpdateProcessor, WebhookServer
+
+SECRET = "s3cret-token_1"
+PATH = "/telegram"
+
+
+def make_update(update_id, user_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "user"},
+            "text": "hello",
+        },
+    }
+
+
+async def request(port, method, path, headers=None, body=b""):
+    """Sends one HTTP request to the local server and returns the status code."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    lines = [f"{method} {path} HTTP/1.1", "Host: localhost", f"Content-Length: {len(body)}"]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    writer.close()
+    return int(status_line.split()[1])
+
+
+class WebhookServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.application = SimpleNamespace(running=True, bot=None, update_queue=asyncio.Queue())
+        self.server = WebhookServer(self.application, PATH, SECRET, host="127.0.0.1", port=0)
+        await self.server.start()
+        self.port = self.server._server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def post(self, headers):
+        return await request(self.port, "POST", PATH, headers, json.dumps(make_update(1, 42)).encode())
+
+    async def test_update_with_the_secret_token_is_queued(self):
+        self.assertEqual(await self.post({SECRET_HEADER: SECRET, "Content-Type": "application/json"}), 200)
+        update = self.application.update_queue.get_nowait()
+        self.assertEqual(update.effective_user.id, 42)
+        self.assertEqual(self.server.metrics, {"updates": 1, "rejected": 0})
+
+    async def test_update_with_a_wrong_or_missing_token_is_rejected(self):
+        self.assertEqual(await self.post({SECRET_HEADER: "wrong"}), 403)
+        self.assertEqual(await self.post({}), 403)
+        self.assertTrue(self.application.update_queue.empty())
+        self.assertEqual(self.server.metrics, {"updates": 0, "rejected": 2})
+
+    async def test_health_and_unknown_paths(self):
+        self.assertEqual(await request(self.port, "GET", "/healthz"), 200)
+        self.application.running = False
+        self.assertEqual(await request(self.port, "GET", "/healthz"), 503)
+        self.assertEqual(await request(self.port, "GET", PATH), 405)
+        self.assertEqual(await request(self.port, "POST", "/other"), 404)
+
+
+class PerUserUpdateProcessorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_a_users_burst_does_not_hold_up_other_users(self):
+        processor = PerUserUpdateProcessor(2)
+        handled = []
+        finished = {}
+        started = time.monotonic()
+
+        async def handle(update_id, user_id):
+            await asyncio.sleep(0.1)
+            handled.append((user_id, update_id))
+            finished[update_id] = time.monotonic() - started
+
+        tasks = [
+            asyncio.ensure_future(processor.process_update(Update.de_json(make_update(i, 1), None), handle(i, 1)))
+            for i in range(1, 7)
+        ]
+        tasks.append(asyncio.ensure_future(processor.process_update(Update.de_json(make_update(100, 2), None), handle(100, 2))))
+        await asyncio.gather(*tasks)
+
+        # User 1's updates run one after another, in order; user 2's runs alongside the first of them.
+        self.assertEqual([update_id for user_id, update_id in handled if user_id == 1], [1, 2, 3, 4, 5, 6])
+        self.assertLess(finished[100], 0.2)
+        self.assertEqual(processor.current_concurrent_updates, 0)
+        self.assertEqual(processor._tails, {})
+
+    async def test_concurrency_limit_applies_across_users(self):
+        processor = PerUserUpdateProcessor(2)
+        peak = 0
+
+        async def handle():
+            nonlocal peak
+            peak = max(peak, processor.current_concurrent_updates)
+            await asyncio.sleep(0.02)
+
+        await asyncio.gather(*(processor.process_update(Update.de_json(make_update(i, i), None), handle()) for i in range(1, 9)))
+        self.assertEqual(peak, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,222 @@
+# telegram_bot/webhook.py
+#
+# Webhook mode: Telegram POSTs every update to a small HTTP server embedded in the bot,
+# instead of the bot long-polling getUpdates. Several replicas can then run behind one
+# load balancer, since any of them can take any update.
+
+import asyncio
+import hmac
+import json
+import logging
+import signal
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Telegram updates are a few kilobytes; anything much larger isn't one.
+MAX_BODY_SIZE = 1024 * 1024
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+# Concurrency given to BaseUpdateProcessor's own semaphore; PerUserUpdateProcessor applies the real limit.
+UNBOUNDED = 2 ** 31
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes up to `max_concurrent_updates` updates at once, but one at a time per user.
+
+    Different users' setup flows run in parallel, while a user's own updates keep their order:
+    the handlers keep what they are waiting for (a chat, keywords, a filter) in user_data,
+    so a message handled before the command that preceded it would land in the wrong step.
+
+    BaseUpdateProcessor holds its semaphore around do_process_update(), so a user's queued
+    updates would occupy slots while waiting for their turn and stall everyone else. Its
+    semaphore is therefore left unbounded; an update waits for the user's previous one first
+    and only then takes one of the `max_concurrent_updates` slots.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        # BaseUpdateProcessor sizes its semaphore from the max_concurrent_updates property.
+        self._limit = UNBOUNDED
+        super().__init__(UNBOUNDED)
+        self._limit = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._running = 0
+        # user_id -> future resolved when the user's latest update is done
+        self._tails = {}
+
+    @property
+    def max_concurrent_updates(self):
+        return self._limit
+
+    @property
+    def current_concurrent_updates(self):
+        return self._running
+
+    async def _run(self, coroutine):
+        async with self._slots:
+            self._running += 1
+            try:
+                await coroutine
+            finally:
+                self._running -= 1
+
+    async def do_process_update(self, update, coroutine):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await self._run(coroutine)
+            return
+        previous = self._tails.get(user.id)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[user.id] = done
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            await self._run(coroutine)
+        finally:
+            if previous is not None and not previous.done():
+                # Cancelled while waiting: the next update must still wait for the previous one.
+                previous.add_done_callback(lambda _: done.done() or done.set_result(None))
+            else:
+                done.set_result(None)
+            if self._tails.get(user.id) is done and done.done():
+                del self._tails[user.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+class WebhookServer:
+    """
+    Minimal HTTP server for Telegram's webhook requests.
+
+    POST `path` with the right secret token header queues the update on the application
+    and answers at once, so Telegram never waits for a handler. GET /healthz answers 200
+    while the application is running and 503 otherwise, for the platform's health checks.
+    """
+
+    def __init__(self, application, path, secret_token, host="0.0.0.0", port=8080):
+        self._application = application
+        self._path = path
+        self._secret_token = secret_token.encode()
+        self._host = host
+        self._port = port
+        self._server = None
+        self.metrics = {"updates": 0, "rejected": 0}
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self._host, self._port)
+        logger.info(f"Webhook server listening on http://{self._host}:{self._port}{self._path}")
+
+    async def _read_request(self, reader):
+        """Returns (method, path, headers, body) of the next request; raises ValueError if it is malformed."""
+        request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+        parts = request_line.decode("latin-1").split()
+        if len(parts) < 2:
+            raise ValueError("malformed request line")
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=10)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        method, path = parts[0], parts[1].split("?")[0]
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY_SIZE:
+            return method, path, headers, None
+        body = await asyncio.wait_for(reader.readexactly(length), timeout=10) if length else b""
+        return method, path, headers, body
+
+    def _respond(self, method, path, headers, body):
+        """Returns (status, response body) and queues the update if the request carries one."""
+        if path == "/healthz" and method in ("GET", "HEAD"):
+            if self._application.running:
+                return "200 OK", b"ok\n"
+            return "503 Service Unavailable", b"starting\n"
+        if path != self._path:
+            return "404 Not Found", b"Not Found\n"
+        if method != "POST":
+            return "405 Method Not Allowed", b"Method Not Allowed\n"
+        # Only Telegram knows the secret, so requests without it are forged.
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, "").encode(), self._secret_token):
+            self.metrics["rejected"] += 1
+            return "403 Forbidden", b"Forbidden\n"
+        if body is None:
+            return "413 Payload Too Large", b"Payload Too Large\n"
+        try:
+            update = Update.de_json(json.loads(body), self._application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Ignoring malformed webhook update: {e}")
+            return "400 Bad Request", b"Bad Request\n"
+        self._application.update_queue.put_nowait(update)
+        self.metrics["updates"] += 1
+        return "200 OK", b""
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                status, body = self._respond(*await self._read_request(reader))
+            except ValueError:
+                status, body = "400 Bad Request", b"Bad Request\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+async def serve_webhook(application, url, path, secret_token, host, port):
+    """
+    Runs `application` in webhook mode until SIGINT or SIGTERM, with the same lifecycle as
+    `run_polling`: initialize, post_init, start, then stop, post_stop, shutdown, post_shutdown.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    server = WebhookServer(application, path, secret_token, host=host, port=port)
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        # Telegram answers webhook calls for this bot at `url` from now on; polling stops working.
+        await application.bot.set_webhook(
+            url=url.rstrip("/") + path,
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=100,
+        )
+        logger.info(f"Webhook set to {url.rstrip('/')}{path}")
+        await stop.wait()
+    finally:
+        await server.close()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        logger.info(f"Webhook server stopped after {server.metrics['updates']} updates ({server.metrics['rejected']} rejected).")
@@ -0,0 +1,726 @@
+# userbot/account.py
+
+import asyncio
+import logging
+import time
+
+from telethon import events
+from telethon.errors import FloodWaitError, MessageIdInvalidError, MessageNotModifiedError
+
+import settings
+from backfill import BackfillRunner
+from batching import ForwardBatcher
+from copier import MediaTooLargeError, MessageCopier
+from dedup import DedupWindow, fingerprint
+from digest import DigestBuffer
+from journal import ForwardJournal
+from metrics import LATENCY_BUCKETS, MATCH_TIME_BUCKETS, MetricsRegistry, SampledLog
+from msgmap import MessageMap
+from peers import STALE_PEER_ERRORS, PeerCache
+from routes import Route, RouteTable
+from sender import SendQueue
+
+logger = logging.getLogger(__name__)
+
+ROUTE_LABELS = ("source", "destination")
+
+
+class SessionNotAuthorizedError(Exception):
+    pass
+
+
+class _AccountLog(logging.LoggerAdapter):
+    """Prefixes log lines with the account name when several accounts share a process."""
+
+    def process(self, msg, kwargs):
+        if self.extra.get("account"):
+            return f"[{self.extra['account']}] {msg}", kwargs
+        return msg, kwargs
+
+
+class Userbot:
+    """
+    One forwarding account: a logged-in TelegramClient with its own routes, journal,
+    batcher, send queue and metrics.
+
+    Nothing is shared with other Userbot instances except the database and the config
+    notifier, so several accounts can run on one event loop without a flood wait or a
+    crash in one of them affecting the others.
+    """
+
+    def __init__(self, client, database, notifier, journal_path, account=None, metrics=None):
+        self.client = client
+        self.account = account
+        self._db = database
+        self._notifier = notifier
+        self._journal_path = journal_path
+        self.log = _AccountLog(logger, {"account": account})
+        # Flood waits are handled by the send queue, which pauses only the affected destination,
+        # instead of Telethon silently sleeping inside the request.
+        self.client.flood_sleep_threshold = 0
+        # Re-sends messages for routes with copy delivery.
+        self.copier = MessageCopier(client, max_buffer=settings.COPY_MAX_BUFFER)
+        # InputPeers of the routes' chats, resolved when a route is added.
+        self.peers = PeerCache(client)
+
+        # Set when the bot reports a change of this account's config.
+        self._config_changed = asyncio.Event()
+        self.user_id = None
+        # All forwarding routes of this account, indexed by source chat id.
+        self.route_table = RouteTable()
+        # Last forwarded message id per route. Opened in run() once the user ID is known.
+        self.journal = None
+        # Destination message of every forwarded source message, for edits and deletions. Opened in serve(); None when disabled.
+        self.message_map = None
+        # Messages collected for the next digest of each digest route. Opened in serve().
+        self.digest = None
+        # Live messages that arrive while the startup catch-up is running, keyed by source chat.
+        # Set to None once the account has caught up and forwards live.
+        self._catchup_buffer = {}
+        # Per-message log lines go through this gate so busy channels don't spend their time formatting logs.
+        self._message_log = SampledLog(self.log, every=settings.MESSAGE_LOG_EVERY)
+
+        self.send_queue = SendQueue(
+            self.forward_batch,
+            rate_per_destination=settings.SEND_RATE_PER_DESTINATION,
+            burst=settings.SEND_BURST,
+            global_rate=settings.SEND_RATE_GLOBAL,
+            max_backlog=settings.SEND_MAX_BACKLOG,
+            on_failure=self.forward_failed,
+        )
+        self.batcher = ForwardBatcher(self.send_queue.put, window=settings.FORWARD_BATCH_WINDOW)
+        # Drops content that was already sent to the same destination recently. None when disabled.
+        self.dedup = None
+        if settings.DEDUP_WINDOW > 0:
+            self.dedup = DedupWindow(settings.DEDUP_WINDOW, ttl=settings.DEDUP_TTL, max_distance=settings.DEDUP_NEAR_DISTANCE)
+        # Fingerprints of queued messages, (destination_id, source_id, message id) -> Fingerprint,
+        # taken out of the window again if their batch is never delivered.
+        self._unsent_fingerprints = {}
+
+        # Copies existing history for the bot's /backfill jobs.
+        self.backfill = BackfillRunner(self, database, prefetch_pages=settings.BACKFILL_PREFETCH_PAGES,
+                                       checkpoint_interval=settings.BACKFILL_CHECKPOINT_INTERVAL)
+
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self._register_metrics()
+        self._notifier.subscribe(self.on_config_changed)
+
+    def _register_metrics(self):
+        # Per-route metrics are labelled with the route's source and destination.
+        metrics = self.metrics
+        self._messages_seen = metrics.counter("userbot_messages_seen_total", "Messages received for a route.", ROUTE_LABELS)
+        self._messages_forwarded = metrics.counter("userbot_messages_forwarded_total", "Messages forwarded or copied along a route.", ROUTE_LABELS)
+        self._messages_skipped = metrics.counter("userbot_messages_skipped_total", "Messages rejected by a route's keywords or filter.", ROUTE_LABELS)
+        self._prefilter_rejected = metrics.counter("userbot_prefilter_rejected_total", "Messages rejected by a route's prefilter, by the stage that rejected them.", ROUTE_LABELS + ("stage",))
+        self._keyword_match_seconds = metrics.histogram("userbot_keyword_match_seconds", "Time to match a message against a route's keywords or filter.", MATCH_TIME_BUCKETS, ROUTE_LABELS)
+        self._forward_latency_seconds = metrics.histogram("userbot_forward_latency_seconds", "Time from a message's post date to the completed forward.", LATENCY_BUCKETS, ROUTE_LABELS)
+        self._config_reloads = metrics.counter("userbot_config_reloads_total", "Configuration loads that changed the routes.")
+        self._messages_duplicate = metrics.counter("userbot_messages_duplicate_total", "Messages dropped as repeats of content recently sent to the destination.", ROUTE_LABELS)
+
+        send_queue = self.send_queue
+        metrics.collected("gauge", "userbot_send_queue_depth", "Batches waiting to be sent, per destination.",
+                          lambda: {(destination_id,): depth for destination_id, depth in send_queue.destination_depths().items()}, ("destination",))
+        metrics.collected("counter", "userbot_flood_wait_seconds_total", "Seconds spent in flood waits, per destination.",
+                          lambda: {(destination_id,): seconds for destination_id, seconds in send_queue.destination_flood_wait_seconds.items()}, ("destination",))
+        metrics.collected("gauge", "userbot_routes", "Configured forwarding routes.", lambda: {(): len(self.route_table)})
+        for name, help in (
+            ("enqueued", "Batches queued for sending."),
+            ("sent_batches", "Batches sent."),
+            ("retries", "Send retries after transient errors."),
+            ("failed_batches", "Batches given up on."),
+            ("backlog_full_waits", "Times a full destination backlog held back new batches."),
+        ):
+            metrics.collected("counter", f"userbot_send_{name}_total", help, lambda name=name: {(): send_queue.metrics[name]})
+        for name, help in (
+            ("reused_media", "Media copied by reference, without a download."),
+            ("reuploaded_media", "Media downloaded and uploaded again by copy routes."),
+            ("too_large", "Media too large for the copy buffer."),
+        ):
+            metrics.collected("counter", f"userbot_copy_{name}_total", help, lambda name=name: {(): self.copier.metrics[name]})
+        metrics.collected("gauge", "userbot_peer_cache_entries", "Chats with a resolved InputPeer.", lambda: {(): len(self.peers)})
+        for name, help in (
+            ("hits", "Sends and history reads that used a cached InputPeer."),
+            ("misses", "Sends and history reads of chats that were not resolved."),
+            ("invalidations", "Cached InputPeers dropped after an error."),
+        ):
+            metrics.collected("counter", f"userbot_peer_cache_{name}_total", help, lambda name=name: {(): self.peers.metrics[name]})
+        metrics.collected("gauge", "userbot_backfill_jobs_running", "History backfills in progress.", lambda: {(): self.backfill.running})
+        for name, help in (
+            ("scanned", "History messages read by backfills."),
+            ("forwarded", "History messages forwarded or copied by backfills."),
+        ):
+            metrics.collected("counter", f"userbot_backfill_{name}_total", help, lambda name=name: {(): self.backfill.metrics[name]})
+        for name, help in (
+            ("recorded", "Forwarded messages recorded in the message map."),
+            ("found", "Edited or deleted source messages found in the message map."),
+            ("purged", "Message map entries dropped after the retention window."),
+        ):
+            metrics.collected("counter", f"userbot_message_map_{name}_total", help,
+                              lambda name=name: {(): self.message_map.metrics[name] if self.message_map is not None else 0})
+        metrics.collected("gauge", "userbot_digest_pending_messages", "Messages collected for digests not posted yet.",
+                          lambda: {(): len(self.digest) if self.digest is not None else 0})
+        for name, help in (
+            ("added", "Messages collected for digests."),
+            ("digests", "Digests posted."),
+            ("posted", "Messages summarized in posted digests."),
+        ):
+            metrics.collected("counter", f"userbot_digest_{name}_total", help,
+                              lambda name=name: {(): self.digest.metrics[name] if self.digest is not None else 0})
+        if self.dedup is not None:
+            metrics.collected("gauge", "userbot_dedup_entries", "Fingerprints held in the duplicate window.", lambda: {(): len(self.dedup)})
+            metrics.collected("counter", "userbot_dedup_evictions_total", "Fingerprints evicted before expiring because the window was full.",
+                              lambda: {(): self.dedup.metrics["evictions"]})
+
+    def on_config_changed(self, user_id):
+        """
+        Notifier callback. Wakes fetch_config when the bot reports a change for this account's user.
+        """
+        if self.user_id is not None and str(user_id) == str(self.user_id):
+            self._config_changed.set()
+
+    def listen_to_sources(self, sources):
+        """
+        (Re)registers the message handlers for exactly the given source chats, so Telethon drops
+        messages from every other chat before any of our handler code runs.
+        """
+        self.client.remove_event_handler(self.handler)
+        self.client.remove_event_handler(self.album_handler)
+        self.client.remove_event_handler(self.edit_handler)
+        self.client.remove_event_handler(self.delete_handler)
+        if sources:
+            chats = sorted(sources)
+            self.client.add_event_handler(self.handler, events.NewMessage(chats=chats))
+            self.client.add_event_handler(self.album_handler, events.Album(chats=chats))
+            if settings.MESSAGE_MAP_RETENTION_DAYS > 0:
+                self.client.add_event_handler(self.edit_handler, events.MessageEdited(chats=chats))
+                self.client.add_event_handler(self.delete_handler, events.MessageDeleted(chats=chats))
+
+    async def load_config(self):
+        """
+        Fetches the forwarding configuration (routes with their source, destination, mode, keywords)
+        for this account from Supabase once, and applies it if anything changed.
+        """
+        config = await self._db.get_config(self.user_id)
+
+        if config:
+            new_table = RouteTable.from_config(config, previous=self.route_table)
+
+            # Check if any route has changed before updating and logging.
+            if new_table.signature != self.route_table.signature:
+                old_signatures = self.route_table.signature
+                new_routes = [route for route in new_table.routes if route.signature not in old_signatures]
+                # Resolve the chats of new routes before their handlers go live, which also verifies
+                # the account's access to them. Chats resolved before are not fetched again.
+                failures = await self.peers.warm([chat_id for route in new_routes for chat_id in (route.source_id, route.destination_id)])
+                self.route_table = new_table
+                self.peers.retain(self.route_table.sources | self.route_table.destinations)
+                self.listen_to_sources(self.route_table.sources)
+                self._config_reloads.inc()
+
+                self.log.info(f"Configuration loaded/updated for User ID {self.user_id}: {len(self.route_table)} route(s)")
+                for route in self.route_table.routes:
+                    self.log.info(f" Route: {route}")
+
+                for route in new_routes:
+                    error = failures.get(route.source_id) or failures.get(route.destination_id)
+                    if error is not None:
+                        self.log.error(f"Cannot access chats (Source: {route.source_id}, Destination: {route.destination_id}): {error}. Ensure userbot is member of both chats and IDs are correct.")
+                        continue
+                    self.log.info(f"Access to Source Chat {route.source_id} and Destination Chat {route.destination_id} verified.")
+                    try:
+                        await self.start_checkpoint(route)
+                    except Exception as e:
+                        self.log.error(f"Cannot read Source Chat {route.source_id}: {e}. Messages posted while the userbot is down may be missing.")
+        else:
+            # If response.data is empty, means no config in DB for this user.
+            # Reset the routes to the awaiting setup state.
+            if self.route_table:
+                self.log.warning("Configuration not found in database. Resetting current config to awaiting setup...")
+                self.route_table = RouteTable()
+                self.peers.retain(())
+                self.listen_to_sources(self.route_table.sources)
+                self._config_reloads.inc()
+
+    async def fetch_config(self, poll_interval=settings.CONFIG_FALLBACK_POLL_INTERVAL):
+        """
+        Keeps the account's configuration up-to-date.
+        This runs as a continuous background task. It reloads the configuration
+        whenever a change notification arrives, and every `poll_interval` seconds as a safety net.
+        """
+        while True:
+            # Sleep until the bot publishes a change or the safety-net poll is due.
+            try:
+                await asyncio.wait_for(self._config_changed.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            # Cleared before the select so a change published mid-fetch triggers another reload.
+            self._config_changed.clear()
+
+            try:
+                if self.user_id:
+                    await self.load_config()
+                    await self.backfill.poll()
+                else:
+                    self.log.info("Userbot ID not yet available, skipping config fetch for now...")
+            except Exception as e:
+                # Added exc_info=True to print the full traceback
+                self.log.error(f"Error fetching config for User ID {self.user_id}: {e}. Contact @DaHormes for help.", exc_info=True)
+
+    async def forward_batch(self, route, messages):
+        """
+        Delivers a coalesced batch of messages along `route`: forwarded with a single API call,
+        or re-sent by the copier on copy routes (one message or album per batch).
+        """
+        message_ids = [message.id for message in messages]
+        # Marked in flight for this attempt only: a batch waiting for a retry is not being sent.
+        if self.journal is not None:
+            try:
+                await self.journal.begin(route, max(message_ids))
+            except Exception as e:
+                self.log.error(f"Error writing forward journal: {e}. These messages may be forwarded again if the userbot stops mid-send.")
+        try:
+            await self.deliver(route, messages, message_ids)
+        except MediaTooLargeError as e:
+            # Retrying won't make it fit; skip it so the route keeps moving.
+            self.log.error(f"Cannot copy {len(messages)} message(s) from {route.source_id} to {route.destination_id}: {e}. Raise COPY_MAX_BUFFER or use forward delivery.")
+            self.forward_failed(route, messages)
+            if self.journal is not None:
+                self.journal.record(route, max(message_ids))
+            return
+        except Exception:
+            # Not sent: withdraw the mark, so a restart before the retry forwards the batch instead of skipping it.
+            if self.journal is not None:
+                try:
+                    await self.journal.abort(route)
+                except Exception as e:
+                    self.log.error(f"Error writing forward journal: {e}. These messages are not forwarded again if the userbot stops before they are sent.")
+            raise
+        # Recorded only once sent. Nothing from here on may raise, or the send queue would send the batch again.
+        if self.journal is not None:
+            self.journal.record(route, max(message_ids))
+        for message_id in message_ids:
+            self._unsent_fingerprints.pop((route.destination_id, route.source_id, message_id), None)
+        self.observe_forwarded(route, messages)
+        if self._message_log.enabled():
+            verb = "Copied" if route.delivery == "copy" else "Forwarded"
+            self.log.info(f"{verb} {len(message_ids)} message(s) from {route.source_id} to {route.destination_id}")
+
+    def forward_failed(self, route, messages):
+        """Lets the content of an undelivered batch through again, so a later repost isn't dropped as its duplicate."""
+        for message in messages:
+            content = self._unsent_fingerprints.pop((route.destination_id, route.source_id, message.id), None)
+            if content is not None:
+                self.dedup.forget(route.destination_id, content)
+
+    async def deliver(self, route, messages, message_ids):
+        """
+        Forwards or copies `messages` along `route` in one call, resolving stale peers once,
+        and records the sent messages in the message map.
+        """
+        try:
+            sent = await self._send(route, messages, message_ids)
+        except STALE_PEER_ERRORS as e:
+            # A cached peer may have gone stale (new access hash, migrated group): resolve the
+            # route's chats again and retry once. If they were never cached, retrying won't help.
+            if route.source_id not in self.peers and route.destination_id not in self.peers:
+                raise
+            self.log.warning(f"Resolving chats of route {route} again after: {e}")
+            self.peers.invalidate(route.source_id, route.destination_id)
+            await self.peers.resolve(route.source_id)
+            await self.peers.resolve(route.destination_id)
+            sent = await self._send(route, messages, message_ids)
+        if self.message_map is not None and sent:
+            self.message_map.record(route, messages, sent)
+
+    async def _send(self, route, messages, message_ids):
+        """Returns the sent messages, in the order of `messages` (None for one that wasn't sent)."""
+        destination = self.peers.get(route.destination_id)
+        if route.delivery == "copy":
+            sent = await self.copier.copy(destination, messages)
+        else:
+            sent = await self.client.forward_messages(destination, message_ids, from_peer=self.peers.get(route.source_id))
+        if sent is None or isinstance(sent, list):
+            return sent
+        return [sent]
+
+    def observe_forwarded(self, route, messages):
+        """Counts a delivered batch and records each message's end-to-end latency."""
+        labels = (route.source_id, route.destination_id)
+        self._messages_forwarded.inc(*labels, amount=len(messages))
+        now = time.time()
+        for message in messages:
+            if message.date is not None:
+                self._forward_latency_seconds.observe(max(0.0, now - message.date.timestamp()), *labels)
+
+    async def dispatch(self, chat_id, messages, message_text):
+        """
+        Queues a message (or a whole album) for every route whose source is `chat_id`
+        and whose mode accepts `message_text`.
+        """
+        # Hold live messages back until the catch-up has forwarded everything older.
+        if self._catchup_buffer is not None:
+            self._catchup_buffer.setdefault(chat_id, []).append((messages, message_text))
+            return
+
+        # One dict lookup, however many routes are configured.
+        routes = self.route_table.lookup(chat_id)
+        if routes:
+            await self.route_message(routes, messages, message_text)
+
+    async def route_message(self, routes, messages, message_text):
+        """
+        Queues a message (or a whole album) for each of `routes` whose prefilter admits it and
+        whose mode accepts `message_text`.
+        """
+        # Prefilters only read fields the message came with, so a message no route admits
+        # is dropped before its text is fingerprinted or matched.
+        admitted = []
+        for route in routes:
+            labels = (route.source_id, route.destination_id)
+            self._messages_seen.inc(*labels, amount=len(messages))
+            stage = route.admits(messages)
+            if stage is None:
+                admitted.append(route)
+            else:
+                self._prefilter_rejected.inc(*labels, stage, amount=len(messages))
+                if self._message_log.enabled():
+                    self.log.info(f"Skipped message from {route.source_id} to {route.destination_id} (Prefilter: {stage})")
+        if not admitted:
+            return
+        # Fingerprinted once for all routes, and only if duplicates are being dropped.
+        content = fingerprint(messages, near=self.dedup.near) if self.dedup is not None else None
+        for route in admitted:
+            labels = (route.source_id, route.destination_id)
+            try:
+                # Check forwarding mode
+                if route.mode == "all":
+                    await self.enqueue(route, messages, content)
+                elif route.mode == "keywords" and route.matcher:
+                    # Single pass over the text for all keywords (case-insensitive)
+                    started = time.perf_counter()
+                    hits = route.matcher.find(message_text)
+                    self._keyword_match_seconds.observe(time.perf_counter() - started, *labels)
+                    if hits and await self.enqueue(route, messages, content):
+                        if self._message_log.enabled():
+                            self.log.info(f"Queued message from {route.source_id} to {route.destination_id} (Mode: Keywords - Matched: {', '.join(hits)})")
+                    elif not hits:
+                        self._messages_skipped.inc(*labels, amount=len(messages))
+                        if self._message_log.enabled():
+                            self.log.info(f"Skipped message from {route.source_id} to {route.destination_id} (Mode: Keywords - No match)")
+                elif route.mode == "keywords" and not route.matcher:
+                    self.log.warning(f"Keywords mode active for route {route} but no keywords defined. Skipping forwarding.")
+                elif route.mode == "filter" and route.rule is not None:
+                    # One combined regex pass decides the whole rule
+                    started = time.perf_counter()
+                    matched = route.rule.match(message_text)
+                    self._keyword_match_seconds.observe(time.perf_counter() - started, *labels)
+                    if matched and await self.enqueue(route, messages, content):
+                        if self._message_log.enabled():
+                            self.log.info(f"Queued message from {route.source_id} to {route.destination_id} (Mode: Filter - Matched)")
+                    elif not matched:
+                        self._messages_skipped.inc(*labels, amount=len(messages))
+                        if self._message_log.enabled():
+                            self.log.info(f"Skipped message from {route.source_id} to {route.destination_id} (Mode: Filter - No match)")
+                elif route.mode == "filter":
+                    self.log.warning(f"Filter mode active for route {route} but no valid filter defined. Skipping forwarding.")
+                elif route.mode == "digest":
+                    # Keywords pick the messages for the digest; without keywords every message goes in.
+                    hits = True
+                    if route.matcher:
+                        started = time.perf_counter()
+                        hits = route.matcher.search(message_text)
+                        self._keyword_match_seconds.observe(time.perf_counter() - started, *labels)
+                    if hits and await self.enqueue(route, messages, content):
+                        if self._message_log.enabled():
+                            self.log.info(f"Collected message from {route.source_id} for the digest to {route.destination_id}")
+                    elif not hits:
+                        self._messages_skipped.inc(*labels, amount=len(messages))
+
+            except Exception as e:
+                self.log.error(f"Error forwarding message from {route.source_id} to {route.destination_id}: {e}. Contact @DaHormes for help.")
+
+    async def enqueue(self, route, messages, content=None):
+        """
+        Hands a message (or album) accepted by `route` to the batcher, or to the digest on digest
+        routes, unless its `content` fingerprint was already sent to the route's destination.
+        Returns True if it was queued.
+        """
+        if self.dedup is not None and self.dedup.check(route.destination_id, content):
+            self._messages_duplicate.inc(route.source_id, route.destination_id, amount=len(messages))
+            if self._message_log.enabled():
+                self.log.info(f"Dropped duplicate message from {route.source_id} to {route.destination_id}")
+            return False
+        if route.mode == "digest":
+            await self.digest.add(route, messages)
+        else:
+            if self.dedup is not None and content is not None:
+                self._unsent_fingerprints[(route.destination_id, route.source_id, messages[0].id)] = content
+            await self.batcher.add(route, messages)
+        return True
+
+    async def handler(self, event):
+        """
+        Handles single new messages from the configured source chats.
+        Registered by listen_to_sources() for those chats only.
+        """
+        # Album parts are handled together by album_handler.
+        if event.message.grouped_id:
+            return
+        message_text = event.message.message if event.message.message else ""
+        await self.dispatch(event.chat_id, [event.message], message_text)
+
+    async def album_handler(self, event):
+        """
+        Handles grouped media (albums) from the configured source chats.
+        The whole album is matched on its caption and forwarded in one call, so it stays grouped.
+        """
+        # Raw text, like single messages: `event.text` would add markdown for the caption's formatting.
+        message_text = event.raw_text if event.raw_text else ""
+        await self.dispatch(event.chat_id, list(event.messages), message_text)
+
+    async def edit_handler(self, event):
+        """
+        Applies an edit in a source chat to the copies of the message on copy routes.
+        Forwards can't be edited; they keep showing the original.
+        """
+        message = event.message
+        routes = [route for route in self.route_table.lookup(event.chat_id) if route.delivery == "copy"]
+        if not routes or self.message_map is None:
+            return
+        copies = (await self.message_map.lookup(event.chat_id, [message.id])).get(message.id)
+        if not copies:
+            return
+        destinations = {route.destination_id: route for route in routes}
+        for destination_id, destination_msg in copies:
+            route = destinations.get(destination_id)
+            if route is None:
+                continue
+
+            async def edit(route, messages, destination_msg=destination_msg):
+                try:
+                    await self.client.edit_message(self.peers.get(route.destination_id), destination_msg, text=message.message or "",
+                                                   formatting_entities=message.entities)
+                except MessageNotModifiedError:
+                    # A reaction or view count changed, not the text.
+                    pass
+                except MessageIdInvalidError:
+                    # The copy was deleted at the destination; nothing to update.
+                    pass
+
+            # Edits share the destination's send rate with the forwards.
+            await self.send_queue.send(route, [message], edit)
+        if self._message_log.enabled():
+            self.log.info(f"Edited copies of message {message.id} from {event.chat_id}")
+
+    async def delete_handler(self, event):
+        """
+        Deletes the forwards and copies of messages deleted in a source chat. Telegram only names
+        the chat of deletions in channels and supergroups; others can't be matched to a source.
+        """
+        if event.chat_id is None or self.message_map is None:
+            return
+        found = await self.message_map.lookup(event.chat_id, event.deleted_ids)
+        if not found:
+            return
+        by_destination = {}
+        for pairs in found.values():
+            for destination_id, destination_msg in pairs:
+                by_destination.setdefault(destination_id, []).append(destination_msg)
+        for destination_id, destination_msgs in by_destination.items():
+
+            async def delete(route, messages, destination_msgs=destination_msgs):
+                # Telethon deletes 100 messages per request.
+                await self.client.delete_messages(self.peers.get(route.destination_id), destination_msgs)
+
+            # Deleted even if the route is gone since, so removed sources don't leave copies behind.
+            await self.send_queue.send(Route(event.chat_id, destination_id), destination_msgs, delete)
+        await self.message_map.forget(event.chat_id, found)
+        if self._message_log.enabled():
+            self.log.info(f"Deleted {sum(map(len, by_destination.values()))} forwarded message(s) of {len(found)} deleted in {event.chat_id}")
+
+    async def start_checkpoint(self, route):
+        """
+        Gives a route without a checkpoint one at the source's latest message, so that a restart
+        catches up from here even if nothing has been forwarded along the route yet.
+        """
+        if self.journal is None or self.journal.get(route) is not None:
+            return
+        latest = await self.client.get_messages(self.peers.get(route.source_id), limit=1)
+        self.journal.record(route, latest[0].id if latest else 0)
+
+    async def catch_up_source(self, source_id, routes, checkpoints):
+        """
+        Forwards every message posted to `source_id` after each route's checkpoint, oldest first.
+        History is paged in bulk (100 messages per request) and fed through the batcher, so the
+        forwards also go out 100 at a time. Returns the id of the newest message seen.
+        """
+        last_id = min(checkpoints.values())
+        source = self.peers.get(source_id)
+        latest = await self.client.get_messages(source, limit=1)
+        if not latest or latest[0].id <= last_id:
+            return last_id
+        if latest[0].id - last_id > settings.CATCHUP_MAX_MESSAGES:
+            self.log.warning(f"Source {source_id} is {latest[0].id - last_id} messages behind. Catching up on the latest {settings.CATCHUP_MAX_MESSAGES} only.")
+            last_id = latest[0].id - settings.CATCHUP_MAX_MESSAGES
+
+        count = 0
+        # Albums are collected across pages and forwarded in one piece.
+        album_id, album, album_text = None, [], ""
+
+        async def flush_album():
+            if album:
+                targets = [route for route in routes if album[-1].id > checkpoints[route.signature]]
+                await self.route_message(targets, list(album), album_text)
+
+        while True:
+            try:
+                async for message in self.client.iter_messages(source, min_id=last_id, reverse=True, wait_time=0):
+                    if message.action:
+                        # Service messages (joins, pins, ...) can't be forwarded and never reach the live handler either.
+                        last_id = message.id
+                        continue
+                    count += 1
+                    if message.grouped_id and message.grouped_id == album_id:
+                        album.append(message)
+                        album_text = album_text or message.message or ""
+                    else:
+                        await flush_album()
+                        album_id, album, album_text = None, [], ""
+                        if message.grouped_id:
+                            album_id, album, album_text = message.grouped_id, [message], message.message or ""
+                        else:
+                            targets = [route for route in routes if message.id > checkpoints[route.signature]]
+                            await self.route_message(targets, [message], message.message or "")
+                    last_id = message.id
+            except FloodWaitError as e:
+                self.log.warning(f"Flood wait of {e.seconds}s while catching up on {source_id}. Resuming after message {last_id}.")
+                await asyncio.sleep(e.seconds)
+                continue
+            break
+        await flush_album()
+        self.log.info(f"Caught up on {count} message(s) from {source_id}.")
+        return last_id
+
+    async def catch_up(self):
+        """
+        Forwards whatever was posted to the sources while the account was down,
+        then replays the live messages held back meanwhile and switches to live forwarding.
+        """
+        caught_up_to = {}
+        if self.journal is None:
+            # Without checkpoints there's no telling what was already forwarded.
+            self.log.warning("No forward journal: skipping the catch-up. Messages posted while the userbot was down are not forwarded.")
+        elif settings.CATCHUP_MAX_MESSAGES > 0:
+            for source_id in self.route_table.sources:
+                routes = self.route_table.lookup(source_id)
+                # Routes without a checkpoint are new and start from the present.
+                checkpoints = {route.signature: self.journal.get(route) for route in routes if self.journal.get(route) is not None}
+                routes = [route for route in routes if route.signature in checkpoints]
+                if not routes:
+                    continue
+                try:
+                    caught_up_to[source_id] = await self.catch_up_source(source_id, routes, checkpoints)
+                except Exception as e:
+                    self.log.error(f"Error catching up on Source Chat {source_id}: {e}. Messages posted while the userbot was down may be missing.")
+
+        buffered, self._catchup_buffer = self._catchup_buffer, None
+        for chat_id, items in buffered.items():
+            for messages, message_text in items:
+                # Skip what the catch-up already covered.
+                if max(message.id for message in messages) > caught_up_to.get(chat_id, 0):
+                    await self.dispatch(chat_id, messages, message_text)
+        self.log.info("Caught up. Forwarding live messages.")
+
+    async def login(self, interactive=True):
+        """
+        Connects and logs in, then records the account's user ID.
+        With `interactive=False` (supervised accounts) an unauthorized session raises
+        SessionNotAuthorizedError instead of prompting for a phone number.
+        """
+        if interactive:
+            await self.client.start()
+        else:
+            await self.client.connect()
+            if not await self.client.is_user_authorized():
+                session = getattr(self.client.session, "filename", None) or self.account
+                raise SessionNotAuthorizedError(f"session '{session}' is not logged in. Log it in once with main.py and SESSION_NAME.")
+
+        user = await self.client.get_me()
+        self.user_id = user.id
+        self.log.info(f"Userbot is running for user: {user.first_name} (ID: {self.user_id})")
+
+    async def serve(self, poll_interval):
+        """
+        Loads the routes, catches up and forwards until the client disconnects.
+        Call login() first.
+        """
+        fetch_task = None
+        # A restarted account catches up again before forwarding live.
+        self._catchup_buffer = {}
+        self.client.add_event_handler(self._first_update, events.Raw)
+        try:
+            journal = ForwardJournal(self._journal_path, database=self._db if settings.JOURNAL_SUPABASE_SYNC else None, user_id=self.user_id)
+            try:
+                await journal.open()
+                self.journal = journal
+            except Exception as e:
+                self.log.error(f"Cannot open the forward journal {self._journal_path}: {e}. Forwarding without catch-up on restart.")
+                await journal.close()
+            if settings.MESSAGE_MAP_RETENTION_DAYS > 0:
+                # Kept next to the journal's checkpoints, in the same file.
+                self.message_map = MessageMap(self._journal_path, retention=settings.MESSAGE_MAP_RETENTION_DAYS * 86400)
+                await self.message_map.open()
+
+            # Load the routes, then forward whatever was missed while we were down before going live.
+            try:
+                await self.load_config()
+            except Exception as e:
+                self.log.error(f"Error fetching config for User ID {self.user_id}: {e}. Contact @DaHormes for help.", exc_info=True)
+            # Opened once the routes are known, so digests collected before a restart go back to their routes.
+            self.digest = DigestBuffer(self, self._journal_path, excerpt_chars=settings.DIGEST_EXCERPT_CHARS)
+            await self.digest.open()
+            await self.catch_up()
+            # Resume backfills that were running when the account stopped.
+            await self.backfill.poll()
+            fetch_task = asyncio.ensure_future(self.fetch_config(poll_interval))
+
+            self.log.info(f"Userbot started in {time.monotonic() - settings.STARTED:.2f}s. Listening for messages...")
+            await self.client.run_until_disconnected()
+        finally:
+            self.client.remove_event_handler(self._first_update)
+            if fetch_task is not None:
+                fetch_task.cancel()
+            await self.backfill.stop()
+            # Send what's queued while the journal can still record it, so a restart doesn't send it again.
+            try:
+                await asyncio.wait_for(self._drain(), timeout=settings.SHUTDOWN_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                if self.journal is not None:
+                    self.log.warning(f"{self.send_queue.depth} batch(es) not sent within {settings.SHUTDOWN_DRAIN_TIMEOUT}s of stopping. They are forwarded by the catch-up after the restart.")
+                else:
+                    self.log.warning(f"{self.send_queue.depth} batch(es) not sent within {settings.SHUTDOWN_DRAIN_TIMEOUT}s of stopping. Without a forward journal they are lost.")
+            # A restarted serve() starts new workers; these must not outlive the journal.
+            await self.send_queue.close()
+            if self.journal is not None:
+                await self.journal.close()
+                self.journal = None
+            if self.message_map is not None:
+                await self.message_map.close()
+                self.message_map = None
+            if self.digest is not None:
+                await self.digest.close()
+                self.digest = None
+
+    async def _drain(self):
+        await self.batcher.flush_all()
+        await self.send_queue.drain()
+
+    async def run(self, poll_interval, interactive=True):
+        """Logs in and serves until the client disconnects."""
+        await self.login(interactive)
+        await self.serve(poll_interval)
+
+    async def _first_update(self, event):
+        """Logs the time to the first update from Telegram once, for the startup budget."""
+        self.client.remove_event_handler(self._first_update)
+        self.log.info(f"First update received {time.monotonic() - settings.STARTED:.2f}s after start.")
@@ -0,0 +1,210 @@
+# userbot/backfill.py
+
+import asyncio
+import datetime
+import logging
+import time
+
+from telethon.errors import FloodWaitError
+
+from batching import MAX_BATCH_SIZE
+from copier import MediaTooLargeError
+from routes import Route
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("pending", "running")
+# Telegram returns at most this many messages per history request.
+HISTORY_PAGE_SIZE = 100
+# Marks the end of the history stream.
+_END = object()
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class BackfillRunner:
+    """
+    Runs the account's history backfills, recorded by the bot's /backfill in 'backfill_jobs'.
+
+    A job copies a source's existing history (or its latest `max_messages`) into a destination,
+    oldest first, through the keywords or filter and delivery of the matching route. A reader
+    task pages the history ahead into a buffer of `prefetch_pages` pages while the job forwards
+    what's already read, 100 messages per call, paced by the send queue's buckets so live
+    forwards to the same destination keep their share.
+    Progress is saved every `checkpoint_interval` seconds: `last_id` is the newest message
+    every older one of which was forwarded or filtered out, so a restarted userbot resumes
+    there. A job whose row leaves the pending/running state (e.g. cancelled) is stopped.
+    """
+
+    def __init__(self, userbot, database, prefetch_pages=5, checkpoint_interval=5.0):
+        self._userbot = userbot
+        self._database = database
+        self._prefetch = max(1, prefetch_pages) * HISTORY_PAGE_SIZE
+        self._checkpoint_interval = checkpoint_interval
+        self._tasks = {}
+        self.metrics = {"scanned": 0, "forwarded": 0}
+
+    @property
+    def running(self):
+        return len(self._tasks)
+
+    async def poll(self):
+        """Starts the account's active jobs that aren't running yet and stops those that no longer are active."""
+        try:
+            jobs = await self._database.get_backfill_jobs(self._userbot.user_id, statuses=ACTIVE_STATUSES)
+        except Exception as e:
+            self._userbot.log.warning(f"Could not load backfill jobs: {e}")
+            return
+        active = {job["id"] for job in jobs}
+        for job_id, task in list(self._tasks.items()):
+            if job_id not in active:
+                task.cancel()
+        # Oldest first, so jobs queued for one destination start in order.
+        for job in reversed(jobs):
+            if job["id"] not in self._tasks:
+                task = asyncio.ensure_future(self._run(job))
+                self._tasks[job["id"]] = task
+                task.add_done_callback(lambda _, job_id=job["id"]: self._tasks.pop(job_id, None))
+
+    async def stop(self):
+        """Stops the running jobs after saving their progress; they resume on the next start."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _save(self, job_id, **fields):
+        fields["updated_at"] = _now()
+        try:
+            await self._database.update_backfill_job(job_id, fields)
+        except Exception as e:
+            self._userbot.log.warning(f"Could not save progress of backfill {job_id}: {e}")
+
+    def _route(self, source_id, destination_id):
+        """The configured route between the two chats, or one that takes every message."""
+        for route in self._userbot.route_table.lookup(source_id):
+            if route.destination_id == destination_id:
+                return route
+        return Route(source_id, destination_id)
+
+    async def _read(self, source, last_id, until_id, queue):
+        """Feeds messages last_id + 1 .. until_id into `queue`, oldest first, then _END or the error that stopped it."""
+        try:
+            while True:
+                try:
+                    async for message in self._userbot.client.iter_messages(source, min_id=last_id, max_id=until_id + 1, reverse=True, wait_time=0):
+                        await queue.put(message)
+                        last_id = message.id
+                except FloodWaitError as e:
+                    self._userbot.log.warning(f"Flood wait of {e.seconds}s while reading history for a backfill. Resuming after message {last_id}.")
+                    await asyncio.sleep(e.seconds)
+                    continue
+                break
+            await queue.put(_END)
+        except Exception as e:
+            await queue.put(e)
+
+    async def _send(self, route, messages):
+        try:
+            await self._userbot.deliver(route, messages, [message.id for message in messages])
+        except MediaTooLargeError as e:
+            # Retrying won't make it fit; skip it so the job keeps moving.
+            self._userbot.log.error(f"Backfill cannot copy {len(messages)} message(s) from {route.source_id} to {route.destination_id}: {e}.")
+
+    async def _run(self, job):
+        userbot = self._userbot
+        job_id = job["id"]
+        source_id, destination_id = int(job["source_id"]), int(job["destination_id"])
+        scanned, forwarded = int(job.get("scanned") or 0), int(job.get("forwarded") or 0)
+        safe_id = int(job.get("last_id") or 0)
+        started = time.monotonic()
+        forwarded_here = 0
+        reader = None
+
+        def progress():
+            rate = forwarded_here / max(time.monotonic() - started, 1e-9)
+            return {"last_id": safe_id, "scanned": scanned, "forwarded": forwarded, "rate": round(rate, 2)}
+
+        try:
+            source = await userbot.peers.resolve(source_id)
+            await userbot.peers.resolve(destination_id)
+            until_id = job.get("until_id")
+            if until_id is None:
+                # Fixed at the first start: newer messages reach the destination as live forwards.
+                latest = await userbot.client.get_messages(source, limit=1)
+                until_id = latest[0].id if latest else 0
+                if job.get("max_messages"):
+                    safe_id = max(safe_id, until_id - int(job["max_messages"]))
+            until_id = int(until_id)
+            await self._save(job_id, status="running", until_id=until_id, last_id=safe_id, started_at=job.get("started_at") or _now())
+            userbot.log.info(f"Backfill {job_id}: copying messages {safe_id + 1}-{until_id} of {source_id} to {destination_id}.")
+
+            route = self._route(source_id, destination_id)
+            queue = asyncio.Queue(maxsize=self._prefetch)
+            reader = asyncio.ensure_future(self._read(source, safe_id, until_id, queue))
+            send_queue = userbot.send_queue
+            batch = []
+            saved = time.monotonic()
+
+            async def flush(upto):
+                nonlocal batch, safe_id, forwarded, forwarded_here, saved
+                if batch:
+                    if await send_queue.send(route, batch, self._send):
+                        forwarded += len(batch)
+                        forwarded_here += len(batch)
+                        self.metrics["forwarded"] += len(batch)
+                    batch = []
+                safe_id = upto
+                if time.monotonic() - saved >= self._checkpoint_interval:
+                    saved = time.monotonic()
+                    await self._save(job_id, **progress())
+
+            async def handle(unit, previous_id):
+                # A unit is one message or a whole album; albums are matched on their caption and sent together.
+                nonlocal safe_id
+                wanted = unit[0].action is None and route.admits(unit) is None
+                if wanted:
+                    text = next((message.message for message in unit if message.message), "")
+                    wanted = route.accepts(text)
+                if wanted:
+                    if batch and (len(batch) + len(unit) > MAX_BATCH_SIZE or not route.batchable):
+                        await flush(previous_id)
+                    batch.extend(unit)
+                    if not route.batchable or len(batch) >= MAX_BATCH_SIZE:
+                        await flush(unit[-1].id)
+                elif not batch:
+                    safe_id = unit[-1].id
+
+            unit, previous_id = [], safe_id
+            while True:
+                item = await queue.get()
+                if isinstance(item, Exception):
+                    raise item
+                if item is _END:
+                    break
+                scanned += 1
+                self.metrics["scanned"] += 1
+                if unit and not (item.grouped_id and item.grouped_id == unit[0].grouped_id):
+                    await handle(unit, previous_id)
+                    previous_id = unit[-1].id
+                    unit = []
+                unit.append(item)
+            if unit:
+                await handle(unit, previous_id)
+                previous_id = unit[-1].id
+            await flush(max(previous_id, until_id))
+
+            await self._save(job_id, status="done", finished_at=_now(), **progress())
+            userbot.log.info(f"Backfill {job_id} done: {forwarded} of {scanned} message(s) copied from {source_id} to {destination_id}.")
+        except asyncio.CancelledError:
+            await self._save(job_id, **progress())
+            userbot.log.info(f"Backfill {job_id} stopped after message {safe_id}.")
+            raise
+        except Exception as e:
+            await self._save(job_id, status="failed", error=str(e), **progress())
+            userbot.log.error(f"Backfill {job_id} from {source_id} to {destination_id} failed: {e}")
+        finally:
+            if reader is not None:
+                reader.cancel()
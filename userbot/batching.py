@@ -0,0 +1,75 @@
+# userbot/batching.py
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Telegram accepts at most 100 message ids per forward_messages call.
+MAX_BATCH_SIZE = 100
+
+
+class _Batch:
+    __slots__ = ("route", "messages", "timer")
+
+    def __init__(self, route):
+        self.route = route
+        self.messages = []
+        self.timer = None
+
+
+class ForwardBatcher:
+    """
+    Coalesces messages per route and hands them to `send(route, messages)` in batches.
+
+    The first message of a batch opens a short window; everything that arrives for the same
+    route before it closes goes out in a single call. Albums are added in one piece, so a
+    batch never splits a grouped media post and it stays grouped at the destination.
+    Routes that can't send a batch in one call (copy delivery) get one batch per message or album.
+    """
+
+    def __init__(self, send, window=0.5, max_size=MAX_BATCH_SIZE):
+        self._send = send
+        self._window = window
+        self._max_size = max_size
+        self._pending = {}
+
+    async def add(self, route, messages):
+        """Queues `messages` (one message, or a whole album) for forwarding along `route`."""
+        if not route.batchable:
+            try:
+                await self._send(route, list(messages))
+            except Exception as e:
+                logger.error(f"Error forwarding {len(messages)} message(s) from {route.source_id} to {route.destination_id}: {e}. Contact @DaHormes for help.")
+            return
+        key = (route.source_id, route.destination_id)
+        batch = self._pending.get(key)
+        # Flush first rather than split an album across two calls.
+        if batch is not None and len(batch.messages) + len(messages) > self._max_size:
+            await self.flush(key)
+            batch = None
+        if batch is None:
+            batch = self._pending[key] = _Batch(route)
+            if self._window > 0:
+                batch.timer = asyncio.get_running_loop().call_later(
+                    self._window, lambda: asyncio.ensure_future(self.flush(key))
+                )
+        batch.messages.extend(messages)
+        if self._window <= 0 or len(batch.messages) >= self._max_size:
+            await self.flush(key)
+
+    async def flush(self, key):
+        """Sends the pending batch for `key` (a (source_id, destination_id) pair), if any."""
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        try:
+            await self._send(batch.route, batch.messages)
+        except Exception as e:
+            logger.error(f"Error forwarding {len(batch.messages)} message(s) from {batch.route.source_id} to {batch.route.destination_id}: {e}. Contact @DaHormes for help.")
+
+    async def flush_all(self):
+        for key in list(self._pending):
+            await self.flush(key)
@@ -0,0 +1,68 @@
+# userbot/bench_filters.py
+#
+# Micro-benchmark for filter mode: cost of CompiledFilter.match() against message
+# length and the number of terms in the rule, for messages that match nothing and
+# for messages that hit some terms (which forces the boolean tree to be evaluated).
+# Run from the userbot directory: python3 bench_filters.py
+
+import random
+import string
+import timeit
+
+from matcher import CompiledFilter
+
+TERM_COUNTS = (10, 100, 200)
+MESSAGE_LENGTHS = (100, 1_000, 10_000)
+
+
+def random_word(rng, low=4, high=12):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(low, high)))
+
+
+def build_rule(rng, count):
+    """A rule mixing every term kind: (a OR word:b OR ...) AND NOT (c OR /d\\d+/ OR ...)."""
+    terms = []
+    for i in range(count):
+        word = random_word(rng, 6, 14)
+        kind = i % 4
+        if kind == 0:
+            terms.append(word)
+        elif kind == 1:
+            terms.append(f"word:{word}")
+        elif kind == 2:
+            terms.append(f'"{word} {random_word(rng)}"')
+        else:
+            terms.append(f"/{word}\\d+/")
+    include, exclude = terms[: count // 2], terms[count // 2:]
+    return f"({' OR '.join(include)}) AND NOT ({' OR '.join(exclude)})", include
+
+
+def main():
+    rng = random.Random(42)
+    words = [random_word(rng) for _ in range(2_000)]
+
+    print(f"{'terms':>6}  {'length':>7}  {'miss':>10}  {'hit':>10}  {'compile':>10}")
+    for count in TERM_COUNTS:
+        rule, include = build_rule(rng, count)
+        start = timeit.default_timer()
+        compiled = CompiledFilter(rule)
+        compile_time = timeit.default_timer() - start
+        # The first include term is a plain substring, so appending it makes the rule match.
+        hit_word = include[0]
+
+        for length in MESSAGE_LENGTHS:
+            miss_text = " ".join(rng.choice(words) for _ in range(length // 5))[:length]
+            hit_text = miss_text[: length // 2] + " " + hit_word.upper() + " " + miss_text[length // 2:]
+            assert not compiled.match(miss_text) and compiled.match(hit_text)
+
+            number = max(1, 200_000 // (count * length // 10 + 1))
+            miss_time = min(timeit.repeat(lambda: compiled.match(miss_text), number=number, repeat=5)) / number
+            hit_time = min(timeit.repeat(lambda: compiled.match(hit_text), number=number, repeat=5)) / number
+            print(
+                f"{count:>6}  {length:>7}  {miss_time * 1e6:>8.1f}us  {hit_time * 1e6:>8.1f}us  "
+                f"{compile_time * 1e3:>8.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
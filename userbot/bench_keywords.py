@@ -0,0 +1,58 @@
+# userbot/bench_keywords.py
+#
+# Micro-benchmark for keyword mode: the compiled KeywordMatcher against the old
+# `any(keyword in message_text.lower() for keyword in keywords)` generator.
+# Up to NAIVE_MAX_KEYWORDS keywords the matcher checks each keyword with `in` on text it
+# lowercased once, since the compiled regex is slower than that for small sets.
+# Run from the userbot directory: python3 bench_keywords.py
+
+import random
+import string
+import timeit
+
+from matcher import KeywordMatcher
+
+KEYWORD_COUNTS = (10, 50, 100, 10_000)
+MESSAGE_LENGTH = 1_000
+
+
+def random_word(rng, low=4, high=12):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(low, high)))
+
+
+def generator_match(message_text, keywords):
+    # The userbot handler's original check, kept verbatim for comparison.
+    return any(keyword in message_text.lower() for keyword in keywords)
+
+
+def main():
+    rng = random.Random(42)
+    words = [random_word(rng) for _ in range(2_000)]
+    # A realistic message: mostly words that are not keywords, so the generator
+    # has to walk the whole keyword list before giving up.
+    miss_text = " ".join(rng.choice(words) for _ in range(MESSAGE_LENGTH // 8))[:MESSAGE_LENGTH]
+
+    print(f"message length: {len(miss_text)} chars")
+    print(f"{'keywords':>9}  {'generator':>12}  {'matcher':>12}  {'speedup':>8}  {'compile':>10}")
+    for count in KEYWORD_COUNTS:
+        keywords = list({random_word(rng, 6, 14) for _ in range(count * 2)})[:count]
+        start = timeit.default_timer()
+        matcher = KeywordMatcher(keywords)
+        compile_time = timeit.default_timer() - start
+
+        # Put one keyword at the end of a copy of the message so both paths do a full scan.
+        hit_text = miss_text + " " + keywords[-1].upper()
+        assert generator_match(hit_text, keywords) and matcher.search(hit_text)
+        assert not generator_match(miss_text, keywords) and not matcher.search(miss_text)
+
+        number = max(1, 20_000 // count)
+        gen_time = min(timeit.repeat(lambda: generator_match(miss_text, keywords), number=number, repeat=5)) / number
+        new_time = min(timeit.repeat(lambda: matcher.search(miss_text), number=number, repeat=5)) / number
+        print(
+            f"{count:>9}  {gen_time * 1e6:>10.1f}us  {new_time * 1e6:>10.1f}us  "
+            f"{gen_time / new_time:>7.1f}x  {compile_time * 1e3:>8.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+# userbot/bench_load.py
+#
+# Offline load test for one userbot account. Drives Userbot.handler with synthetic NewMessage
+# events at a fixed rate, through the real routes, matcher, batcher, send queue and journal,
+# against an in-process fake Telegram client (forward_messages with simulated latency and
+# flood waits) and a fake 'user_configs' store that keeps changing while the load runs.
+# Reports throughput, handler and end-to-end latency percentiles, config reload times and memory.
+# No network or credentials needed. Exits with code 1 if a --max-*/--min-* budget is missed,
+# so it can gate performance regressions.
+# Run from the userbot directory: python3 bench_load.py [--rate 1000 --keywords 1000 ...]
+
+import argparse
+import asyncio
+import datetime
+import gc
+import logging
+import os
+import random
+import resource
+import string
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from telethon.errors import FloodWaitError
+from telethon.tl.types import Channel, ChatPhotoEmpty
+
+import settings
+from account import Userbot
+from journal import ForwardJournal
+
+SOURCE_ID = -1001000000001
+USER_ID = 1
+
+
+def random_word(rng, low=4, high=12):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(low, high)))
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class FakeClient:
+    """The parts of TelegramClient the userbot uses, answering from memory."""
+
+    def __init__(self, latency, flood_every, flood_seconds, sent_at):
+        self.flood_sleep_threshold = 60
+        self._latency = latency
+        self._flood_every = flood_every
+        self._flood_seconds = flood_seconds
+        self._sent_at = sent_at
+        self.calls = 0
+        self.flood_waits = 0
+        self.forwarded = 0
+        self.latencies = []
+
+    def add_event_handler(self, callback, event=None):
+        pass
+
+    def remove_event_handler(self, callback, event=None):
+        pass
+
+    async def get_entity(self, chat_id):
+        await asyncio.sleep(self._latency)
+        return Channel(id=abs(chat_id) % 10**12, title="chat", photo=ChatPhotoEmpty(), date=datetime.datetime.now(), access_hash=1)
+
+    async def get_messages(self, peer, limit=1):
+        return []
+
+    async def forward_messages(self, destination, message_ids, from_peer=None):
+        self.calls += 1
+        await asyncio.sleep(self._latency)
+        if self._flood_every and self.calls % self._flood_every == 0:
+            self.flood_waits += 1
+            raise FloodWaitError(None, capture=self._flood_seconds)
+        now = time.perf_counter()
+        self.forwarded += len(message_ids)
+        self.latencies.extend(now - self._sent_at[message_id] for message_id in message_ids)
+
+
+class FakeDatabase:
+    """A 'user_configs' store whose keyword list changes on every read, so each reload recompiles."""
+
+    def __init__(self, keywords, destinations):
+        self._keywords = keywords
+        self._destinations = destinations
+        self.reads = 0
+
+    async def get_config(self, user_id):
+        self.reads += 1
+        # Swap the last keyword for a fresh one: the route changes, most of the list doesn't.
+        keywords = self._keywords[:-1] + [f"reload{self.reads}"]
+        return {"routes": [{"source_id": SOURCE_ID, "destination_ids": self._destinations, "mode": "keywords", "keywords": keywords}]}
+
+
+class FakeNotifier:
+    def subscribe(self, callback):
+        pass
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    keywords = list({random_word(rng, 6, 14) for _ in range(args.keywords * 2)})[: args.keywords]
+    words = [random_word(rng) for _ in range(2_000)]
+    # The last keyword is replaced on every reload, so only the others are used as hits.
+    stable = keywords[:-1] or keywords
+    texts = []
+    for i in range(min(args.messages, 1_000)):
+        text = " ".join(rng.choice(words) for _ in range(args.length // 6))
+        if rng.random() < args.hit_ratio:
+            text += " " + rng.choice(stable)
+        texts.append(text)
+    destinations = [-1002000000000 - i for i in range(args.destinations)]
+
+    settings.SEND_RATE_PER_DESTINATION = args.send_rate
+    settings.SEND_BURST = max(1, int(args.send_rate))
+    settings.SEND_RATE_GLOBAL = args.send_rate * args.destinations
+    settings.FORWARD_BATCH_WINDOW = args.batch_window
+    sent_at = {}
+    client = FakeClient(args.latency, args.flood_every, args.flood_seconds, sent_at)
+    database = FakeDatabase(keywords, destinations)
+    with tempfile.TemporaryDirectory() as tmp:
+        userbot = Userbot(client, database, FakeNotifier(), None)
+        userbot.user_id = USER_ID
+        # What Userbot.serve() does after logging in.
+        userbot.journal = ForwardJournal(os.path.join(tmp, "journal.db"))
+        await userbot.journal.open()
+        await userbot.load_config()
+        await userbot.catch_up()
+
+        # Time every config reload the fetch_config loop performs while the load runs.
+        reload_times = []
+        load_config = userbot.load_config
+
+        async def timed_load_config():
+            started = time.perf_counter()
+            await load_config()
+            reload_times.append(time.perf_counter() - started)
+
+        userbot.load_config = timed_load_config
+        fetch_task = asyncio.ensure_future(userbot.fetch_config(poll_interval=3600))
+
+        async def reload_periodically():
+            while True:
+                await asyncio.sleep(args.reload_every)
+                userbot.on_config_changed(USER_ID)
+
+        reload_task = asyncio.ensure_future(reload_periodically()) if args.reload_every > 0 else None
+
+        gc.collect()
+        rss_before = rss_mb()
+        handler_times = []
+        max_lag = 0.0
+        date = datetime.datetime.now(datetime.timezone.utc)
+        started = time.perf_counter()
+        for i in range(args.messages):
+            due = started + i / args.rate
+            now = time.perf_counter()
+            if due > now + 0.001:
+                await asyncio.sleep(due - now)
+            else:
+                max_lag = max(max_lag, now - due)
+            message = SimpleNamespace(id=i + 1, message=texts[i % len(texts)], grouped_id=None, date=date, photo=None, document=None)
+            event = SimpleNamespace(message=message, chat_id=SOURCE_ID)
+            sent_at[message.id] = time.perf_counter()
+            await userbot.handler(event)
+            handler_times.append(time.perf_counter() - sent_at[message.id])
+        produced = time.perf_counter() - started
+
+        await userbot.batcher.flush_all()
+        await userbot.send_queue.drain()
+        elapsed = time.perf_counter() - started
+        for task in (fetch_task, reload_task):
+            if task is not None:
+                task.cancel()
+        await userbot.journal.close()
+
+    hits = [any(keyword in text for keyword in stable) for text in texts]
+    expected = sum(hits[i % len(texts)] for i in range(args.messages)) * args.destinations
+    return {
+        "offered_rate": args.messages / produced,
+        "throughput": client.forwarded / elapsed,
+        "forwarded": client.forwarded,
+        "expected": expected,
+        "forward_calls": client.calls,
+        "flood_waits": client.flood_waits,
+        "handler_p50_ms": percentile(handler_times, 0.5) * 1e3,
+        "handler_p99_ms": percentile(handler_times, 0.99) * 1e3,
+        "handler_max_ms": max(handler_times) * 1e3,
+        "schedule_lag_ms": max_lag * 1e3,
+        "e2e_p50_ms": percentile(client.latencies, 0.5) * 1e3,
+        "e2e_p99_ms": percentile(client.latencies, 0.99) * 1e3,
+        "reloads": len(reload_times),
+        "reload_p50_ms": percentile(reload_times, 0.5) * 1e3,
+        "reload_max_ms": max(reload_times, default=0.0) * 1e3,
+        "rss_before_mb": rss_before,
+        "rss_peak_mb": rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the userbot's forwarding path.")
+    parser.add_argument("--rate", type=float, default=500, help="messages per second offered to the handler")
+    parser.add_argument("--messages", type=int, default=5_000, help="messages to send")
+    parser.add_argument("--keywords", type=int, default=100, help="keywords on the route")
+    parser.add_argument("--hit-ratio", type=float, default=0.5, help="share of messages containing a keyword")
+    parser.add_argument("--length", type=int, default=300, help="message length in characters")
+    parser.add_argument("--destinations", type=int, default=3, help="destinations the source fans out to")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per fake API call")
+    parser.add_argument("--flood-every", type=int, default=0, help="every Nth forward call raises a flood wait (0: never)")
+    parser.add_argument("--flood-seconds", type=int, default=1, help="length of the simulated flood waits")
+    parser.add_argument("--send-rate", type=float, default=10, help="forward calls per second per destination")
+    parser.add_argument("--batch-window", type=float, default=settings.FORWARD_BATCH_WINDOW, help="FORWARD_BATCH_WINDOW")
+    parser.add_argument("--reload-every", type=float, default=1.0, help="seconds between config change notifications (0: none)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--max-handler-p99-ms", type=float, help="fail if the handler's p99 latency is higher")
+    parser.add_argument("--max-e2e-p99-ms", type=float, help="fail if the end-to-end p99 latency is higher")
+    parser.add_argument("--min-throughput", type=float, help="fail if fewer messages per second are forwarded")
+    args = parser.parse_args()
+
+    # Per-message logs and flood wait warnings would measure the terminal, not the userbot.
+    logging.basicConfig(level=logging.ERROR)
+    settings.MESSAGE_LOG_EVERY = 0
+    results = asyncio.run(run(args))
+
+    print(f"{'offered rate':<22} {results['offered_rate']:>10.0f} msg/s")
+    print(f"{'throughput':<22} {results['throughput']:>10.0f} msg/s forwarded "
+          f"({results['forwarded']}/{results['expected']} in {results['forward_calls']} calls, {results['flood_waits']} flood waits)")
+    print(f"{'handler latency':<22} {results['handler_p50_ms']:>10.3f} ms p50  {results['handler_p99_ms']:.3f} ms p99  {results['handler_max_ms']:.3f} ms max")
+    print(f"{'schedule lag':<22} {results['schedule_lag_ms']:>10.1f} ms max")
+    print(f"{'end-to-end latency':<22} {results['e2e_p50_ms']:>10.1f} ms p50  {results['e2e_p99_ms']:.1f} ms p99")
+    print(f"{'config reloads':<22} {results['reloads']:>10d}      {results['reload_p50_ms']:.2f} ms p50  {results['reload_max_ms']:.2f} ms max")
+    print(f"{'memory (RSS)':<22} {results['rss_before_mb']:>10.1f} MB at start  {results['rss_peak_mb']:.1f} MB peak")
+
+    failures = []
+    if args.max_handler_p99_ms is not None and results["handler_p99_ms"] > args.max_handler_p99_ms:
+        failures.append(f"handler p99 {results['handler_p99_ms']:.3f} ms > {args.max_handler_p99_ms} ms")
+    if args.max_e2e_p99_ms is not None and results["e2e_p99_ms"] > args.max_e2e_p99_ms:
+        failures.append(f"end-to-end p99 {results['e2e_p99_ms']:.1f} ms > {args.max_e2e_p99_ms} ms")
+    if args.min_throughput is not None and results["throughput"] < args.min_throughput:
+        failures.append(f"throughput {results['throughput']:.0f} msg/s < {args.min_throughput} msg/s")
+    if results["forwarded"] < results["expected"]:
+        failures.append(f"only {results['forwarded']} of {results['expected']} messages were forwarded")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
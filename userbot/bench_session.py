@@ -0,0 +1,147 @@
+# userbot/bench_session.py
+#
+# Compares the Telethon session backends under a burst of updates. Every update does what
+# Telethon does with the session while handling one (process_entities with the update's users
+# and chats) plus the entity lookups a handler causes (get_input_entity by id); every
+# --save-every seconds the session is saved as Telethon's keepalive loop does. For the SQLite
+# file session that's a commit on the event loop; for the memory session it's a snapshot
+# handed to a store that uploads it in the background (--upload-latency).
+# Reports per-update latency percentiles, the longest save, the session's size and lookups
+# of entities the memory session dropped to stay within its bound.
+# No network or credentials needed.
+# Run from the userbot directory: python3 bench_session.py [--updates 20000 --entities 5000 ...]
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from telethon import utils
+from telethon.crypto import AuthKey
+from telethon.sessions import SQLiteSession
+from telethon.tl import types
+
+from bench_load import percentile
+from sessions import SessionSnapshotter, SnapshotSession
+
+
+class FakeStore:
+    """A session store that takes --upload-latency seconds per save, off the event loop's critical path."""
+
+    name = "bench"
+
+    def __init__(self, latency):
+        self._latency = latency
+        self.saved = None
+
+    async def save(self, data):
+        await asyncio.sleep(self._latency)
+        self.saved = data
+
+
+def make_entities(rng, count):
+    """Users and channels as they arrive in updates, with usernames and names."""
+    entities = []
+    for i in range(count):
+        if i % 3:
+            entities.append(types.User(id=10_000 + i, access_hash=rng.getrandbits(63), first_name=f"user{i}", username=f"user{i}"))
+        else:
+            entities.append(types.Channel(id=1_000_000 + i, title=f"channel{i}", photo=types.ChatPhotoEmpty(), date=None,
+                                          access_hash=rng.getrandbits(63), username=f"channel{i}"))
+    return entities
+
+
+async def run(session, save, args):
+    rng = random.Random(args.seed)
+    entities = make_entities(rng, args.entities)
+    # Handlers look up entities that came with earlier updates.
+    seen = []
+    misses = 0
+    latencies = []
+    save_times = []
+    last_save = time.perf_counter()
+    started = time.perf_counter()
+    for i in range(args.updates):
+        due = started + i / args.rate
+        now = time.perf_counter()
+        if due > now + 0.001:
+            await asyncio.sleep(due - now)
+        begin = time.perf_counter()
+        update_entities = rng.sample(entities, args.per_update)
+        session.process_entities(types.contacts.ResolvedPeer(None, update_entities, []))
+        seen.extend(utils.get_peer_id(entity) for entity in update_entities)
+        for _ in range(args.lookups):
+            try:
+                session.get_input_entity(rng.choice(seen))
+            except ValueError:
+                # Dropped from a bounded session; Telethon would ask Telegram.
+                misses += 1
+        latencies.append(time.perf_counter() - begin)
+        if time.perf_counter() - last_save >= args.save_every:
+            begin = time.perf_counter()
+            await save()
+            save_times.append(time.perf_counter() - begin)
+            last_save = time.perf_counter()
+    begin = time.perf_counter()
+    await save()
+    save_times.append(time.perf_counter() - begin)
+    return latencies, save_times, misses, time.perf_counter() - started
+
+
+async def bench_sqlite(path, args):
+    session = SQLiteSession(path)
+
+    async def save():
+        session.save()
+
+    try:
+        return await run(session, save, args) + (os.path.getsize(path + ".session"),)
+    finally:
+        session.close()
+
+
+async def bench_memory(args):
+    session = SnapshotSession()
+    session.set_dc(2, "149.154.167.51", 443)
+    session.auth_key = AuthKey(bytes(256))
+    store = FakeStore(args.upload_latency)
+    snapshotter = SessionSnapshotter(session, store)
+    pending = []
+
+    async def save():
+        # Taking the snapshot runs on the loop (measured up to the yield); the upload continues alongside.
+        pending.append(asyncio.ensure_future(snapshotter.save()))
+        await asyncio.sleep(0)
+
+    result = await run(session, save, args)
+    await asyncio.gather(*pending)
+    return result + (len(store.saved or ""),)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update handling latency of the SQLite and memory Telethon sessions.")
+    parser.add_argument("--updates", type=int, default=20_000, help="updates to handle")
+    parser.add_argument("--rate", type=float, default=5_000, help="updates per second offered")
+    parser.add_argument("--entities", type=int, default=5_000, help="distinct users and channels seen")
+    parser.add_argument("--per-update", type=int, default=3, help="users and chats carried by each update")
+    parser.add_argument("--lookups", type=int, default=2, help="entity lookups by id per update")
+    parser.add_argument("--save-every", type=float, default=1.0, help="seconds between session saves (Telethon: 60)")
+    parser.add_argument("--upload-latency", type=float, default=0.05, help="seconds per snapshot upload")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {
+            "sqlite": asyncio.run(bench_sqlite(os.path.join(tmp, "bench"), args)),
+            "memory": asyncio.run(bench_memory(args)),
+        }
+    for name, (latencies, save_times, misses, elapsed, size) in results.items():
+        print(f"{name:<8} {len(latencies) / elapsed:>8.0f} updates/s  "
+              f"update {percentile(latencies, 0.5) * 1e6:>7.1f} us p50  {percentile(latencies, 0.99) * 1e6:>8.1f} us p99  {max(latencies) * 1e3:>6.2f} ms max  "
+              f"save {max(save_times) * 1e3:>6.2f} ms max  size {size / 1024:>7.0f} KB  {misses} lookup misses")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# userbot/copier.py
+
+import asyncio
+import io
+import logging
+
+from telethon.errors import ChatForwardsRestrictedError
+from telethon.tl.types import MessageMediaWebPage
+
+logger = logging.getLogger(__name__)
+
+# Bytes requested per download call when media has to be re-uploaded.
+DOWNLOAD_CHUNK_SIZE = 512 * 1024
+
+
+class MediaTooLargeError(Exception):
+    pass
+
+
+class MessageCopier:
+    """
+    Re-sends messages as our own ("copy" delivery) instead of forwarding them.
+
+    Text is sent with its formatting entities. Media already on Telegram's servers is re-sent
+    by reference (the photo/document InputMedia of the original), which costs one API call and no
+    transfer. Only when the source forbids that (protected content) is the media downloaded into
+    memory and uploaded again. That fallback holds at most `max_buffer` bytes at a time and never
+    touches the disk.
+    """
+
+    def __init__(self, client, max_buffer=50 * 1024 * 1024):
+        self._client = client
+        self._max_buffer = max_buffer
+        # One re-upload at a time keeps the fallback's memory bounded by max_buffer.
+        self._reupload_lock = asyncio.Lock()
+        self.metrics = {"copied": 0, "reused_media": 0, "reuploaded_media": 0, "too_large": 0}
+
+    async def copy(self, destination, messages):
+        """
+        Copies `messages` to `destination`: one message, or the parts of one album.
+        Returns the sent message(s).
+        """
+        if len(messages) == 1:
+            sent = await self._copy_single(destination, messages[0])
+        else:
+            sent = await self._copy_album(destination, messages)
+        self.metrics["copied"] += len(messages)
+        return sent
+
+    @staticmethod
+    def _has_file(message):
+        # Link previews are part of the text, not a file to re-send.
+        return message.media is not None and not isinstance(message.media, MessageMediaWebPage)
+
+    async def _copy_single(self, destination, message):
+        if self._has_file(message) and not message.noforwards:
+            try:
+                # Telethon re-sends the original media by reference and keeps text, entities and buttons.
+                sent = await self._client.send_message(destination, message)
+                self.metrics["reused_media"] += 1
+                return sent
+            except ChatForwardsRestrictedError:
+                pass
+        elif not self._has_file(message):
+            return await self._client.send_message(destination, message)
+
+        async with self._reupload_lock:
+            buffer = await self._download(message, self._max_buffer)
+            sent = await self._client.send_file(
+                destination,
+                buffer,
+                caption=message.message or "",
+                formatting_entities=message.entities,
+                attributes=getattr(message.document, "attributes", None),
+                mime_type=message.file.mime_type if message.document else None,
+            )
+        self.metrics["reuploaded_media"] += 1
+        return sent
+
+    async def _copy_album(self, destination, messages):
+        # Raw captions with their entities, one list per item, so formatting is copied as is.
+        captions = [message.message or "" for message in messages]
+        entities = [message.entities or [] for message in messages]
+        if not any(message.noforwards for message in messages):
+            try:
+                sent = await self._client.send_file(destination, [message.media for message in messages], caption=captions,
+                                                   formatting_entities=entities)
+                self.metrics["reused_media"] += len(messages)
+                return sent
+            except ChatForwardsRestrictedError:
+                pass
+
+        total = sum(message.file.size or 0 for message in messages if message.file)
+        if total > self._max_buffer:
+            # The album doesn't fit in the buffer as a whole; copy its parts one by one instead.
+            logger.warning(f"Album of {len(messages)} item(s) ({total} bytes) exceeds the copy buffer. Sending its items separately.")
+            return [await self._copy_single(destination, message) for message in messages]
+
+        async with self._reupload_lock:
+            buffers = []
+            for message in messages:
+                buffers.append(await self._download(message, self._max_buffer - sum(b.getbuffer().nbytes for b in buffers)))
+            sent = await self._client.send_file(destination, buffers, caption=captions, formatting_entities=entities)
+        self.metrics["reuploaded_media"] += len(messages)
+        return sent
+
+    async def _download(self, message, limit):
+        """
+        Streams the message's media into an in-memory buffer chunk by chunk, giving up
+        as soon as it would grow past `limit` bytes.
+        """
+        size = message.file.size if message.file else None
+        if size is not None and size > limit:
+            self.metrics["too_large"] += 1
+            raise MediaTooLargeError(f"media of message {message.id} is {size} bytes, over the {limit}-byte copy buffer")
+        buffer = io.BytesIO()
+        async for chunk in self._client.iter_download(message.media, request_size=DOWNLOAD_CHUNK_SIZE):
+            if buffer.tell() + len(chunk) > limit:
+                self.metrics["too_large"] += 1
+                raise MediaTooLargeError(f"media of message {message.id} exceeds the {limit}-byte copy buffer")
+            buffer.write(chunk)
+        buffer.seek(0)
+        # The name tells Telethon what kind of file it is uploading (photo, video, document...).
+        buffer.name = (message.file.name if message.file and message.file.name else None) or f"file{message.file.ext or ''}"
+        return buffer
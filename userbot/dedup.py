@@ -0,0 +1,160 @@
+# userbot/dedup.py
+
+import hashlib
+import re
+import time
+from collections import OrderedDict
+
+# Runs of anything but letters and digits; they separate words in the normalized text.
+_SEPARATORS = re.compile(r"[\W_]+")
+# Near-duplicate detection splits the 64-bit SimHash into this many bands. Two hashes that
+# differ in at most BANDS - 1 bits share at least one band exactly, so candidates are found
+# with one dict lookup per band.
+BANDS = 4
+BAND_BITS = 64 // BANDS
+MAX_DISTANCE = BANDS - 1
+# Texts with fewer words get no SimHash; on short texts it matches too much.
+SIMHASH_MIN_WORDS = 8
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data.encode(), digest_size=8).digest(), "big")
+
+
+def simhash(words):
+    """64-bit SimHash of the word 3-shingles of `words`."""
+    shingles = [" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))]
+    # Bit columns are counted on the binary strings, which keeps the per-bit loop in C.
+    rows = [format(_hash64(shingle), "064b") for shingle in shingles]
+    half = len(rows) / 2
+    bits = "".join("1" if column.count("1") > half else "0" for column in zip(*rows))
+    return int(bits, 2)
+
+
+class Fingerprint:
+    __slots__ = ("digest", "simhash")
+
+    def __init__(self, digest, simhash=None):
+        self.digest = digest
+        self.simhash = simhash
+
+
+def fingerprint(messages, near=False):
+    """
+    Fingerprints a message, or an album as a whole: a hash of the normalized text plus
+    the ids of the attached photos/documents, which stay the same when media is re-posted.
+    With `near`, long enough texts also get a SimHash. Returns None for messages with
+    neither text nor media, which are never treated as duplicates.
+    """
+    texts = []
+    media = []
+    for message in messages:
+        if message.message:
+            texts.append(message.message)
+        file = message.photo or message.document
+        if file is not None:
+            media.append(f"{type(file).__name__}:{file.id}")
+    words = _SEPARATORS.sub(" ", " ".join(texts).casefold()).split()
+    if not words and not media:
+        return None
+    digest = hashlib.blake2b(("\x00".join([" ".join(words)] + media)).encode(), digest_size=16).digest()
+    near_hash = None
+    if near and not media and len(words) >= SIMHASH_MIN_WORDS:
+        near_hash = simhash(words)
+    return Fingerprint(digest, near_hash)
+
+
+class DedupWindow:
+    """
+    Remembers what was recently sent to each destination, to drop repeats.
+
+    Fingerprints live in an insertion-ordered dict capped at `maxsize` entries across all
+    destinations, oldest evicted first, and expire `ttl` seconds after they were first seen,
+    so memory stays bounded however long the process runs. Exact repeats are one dict lookup. With
+    `max_distance` > 0 (at most 3), texts whose SimHash differs in that many bits or
+    fewer also count as repeats; they are found through the banded index in O(1).
+    A repeat does not extend the window, so content that keeps being reposted goes
+    through again once per `ttl`.
+    """
+
+    def __init__(self, maxsize=10000, ttl=3600.0, max_distance=0):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._max_distance = min(max(0, max_distance), MAX_DISTANCE)
+        # (destination_id, digest) -> (expires_at, simhash)
+        self._entries = OrderedDict()
+        # (destination_id, band number, band value) -> set of entry keys
+        self._bands = {}
+        self.metrics = {"checked": 0, "duplicates": 0, "near_duplicates": 0, "evictions": 0}
+
+    @property
+    def near(self):
+        return self._max_distance > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _band_keys(destination_id, value):
+        mask = (1 << BAND_BITS) - 1
+        return [(destination_id, band, value >> (band * BAND_BITS) & mask) for band in range(BANDS)]
+
+    def _remove(self, key):
+        _, near_hash = self._entries.pop(key)
+        if near_hash is not None:
+            for band_key in self._band_keys(key[0], near_hash):
+                bucket = self._bands.get(band_key)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._bands[band_key]
+
+    def _expire(self, now):
+        # Entries are in insertion order, so the expired ones are at the front.
+        while self._entries:
+            key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self._maxsize:
+                break
+            if expires_at > now:
+                self.metrics["evictions"] += 1
+            self._remove(key)
+
+    def _near_match(self, destination_id, value, now):
+        for band_key in self._band_keys(destination_id, value):
+            for key in self._bands.get(band_key, ()):
+                expires_at, other = self._entries[key]
+                if expires_at > now and bin(value ^ other).count("1") <= self._max_distance:
+                    return True
+        return False
+
+    def check(self, destination_id, fp):
+        """
+        Returns True if `fp` (a Fingerprint, or None) was already sent to `destination_id`
+        within the window. Otherwise records it and returns False.
+        """
+        if fp is None:
+            return False
+        self.metrics["checked"] += 1
+        now = time.monotonic()
+        key = (destination_id, fp.digest)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            self.metrics["duplicates"] += 1
+            return True
+        if fp.simhash is not None and self._max_distance and self._near_match(destination_id, fp.simhash, now):
+            self.metrics["near_duplicates"] += 1
+            return True
+        if entry is not None:
+            self._remove(key)
+        near_hash = fp.simhash if self._max_distance else None
+        self._entries[key] = (now + self._ttl, near_hash)
+        if near_hash is not None:
+            for band_key in self._band_keys(destination_id, near_hash):
+                self._bands.setdefault(band_key, set()).add(key)
+        self._expire(now)
+        return False
+
+    def forget(self, destination_id, fp):
+        """Drops `fp` from the window of `destination_id`, e.g. because sending it failed."""
+        if fp is not None and (destination_id, fp.digest) in self._entries:
+            self._remove((destination_id, fp.digest))
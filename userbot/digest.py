@@ -0,0 +1,216 @@
+# userbot/digest.py
+
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from routes import Route
+
+logger = logging.getLogger(__name__)
+
+# Telegram's limit on the length of one text message.
+MAX_MESSAGE_LENGTH = 4096
+
+
+def excerpt(messages, limit):
+    """One line for a digest: the start of the message's (or album's) text, or what kind of media it is."""
+    text = next((message.message for message in messages if message.message), "")
+    text = " ".join(text.split())
+    if len(text) > limit:
+        text = text[:limit - 1].rstrip() + "…"
+    if not text:
+        text = "[media]" if any(getattr(message, "media", None) is not None for message in messages) else "[message]"
+    if len(messages) > 1:
+        text += f" ({len(messages)} items)"
+    return text
+
+
+def link(source_id, message_id):
+    """A t.me link to a message in a channel or supergroup; None for other chats, which have no links."""
+    text = str(source_id)
+    if text.startswith("-100"):
+        return f"https://t.me/c/{text[4:]}/{message_id}"
+    return None
+
+
+def render(source_id, entries):
+    """
+    The digest's text for `entries` [(message_id, excerpt), ...], split into messages Telegram
+    accepts. Returns [(text, [message_id, ...]), ...], each part with the entries it lists.
+    """
+    header = f"Digest: {len(entries)} message(s) from {source_id}"
+    parts, part, message_ids = [], header, []
+    for message_id, text in entries:
+        url = link(source_id, message_id)
+        line = f"• {text}\n{url}" if url else f"• {text}"
+        if len(part) + 2 + len(line) > MAX_MESSAGE_LENGTH:
+            parts.append((part, message_ids))
+            part, message_ids = line[:MAX_MESSAGE_LENGTH], []
+        else:
+            part += "\n\n" + line
+        message_ids.append(message_id)
+    parts.append((part, message_ids))
+    return parts
+
+
+class DigestBuffer:
+    """
+    Collects the messages accepted by 'digest' routes and posts them as one summary message
+    per route every `digest_interval` seconds, or as soon as `digest_max` messages are waiting,
+    instead of one forward each.
+
+    A digest holds an excerpt and a link per message, not the message itself, so a buffer is
+    about `digest_max` short lines. Messages that arrive while a digest is being posted (through a
+    flood wait, say) start the next one, which is posted right after it if it is due by then.
+    Entries are written to an SQLite table in the journal file as they arrive and deleted once
+    posted, so a restarted userbot posts what it had collected.
+    """
+
+    def __init__(self, userbot, path, excerpt_chars=200, tick=1.0):
+        self._userbot = userbot
+        self._path = path
+        self._excerpt_chars = excerpt_chars
+        self._tick = tick
+        # (source_id, destination_id) -> [started, [(message_id, excerpt), ...]], started being a Unix time.
+        self._buffers = {}
+        # Running posts by key, and the keys whose next digest came due meanwhile.
+        self._posting = {}
+        self._due = set()
+        # sqlite3 connections must stay on one thread, so all disk work goes through this executor.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="digest")
+        self._db = None
+        self._task = None
+        self.metrics = {"added": 0, "digests": 0, "posted": 0}
+
+    def __len__(self):
+        return sum(len(entries) for _, entries in self._buffers.values())
+
+    def _open(self):
+        self._db = sqlite3.connect(self._path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS digest_entries ("
+            " source_id INTEGER NOT NULL,"
+            " destination_id INTEGER NOT NULL,"
+            " message_id INTEGER NOT NULL,"
+            " excerpt TEXT NOT NULL,"
+            " added REAL NOT NULL,"
+            " PRIMARY KEY (source_id, destination_id, message_id)"
+            ") WITHOUT ROWID"
+        )
+        self._db.commit()
+        return self._db.execute("SELECT source_id, destination_id, message_id, excerpt, added FROM digest_entries ORDER BY added, message_id").fetchall()
+
+    def _insert(self, row):
+        self._db.execute("INSERT OR REPLACE INTO digest_entries (source_id, destination_id, message_id, excerpt, added) VALUES (?, ?, ?, ?, ?)", row)
+        self._db.commit()
+
+    def _delete(self, key, message_ids):
+        self._db.executemany(
+            "DELETE FROM digest_entries WHERE source_id = ? AND destination_id = ? AND message_id = ?",
+            [(*key, message_id) for message_id in message_ids],
+        )
+        self._db.commit()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def open(self):
+        """Loads the entries collected before a restart and starts posting due digests."""
+        for source_id, destination_id, message_id, text, added in await self._run(self._open):
+            buffer = self._buffers.setdefault((source_id, destination_id), [added, []])
+            buffer[1].append((message_id, text))
+        if self._buffers:
+            self._userbot.log.info(f"Resuming {len(self._buffers)} digest(s) with {len(self)} message(s) collected before the restart.")
+        self._task = asyncio.ensure_future(self._maintain())
+
+    async def add(self, route, messages):
+        """Adds a message (or album) accepted by a digest route to the route's next digest."""
+        key = (route.source_id, route.destination_id)
+        message_id = messages[0].id
+        text = excerpt(messages, self._excerpt_chars)
+        now = time.time()
+        await self._run(self._insert, (*key, message_id, text, now))
+        buffer = self._buffers.setdefault(key, [now, []])
+        buffer[1].append((message_id, text))
+        self.metrics["added"] += 1
+        # Collected is as good as forwarded: a restart posts it, so the catch-up doesn't start earlier.
+        if self._userbot.journal is not None:
+            self._userbot.journal.record(route, max(message.id for message in messages))
+        if len(buffer[1]) >= route.digest_max:
+            self._post_later(key)
+
+    def _route(self, key):
+        """The digest route between the two chats, or a default one if it was removed or changed mode."""
+        for route in self._userbot.route_table.lookup(key[0]):
+            if route.destination_id == key[1] and route.mode == "digest":
+                return route
+        return None
+
+    def _post_later(self, key):
+        if key in self._posting:
+            self._due.add(key)
+            return
+        task = self._posting[key] = asyncio.ensure_future(self._post_due(key))
+        task.add_done_callback(lambda _: self._posting.pop(key, None))
+
+    async def _post_due(self, key):
+        await self._post(key)
+        while key in self._due:
+            self._due.discard(key)
+            await self._post(key)
+
+    async def _post(self, key):
+        started, entries = self._buffers.pop(key, (None, []))
+        if not entries:
+            return
+        route = self._route(key) or Route(*key)
+        parts = render(key[0], entries)
+        posted = 0
+        for text, message_ids in parts:
+
+            async def send(route, message_ids, text=text):
+                await self._userbot.client.send_message(self._userbot.peers.get(route.destination_id), text, link_preview=False)
+
+            # Each part is paced and retried on its own with the destination's forwards, so a retry
+            # never repeats parts already sent. A part given up on is dropped like a failed forward.
+            if await self._userbot.send_queue.send(route, message_ids, send):
+                posted += len(message_ids)
+            # Removed part by part, so a restart mid-digest doesn't post the sent parts again.
+            try:
+                await self._run(self._delete, key, message_ids)
+            except Exception as e:
+                logger.error(f"Error removing posted digest entries: {e}")
+        if posted:
+            self.metrics["digests"] += 1
+            self.metrics["posted"] += posted
+            self._userbot.log.info(f"Posted a digest of {posted} of {len(entries)} message(s) from {key[0]} to {key[1]} in {len(parts)} message(s).")
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(self._tick)
+            now = time.time()
+            for key, (started, _) in list(self._buffers.items()):
+                route = self._route(key)
+                # Entries of a route that is no longer a digest route are posted right away.
+                if route is None or now - started >= route.digest_interval:
+                    self._post_later(key)
+
+    async def close(self):
+        """Stops posting. Collected entries stay on disk and are posted after the next start."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        # Before the database closes under them.
+        posting = list(self._posting.values())
+        for task in posting:
+            task.cancel()
+        await asyncio.gather(*posting, return_exceptions=True)
+        self._due.clear()
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,179 @@
+# userbot/journal.py
+
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class ForwardJournal:
+    """
+    Remembers the last message id forwarded along each route, so a restarted userbot
+    can forward whatever was posted to the source while it was down.
+
+    Checkpoints are kept in memory and written to a local SQLite file in the background
+    every `flush_interval` seconds and at shutdown, so the hot path never waits on disk.
+    A crash loses at most one interval of checkpoints, which means those messages are
+    forwarded again on restart rather than missed.
+
+    Right before a batch is sent, `begin()` writes its last id to an 'inflight' table. A send that
+    fails takes the mark back with `abort()`; a sent batch's mark is dropped when its checkpoint is
+    written. On open, an in-flight mark beyond its route's checkpoint becomes the checkpoint, so a
+    batch that was being sent when the process stopped isn't forwarded a second time by the catch-up.
+    Optionally the checkpoints are mirrored to the Supabase 'forward_journal' table, for
+    deployments whose local disk doesn't survive a redeploy.
+    """
+
+    def __init__(self, path, flush_interval=1.0, database=None, user_id=None):
+        self._path = path
+        self._flush_interval = flush_interval
+        self._database = database
+        self._user_id = user_id
+        self._checkpoints = {}
+        self._dirty = {}
+        # sqlite3 connections must stay on one thread, so all disk work goes through this executor.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+        self._db = None
+        self._task = None
+
+    def _open(self):
+        self._db = sqlite3.connect(self._path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            " source_id INTEGER NOT NULL,"
+            " destination_id INTEGER NOT NULL,"
+            " last_id INTEGER NOT NULL,"
+            " PRIMARY KEY (source_id, destination_id)"
+            ") WITHOUT ROWID"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS inflight ("
+            " source_id INTEGER NOT NULL,"
+            " destination_id INTEGER NOT NULL,"
+            " last_id INTEGER NOT NULL,"
+            " PRIMARY KEY (source_id, destination_id)"
+            ") WITHOUT ROWID"
+        )
+        self._db.commit()
+        checkpoints = {(source_id, destination_id): last_id for source_id, destination_id, last_id in self._db.execute("SELECT source_id, destination_id, last_id FROM checkpoints")}
+        inflight = {(source_id, destination_id): last_id for source_id, destination_id, last_id in self._db.execute("SELECT source_id, destination_id, last_id FROM inflight")}
+        return checkpoints, inflight
+
+    def _write(self, rows):
+        self._db.executemany(
+            "INSERT INTO checkpoints (source_id, destination_id, last_id) VALUES (?, ?, ?)"
+            " ON CONFLICT (source_id, destination_id) DO UPDATE SET last_id = MAX(last_id, excluded.last_id)",
+            rows,
+        )
+        # Marks of batches the checkpoints now cover, in the same transaction.
+        self._db.execute(
+            "DELETE FROM inflight WHERE last_id <= (SELECT checkpoints.last_id FROM checkpoints"
+            " WHERE checkpoints.source_id = inflight.source_id AND checkpoints.destination_id = inflight.destination_id)"
+        )
+        self._db.commit()
+
+    def _write_inflight(self, row):
+        self._db.execute(
+            "INSERT INTO inflight (source_id, destination_id, last_id) VALUES (?, ?, ?)"
+            " ON CONFLICT (source_id, destination_id) DO UPDATE SET last_id = MAX(last_id, excluded.last_id)",
+            row,
+        )
+        self._db.commit()
+
+    def _reset_inflight(self, source_id, destination_id, last_id):
+        if last_id is None:
+            self._db.execute("DELETE FROM inflight WHERE source_id = ? AND destination_id = ?", (source_id, destination_id))
+        else:
+            self._db.execute("UPDATE inflight SET last_id = ? WHERE source_id = ? AND destination_id = ?", (last_id, source_id, destination_id))
+        self._db.commit()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def open(self):
+        """Loads the stored checkpoints and starts the background flusher."""
+        self._checkpoints, inflight = await self._run(self._open)
+        for key, last_id in inflight.items():
+            if last_id > self._checkpoints.get(key, 0):
+                # Cut off mid-send: the batch may well have arrived, so don't send it again.
+                logger.warning(f"A batch up to message {last_id} from {key[0]} to {key[1]} was being sent when the userbot stopped. It is not forwarded again.")
+                self._record(key, last_id)
+        if self._database is not None and self._user_id is not None:
+            try:
+                table = await self._database.table("forward_journal")
+                rows = await self._database.execute(table.select("source_id, destination_id, last_id").eq("user_id", self._user_id))
+                for row in rows:
+                    key = (int(row["source_id"]), int(row["destination_id"]))
+                    if int(row["last_id"]) > self._checkpoints.get(key, 0):
+                        self._checkpoints[key] = int(row["last_id"])
+            except Exception as e:
+                logger.warning(f"Could not load forward journal from Supabase: {e}. Using the local journal only.")
+        self._task = asyncio.ensure_future(self._flush_periodically())
+        logger.info(f"Forward journal loaded: {len(self._checkpoints)} checkpoint(s) from {self._path}")
+
+    def get(self, route):
+        """Returns the last message id forwarded along `route`, or None if it has no checkpoint yet."""
+        return self._checkpoints.get((route.source_id, route.destination_id))
+
+    async def begin(self, route, message_id):
+        """Marks a batch up to `message_id` as being sent along `route`, on disk before returning."""
+        await self._run(self._write_inflight, (route.source_id, route.destination_id, message_id))
+
+    async def abort(self, route):
+        """
+        Takes back the mark of a send along `route` that failed. Batches sent before it stay
+        marked until their checkpoint is written.
+        """
+        await self._run(self._reset_inflight, route.source_id, route.destination_id, self.get(route))
+
+    def record(self, route, message_id):
+        """Moves the checkpoint of `route` forward to `message_id`. Never moves it back."""
+        self._record((route.source_id, route.destination_id), message_id)
+
+    def _record(self, key, message_id):
+        if message_id > self._checkpoints.get(key, 0):
+            self._checkpoints[key] = message_id
+            self._dirty[key] = message_id
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        rows = [(source_id, destination_id, last_id) for (source_id, destination_id), last_id in dirty.items()]
+        try:
+            await self._run(self._write, rows)
+        except Exception as e:
+            logger.error(f"Error writing forward journal: {e}")
+            # Keep the checkpoints for the next flush.
+            for key, last_id in dirty.items():
+                self._dirty.setdefault(key, last_id)
+            return
+        if self._database is not None and self._user_id is not None:
+            payload = [
+                {"user_id": self._user_id, "source_id": source_id, "destination_id": destination_id, "last_id": last_id}
+                for source_id, destination_id, last_id in rows
+            ]
+            try:
+                table = await self._database.table("forward_journal")
+                await self._database.execute(table.upsert(payload))
+            except Exception as e:
+                logger.warning(f"Could not sync forward journal to Supabase: {e}")
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,227 @@
+# userbot/matcher.py
+#
+# Compiled matchers for the keyword and filter modes. Both fold their literal terms into one
+# prefix trie rendered as a single regular expression.
+
+import re
+
+from rules import parse
+
+# Up to this many keywords, plain substring checks beat the compiled regex (see bench_keywords.py).
+NAIVE_MAX_KEYWORDS = 50
+
+
+def _render(node):
+    """Renders a trie node as a regex fragment, longest alternatives first."""
+    optional = "" in node
+    branches = []
+    single_chars = []
+    for char in sorted(k for k in node if k):
+        child = node[char]
+        if len(child) == 1 and "" in child:
+            single_chars.append(re.escape(char))
+        else:
+            branches.append(re.escape(char) + _render(child))
+    if single_chars:
+        branches.append(single_chars[0] if len(single_chars) == 1 else "[" + "".join(single_chars) + "]")
+    if not branches:
+        return ""
+    result = branches[0] if len(branches) == 1 and not optional else "(?:" + "|".join(branches) + ")"
+    if optional:
+        result += "?"
+    return result
+
+
+def _compile_trie(words):
+    """
+    Folds `words` into a prefix trie. Returns the regex fragment that matches the longest word
+    starting at a position, and for every word the words that are its prefixes (itself included).
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+    # At a given position the regex reports the longest word. Every shorter word that also
+    # starts there is a prefix of it, so precompute those.
+    prefixes = {}
+    for word in words:
+        node = trie
+        found = []
+        for i, char in enumerate(word, 1):
+            node = node[char]
+            if "" in node:
+                found.append(word[:i])
+        prefixes[word] = found
+    return _render(trie), prefixes
+
+
+class KeywordMatcher:
+    """
+    Compiled multi-keyword matcher used by the userbot's keyword mode.
+
+    All keywords are folded into a prefix trie which is then rendered as a single
+    regular expression, so a message is scanned once by the C regex engine no matter
+    how many keywords are configured. Build it once whenever the keyword set changes
+    and reuse it for every message.
+
+    The regex only pays off for larger sets: at 10 keywords it is slower than checking each
+    keyword with `in`, so sets of up to NAIVE_MAX_KEYWORDS keywords are matched that way.
+    """
+
+    def __init__(self, keywords):
+        # Keywords are stored lowercased; the text is lowercased once per message instead.
+        self.keywords = sorted({str(k).lower() for k in keywords if k})
+        self._prefixes = {}
+        self._pattern = None
+        self._search = None
+        self._naive = len(self.keywords) <= NAIVE_MAX_KEYWORDS
+        if self.keywords and not self._naive:
+            body, self._prefixes = _compile_trie(self.keywords)
+            self._pattern = re.compile(body)
+            # A zero-width lookahead lets finditer report a hit at every start position,
+            # including keywords that overlap each other.
+            self._all = re.compile(f"(?=({body}))")
+            self._search = self._pattern.search
+
+    def __bool__(self):
+        return bool(self.keywords)
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def search(self, text):
+        """Returns True if any keyword occurs in ``text`` (case-insensitive)."""
+        if not self.keywords or not text:
+            return False
+        if self._naive:
+            lowered = text.lower()
+            return any(keyword in lowered for keyword in self.keywords)
+        return self._search(text.lower()) is not None
+
+    def find(self, text):
+        """
+        Returns the sorted list of keywords that occur in ``text`` (case-insensitive).
+        An empty list means no match.
+        """
+        if not self.keywords or not text:
+            return []
+        lowered = text.lower()
+        if self._naive:
+            return [keyword for keyword in self.keywords if keyword in lowered]
+        # Cheap rejection first: most messages don't match anything.
+        if self._search(lowered) is None:
+            return []
+        hits = set()
+        for match in self._all.finditer(lowered):
+            hits.update(self._prefixes[match.group(1)])
+        return sorted(hits)
+
+
+class CompiledFilter:
+    """
+    A filter rule (see rules.py) compiled for fast evaluation.
+
+    Plain and whole-word terms are folded into a prefix trie rendered as one regex, so a single
+    scan of the lowercased message finds every literal term that occurs, however many there are.
+    Regex terms are searched as one alternation, and only from its first match on are they
+    scanned with zero-width lookaheads to learn which of them occur.
+    A message without hits (the common case) is rejected after the scans; otherwise the boolean
+    tree is evaluated on the terms found. A regex term can only be missed when another regex
+    term matched at the same position, so only those positions are checked again.
+    """
+
+    def __init__(self, text):
+        self.text = str(text or "").strip()
+        self._tree, self.terms = parse(self.text)
+
+        # Literal terms by value: (index of the substring term, index of the whole-word term).
+        self._literals = {}
+        regexes = []
+        for index, (kind, value) in enumerate(self.terms):
+            if kind == "regex":
+                regexes.append((index, value))
+            else:
+                slots = self._literals.setdefault(value, [None, None])
+                slots[kind == "word"] = index
+
+        self._literal_search = None
+        if self._literals:
+            body, self._prefixes = _compile_trie(self._literals)
+            self._literal_search = re.compile(body).search
+            # At each position the scan reports the longest literal; the shorter ones starting
+            # there are its prefixes.
+            self._literal_all = re.compile(f"(?=({body}))")
+
+        self._regex_scan = None
+        self._regex_patterns = {}
+        if regexes:
+            self._regex_search = re.compile("|".join(f"(?:{value})" for _, value in regexes), re.IGNORECASE).search
+            self._regex_scan = re.compile(
+                "|".join(f"(?=(?P<t{index}>{value}))" for index, value in regexes), re.IGNORECASE
+            )
+            self._regex_patterns = {index: re.compile(value, re.IGNORECASE) for index, value in regexes}
+            self._group_term = {f"t{index}": index for index, _ in regexes}
+
+    def __repr__(self):
+        return f"CompiledFilter({self.text!r})"
+
+    def _find_literals(self, text, found):
+        lowered = text.lower()
+        # Cheap rejection first: most messages contain no term at all.
+        if self._literal_search(lowered) is None:
+            return
+        end_of_text = len(lowered)
+        for match in self._literal_all.finditer(lowered):
+            start = match.start()
+            # Word boundaries, like (?<!\w)term(?!\w).
+            open_before = start == 0 or not (lowered[start - 1].isalnum() or lowered[start - 1] == "_")
+            for value in self._prefixes[match.group(1)]:
+                text_index, word_index = self._literals[value]
+                if text_index is not None:
+                    found.add(text_index)
+                if word_index is not None and open_before:
+                    end = start + len(value)
+                    if end == end_of_text or not (lowered[end].isalnum() or lowered[end] == "_"):
+                        found.add(word_index)
+
+    def match(self, text):
+        """Returns True if `text` satisfies the rule."""
+        text = text or ""
+        found = set()
+        if self._literal_search is not None:
+            self._find_literals(text, found)
+        positions = []
+        if self._regex_scan is not None:
+            # No regex term matches before the leftmost match of any of them, so scan from there.
+            first = self._regex_search(text)
+            group_term = self._group_term
+            for match in self._regex_scan.finditer(text, first.start() if first else len(text) + 1):
+                found.add(group_term[match.lastgroup])
+                positions.append(match.start())
+        checked = {}
+
+        def truth(index):
+            if index in found:
+                return True
+            # Literal terms are always found by the trie scan; regex terms only hide behind each other.
+            if not positions or index not in self._regex_patterns:
+                return False
+            if index not in checked:
+                term_match = self._regex_patterns[index].match
+                checked[index] = any(term_match(text, pos) for pos in positions)
+            return checked[index]
+
+        return self._evaluate(self._tree, truth)
+
+    @classmethod
+    def _evaluate(cls, node, truth):
+        kind = node[0]
+        if kind == "term":
+            return truth(node[1])
+        if kind == "not":
+            return not cls._evaluate(node[1], truth)
+        if kind == "and":
+            return all(cls._evaluate(child, truth) for child in node[1])
+        return any(cls._evaluate(child, truth) for child in node[1])
@@ -0,0 +1,213 @@
+# userbot/metrics.py
+
+import asyncio
+import bisect
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds, in seconds.
+MATCH_TIME_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05)
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labelvalues, amount=1):
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        for labelvalues, value in self._values.items():
+            yield self.name, self.labelnames, labelvalues, value
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram per label set. Observing is a bisect and two additions,
+    cheap enough for the per-message path.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        # Per label set: [count per bucket (last one is +Inf), sum].
+        self._values = {}
+
+    def observe(self, value, *labelvalues):
+        state = self._values.get(labelvalues)
+        if state is None:
+            state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self):
+        for labelvalues, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", self.labelnames + ("le",), labelvalues + (bound,), cumulative
+            yield f"{self.name}_sum", self.labelnames, labelvalues, total
+            yield f"{self.name}_count", self.labelnames, labelvalues, cumulative
+
+
+class Collected:
+    """
+    A metric whose values are read from elsewhere at scrape time. `collect()` returns
+    a dict of label values (a tuple) to value, e.g. the send queue's depth per destination.
+    """
+
+    def __init__(self, kind, name, help, collect, labelnames=()):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._collect = collect
+
+    def samples(self):
+        for labelvalues, value in self._collect().items():
+            yield self.name, self.labelnames, labelvalues, value
+
+
+class MetricsRegistry:
+    """
+    The metrics of one userbot account, rendered in the Prometheus text format.
+    `const_labels` (e.g. {"account": "alice"}) are added to every sample, so the
+    registries of several accounts can be served side by side.
+    """
+
+    def __init__(self, const_labels=None):
+        self._metrics = []
+        self._const_names = tuple(const_labels or {})
+        self._const_values = tuple((const_labels or {}).values())
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, buckets, labelnames=()):
+        return self._register(Histogram(name, help, buckets, labelnames))
+
+    def collected(self, kind, name, help, collect, labelnames=()):
+        return self._register(Collected(kind, name, help, collect, labelnames))
+
+    def render(self):
+        return render([self])
+
+
+def render(registries):
+    """
+    Renders `registries` as one Prometheus text page. Metrics of the same name are
+    grouped under a single HELP/TYPE header, as the format requires.
+    """
+    grouped = {}
+    for registry in registries:
+        for metric in registry._metrics:
+            grouped.setdefault(metric.name, []).append((registry, metric))
+    lines = []
+    for name, entries in grouped.items():
+        lines.append(f"# HELP {name} {entries[0][1].help}")
+        lines.append(f"# TYPE {name} {entries[0][1].kind}")
+        for registry, metric in entries:
+            try:
+                for sample, labelnames, labelvalues, value in metric.samples():
+                    labels = _format_labels(registry._const_names + labelnames, registry._const_values + labelvalues)
+                    lines.append(f"{sample}{labels} {_format_value(value)}")
+            except Exception as e:
+                logger.warning(f"Could not collect metric {name}: {e}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Minimal HTTP server that answers GET /metrics with the contents of `registries`,
+    a list that may grow while the server runs (one registry per account).
+    Bound to localhost by default, so only a local scraper or sidecar can read it.
+    """
+
+    def __init__(self, registries, host="127.0.0.1", port=9464):
+        self._registries = registries
+        self._host = host
+        self._port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self._host, self._port)
+        logger.info(f"Metrics available at http://{self._host}:{self._port}/metrics")
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain the headers; the request has no body we care about.
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", render(self._registries).encode()
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+class SampledLog:
+    """
+    Gate for per-message log lines. `enabled()` is true for every `every`-th call
+    (0 turns them off) and only if INFO is enabled, so callers can skip building
+    the f-string entirely on busy channels.
+    """
+
+    def __init__(self, logger, every=1):
+        self._logger = logger
+        self._every = every
+        self._calls = 0
+
+    def enabled(self):
+        if self._every <= 0 or not self._logger.isEnabledFor(logging.INFO):
+            return False
+        self._calls += 1
+        if self._calls >= self._every:
+            self._calls = 0
+            return True
+        return False
@@ -0,0 +1,158 @@
+# userbot/msgmap.py
+
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class MessageMap:
+    """
+    Remembers which destination message each forwarded or copied source message became,
+    so edits and deletions in the source can be applied to the destination.
+
+    Pairs live in an SQLite table keyed by (source chat, source message), which makes a lookup
+    one B-tree search however many millions of pairs there are; only pairs recorded in the last
+    `flush_interval` seconds are held in memory. Pairs older than `retention` seconds are purged,
+    so the file stops growing once the window is full. The table sits next to the forward
+    journal's checkpoints in the same file.
+    """
+
+    def __init__(self, path, retention=7 * 86400, flush_interval=1.0, purge_interval=3600.0):
+        self._path = path
+        self._retention = retention
+        self._flush_interval = flush_interval
+        self._purge_interval = purge_interval
+        # (source_id, source_msg) -> [(destination_id, destination_msg), ...], not yet written.
+        self._pending = {}
+        # sqlite3 connections must stay on one thread, so all disk work goes through this executor.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="msgmap")
+        self._db = None
+        self._task = None
+        self.metrics = {"recorded": 0, "lookups": 0, "found": 0, "purged": 0}
+
+    def _open(self):
+        self._db = sqlite3.connect(self._path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS message_map ("
+            " source_id INTEGER NOT NULL,"
+            " source_msg INTEGER NOT NULL,"
+            " destination_id INTEGER NOT NULL,"
+            " destination_msg INTEGER NOT NULL,"
+            " created INTEGER NOT NULL,"
+            " PRIMARY KEY (source_id, source_msg, destination_id)"
+            ") WITHOUT ROWID"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS message_map_created ON message_map (created)")
+        self._db.commit()
+
+    def _write(self, rows):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO message_map (source_id, source_msg, destination_id, destination_msg, created) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        self._db.commit()
+
+    def _select(self, source_id, source_msgs):
+        placeholders = ",".join("?" * len(source_msgs))
+        return self._db.execute(
+            f"SELECT source_msg, destination_id, destination_msg FROM message_map WHERE source_id = ? AND source_msg IN ({placeholders})",
+            (source_id, *source_msgs),
+        ).fetchall()
+
+    def _delete(self, source_id, source_msgs):
+        placeholders = ",".join("?" * len(source_msgs))
+        self._db.execute(f"DELETE FROM message_map WHERE source_id = ? AND source_msg IN ({placeholders})", (source_id, *source_msgs))
+        self._db.commit()
+
+    def _purge(self, before):
+        deleted = self._db.execute("DELETE FROM message_map WHERE created < ?", (before,)).rowcount
+        self._db.commit()
+        return deleted
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def open(self):
+        """Opens the table and starts the background flusher and purger."""
+        await self._run(self._open)
+        self._task = asyncio.ensure_future(self._maintain())
+
+    def record(self, route, messages, sent):
+        """Remembers that `messages` from the route's source became `sent` (in the same order) at its destination."""
+        for message, copy in zip(messages, sent):
+            if copy is not None:
+                self._pending.setdefault((route.source_id, message.id), []).append((route.destination_id, copy.id))
+                self.metrics["recorded"] += 1
+
+    async def lookup(self, source_id, source_msgs):
+        """Returns {source_msg: [(destination_id, destination_msg), ...]} for the given source messages."""
+        self.metrics["lookups"] += 1
+        found = {}
+        for source_msg in source_msgs:
+            pairs = self._pending.get((source_id, source_msg))
+            if pairs:
+                found.setdefault(source_msg, []).extend(pairs)
+        source_msgs = list(source_msgs)
+        # SQLite allows 999 bound parameters per statement in older builds.
+        for i in range(0, len(source_msgs), 500):
+            for source_msg, destination_id, destination_msg in await self._run(self._select, source_id, source_msgs[i:i + 500]):
+                pairs = found.setdefault(source_msg, [])
+                if (destination_id, destination_msg) not in pairs:
+                    pairs.append((destination_id, destination_msg))
+        self.metrics["found"] += len(found)
+        return found
+
+    async def forget(self, source_id, source_msgs):
+        """Drops the pairs of deleted source messages."""
+        source_msgs = list(source_msgs)
+        for source_msg in source_msgs:
+            self._pending.pop((source_id, source_msg), None)
+        for i in range(0, len(source_msgs), 500):
+            await self._run(self._delete, source_id, source_msgs[i:i + 500])
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        now = int(time.time())
+        rows = [
+            (source_id, source_msg, destination_id, destination_msg, now)
+            for (source_id, source_msg), pairs in pending.items()
+            for destination_id, destination_msg in pairs
+        ]
+        try:
+            await self._run(self._write, rows)
+        except Exception as e:
+            logger.error(f"Error writing message map: {e}")
+            # Keep the pairs for the next flush.
+            for key, pairs in pending.items():
+                self._pending.setdefault(key, []).extend(pairs)
+
+    async def _maintain(self):
+        last_purge = 0.0
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+            if time.monotonic() - last_purge >= self._purge_interval:
+                last_purge = time.monotonic()
+                try:
+                    purged = await self._run(self._purge, int(time.time() - self._retention))
+                    self.metrics["purged"] += purged
+                except Exception as e:
+                    logger.error(f"Error purging message map: {e}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        self._executor.shutdown(wait=False)
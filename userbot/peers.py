@@ -0,0 +1,102 @@
+# userbot/peers.py
+
+import asyncio
+import logging
+
+from telethon import utils
+from telethon.errors import (
+    ChannelInvalidError,
+    ChannelPrivateError,
+    ChatIdInvalidError,
+    PeerIdInvalidError,
+)
+
+logger = logging.getLogger(__name__)
+
+# Errors meaning a cached peer no longer works: access was lost, or the access hash or
+# chat id is stale (e.g. a basic group that was migrated to a supergroup).
+STALE_PEER_ERRORS = (ChannelInvalidError, ChannelPrivateError, ChatIdInvalidError, PeerIdInvalidError)
+# Chats resolved at once during a warm-up.
+WARM_UP_CONCURRENCY = 8
+
+
+class PeerCache:
+    """
+    Resolves the routes' chat ids to InputPeers once, so sending and reading history
+    never pay for resolving the same chat again.
+
+    `resolve` fetches the chat with get_entity, which also proves the account can access it,
+    and keeps the InputPeer until `invalidate` is called, e.g. on a STALE_PEER_ERRORS error.
+    A basic group that was migrated resolves to its supergroup. Concurrent resolves of one
+    chat share a single request.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._peers = {}
+        self._pending = {}
+        self.metrics = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def __len__(self):
+        return len(self._peers)
+
+    def __contains__(self, chat_id):
+        return chat_id in self._peers
+
+    def get(self, chat_id):
+        """Returns the cached InputPeer of `chat_id`, or `chat_id` itself if it isn't resolved yet."""
+        peer = self._peers.get(chat_id)
+        if peer is None:
+            self.metrics["misses"] += 1
+            return chat_id
+        self.metrics["hits"] += 1
+        return peer
+
+    async def resolve(self, chat_id):
+        """Returns the InputPeer of `chat_id`, resolving it if needed. Raises if the chat is inaccessible."""
+        peer = self._peers.get(chat_id)
+        if peer is not None:
+            return peer
+        future = self._pending.get(chat_id)
+        if future is None:
+            future = self._pending[chat_id] = asyncio.ensure_future(self._fetch(chat_id))
+            future.add_done_callback(lambda _: self._pending.pop(chat_id, None))
+        return await asyncio.shield(future)
+
+    async def _fetch(self, chat_id):
+        entity = await self._client.get_entity(chat_id)
+        migrated_to = getattr(entity, "migrated_to", None)
+        if migrated_to is not None:
+            entity = await self._client.get_entity(migrated_to)
+            logger.warning(f"Chat {chat_id} was migrated to supergroup {entity.id}; sending there. Update the route to use -100{entity.id}.")
+        peer = utils.get_input_peer(entity)
+        self._peers[chat_id] = peer
+        return peer
+
+    async def warm(self, chat_ids):
+        """
+        Resolves `chat_ids` concurrently. Returns {chat_id: exception} for the chats
+        that could not be resolved.
+        """
+        semaphore = asyncio.Semaphore(WARM_UP_CONCURRENCY)
+
+        async def resolve(chat_id):
+            async with semaphore:
+                try:
+                    await self.resolve(chat_id)
+                except Exception as e:
+                    return chat_id, e
+            return chat_id, None
+
+        results = await asyncio.gather(*(resolve(chat_id) for chat_id in set(chat_ids)))
+        return {chat_id: error for chat_id, error in results if error is not None}
+
+    def invalidate(self, *chat_ids):
+        for chat_id in chat_ids:
+            if self._peers.pop(chat_id, None) is not None:
+                self.metrics["invalidations"] += 1
+
+    def retain(self, chat_ids):
+        """Forgets the peers of chats that are no longer in `chat_ids`."""
+        for chat_id in set(self._peers) - set(chat_ids):
+            del self._peers[chat_id]
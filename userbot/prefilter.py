@@ -0,0 +1,185 @@
+# prefilter.py
+#
+# Metadata prefilters shared by the bot and the userbot.
+# A prefilter decides on fields Telegram already sent with a message - media type, file size,
+# sender, forward header, album - before any of the message's text is looked at, so messages
+# it rejects cost no text processing. The bot parses it to validate it before saving it to
+# 'user_configs'; the userbot compiles it once per config load and checks it for every message.
+# This file is kept identical in telegram_bot/ and userbot/ since each is deployed on its own.
+#
+# Syntax (space-separated, all conditions must hold):
+#   media:document,video    only these kinds: text, photo, video, gif, audio, voice, sticker, document, other
+#   max_size:20MB           files up to this size (B, KB, MB, GB); messages without a file pass
+#   min_size:100KB          files of at least this size; messages without a file pass
+#   from:12345,67890        only messages sent by these user or chat ids
+#   forwarded:no            only originals (forwarded:only for forwards only)
+#   album:no                no album parts (album:only for albums only)
+
+import re
+
+MEDIA_KINDS = ("text", "photo", "video", "gif", "audio", "voice", "sticker", "document", "other")
+# Checked in this order, cheapest first; a message is counted under the first stage that rejects it.
+STAGES = ("forwarded", "album", "sender", "media", "size")
+MAX_SENDERS = 100
+
+_SIZE = re.compile(r"(\d+(?:\.\d+)?)\s*(b|kb|mb|gb)?", re.IGNORECASE)
+_UNITS = {"b": 1, "kb": 1024, "mb": 1024 ** 2, "gb": 1024 ** 3}
+_CHOICES = ("no", "only")
+# Document attributes that make a document a more specific kind, strongest first.
+_ATTRIBUTE_KINDS = (
+    ("DocumentAttributeSticker", "sticker"),
+    ("DocumentAttributeAnimated", "gif"),
+    ("DocumentAttributeVideo", "video"),
+    ("DocumentAttributeAudio", "audio"),
+)
+
+
+class PrefilterSyntaxError(ValueError):
+    pass
+
+
+def _parse_size(value):
+    match = _SIZE.fullmatch(value.strip())
+    if not match:
+        raise PrefilterSyntaxError(f"{value!r} is not a size like 500KB or 20MB")
+    return int(float(match.group(1)) * _UNITS[(match.group(2) or "b").lower()])
+
+
+def _format_size(size):
+    for unit in ("GB", "MB", "KB"):
+        if size >= _UNITS[unit.lower()] and size % _UNITS[unit.lower()] == 0:
+            return f"{size // _UNITS[unit.lower()]}{unit}"
+    return f"{size}B"
+
+
+def parse(text):
+    """
+    Parses a prefilter into a dict with the keys 'media', 'max_size', 'min_size', 'senders',
+    'forwarded' and 'album' (only those given). Raises PrefilterSyntaxError.
+    """
+    spec = {}
+    terms = text.split()
+    if not terms:
+        raise PrefilterSyntaxError("the prefilter is empty")
+    for term in terms:
+        key, _, value = term.partition(":")
+        key, value = key.lower(), value.strip()
+        if not value:
+            raise PrefilterSyntaxError(f"{term!r} needs a value, like {key}:...")
+        if key in spec or (key == "from" and "senders" in spec):
+            raise PrefilterSyntaxError(f"{key} is given twice")
+        if key == "media":
+            kinds = [kind.lower() for kind in value.split(",") if kind]
+            unknown = [kind for kind in kinds if kind not in MEDIA_KINDS]
+            if unknown:
+                raise PrefilterSyntaxError(f"unknown media kind {unknown[0]!r}; use {', '.join(MEDIA_KINDS)}")
+            spec["media"] = sorted(set(kinds), key=MEDIA_KINDS.index)
+        elif key in ("max_size", "min_size"):
+            spec[key] = _parse_size(value)
+        elif key == "from":
+            try:
+                senders = sorted({int(sender) for sender in value.split(",") if sender})
+            except ValueError:
+                raise PrefilterSyntaxError(f"from: takes numeric user or chat ids, not {value!r}") from None
+            if len(senders) > MAX_SENDERS:
+                raise PrefilterSyntaxError(f"at most {MAX_SENDERS} senders")
+            spec["senders"] = senders
+        elif key in ("forwarded", "album"):
+            if value.lower() not in _CHOICES:
+                raise PrefilterSyntaxError(f"{key}: takes 'no' or 'only', not {value!r}")
+            spec[key] = value.lower()
+        else:
+            raise PrefilterSyntaxError(f"unknown condition {key!r}; use media, max_size, min_size, from, forwarded or album")
+    if spec.get("min_size") is not None and spec.get("max_size") is not None and spec["min_size"] > spec["max_size"]:
+        raise PrefilterSyntaxError("min_size is larger than max_size")
+    return spec
+
+
+def describe(spec):
+    """The prefilter in the syntax parse() reads, in a fixed order."""
+    terms = []
+    if spec.get("media") is not None:
+        terms.append("media:" + ",".join(spec["media"]))
+    for key in ("max_size", "min_size"):
+        if spec.get(key) is not None:
+            terms.append(f"{key}:{_format_size(spec[key])}")
+    if spec.get("senders"):
+        terms.append("from:" + ",".join(str(sender) for sender in spec["senders"]))
+    for key in ("forwarded", "album"):
+        if spec.get(key):
+            terms.append(f"{key}:{spec[key]}")
+    return " ".join(terms)
+
+
+def media_kind(message):
+    """The kind of a Telethon message's media, from its classes alone."""
+    media = message.media
+    if media is None:
+        return "text"
+    name = type(media).__name__
+    if name == "MessageMediaWebPage":
+        # A link preview belongs to the text.
+        return "text"
+    if name == "MessageMediaPhoto":
+        return "photo"
+    if name != "MessageMediaDocument":
+        return "other"
+    names = {type(attribute).__name__: attribute for attribute in getattr(media.document, "attributes", None) or ()}
+    for attribute, kind in _ATTRIBUTE_KINDS:
+        if attribute in names:
+            if kind == "audio" and getattr(names[attribute], "voice", False):
+                return "voice"
+            return kind
+    return "document"
+
+
+def file_size(message):
+    """Bytes of a message's file (the largest size of a photo), or None without one."""
+    media = message.media
+    document = getattr(media, "document", None)
+    if document is not None:
+        return getattr(document, "size", None)
+    photo = getattr(media, "photo", None)
+    if photo is not None:
+        sizes = [getattr(size, "size", 0) for size in getattr(photo, "sizes", None) or ()]
+        return max(sizes) if sizes else None
+    return None
+
+
+class Prefilter:
+    """
+    A parsed prefilter, compiled into the checks its conditions need. `check()` returns the
+    stage that rejects a message (or album), or None if it passes; an album passes only if all
+    of its parts do.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.text = describe(spec)
+        self._checks = []
+        # Every value a check needs is bound as a default argument: closures would all see the last one.
+        forwarded = spec.get("forwarded")
+        if forwarded:
+            self._checks.append(("forwarded", lambda message, only=forwarded == "only": (message.fwd_from is not None) == only))
+        album = spec.get("album")
+        if album:
+            self._checks.append(("album", lambda message, only=album == "only": bool(message.grouped_id) == only))
+        if spec.get("senders"):
+            self._checks.append(("sender", lambda message, senders=frozenset(spec["senders"]): getattr(message, "sender_id", None) in senders))
+        if spec.get("media") is not None:
+            self._checks.append(("media", lambda message, kinds=frozenset(spec["media"]): media_kind(message) in kinds))
+        low, high = spec.get("min_size"), spec.get("max_size")
+        if low is not None or high is not None:
+
+            def sized(message, low=low or 0, high=high if high is not None else float("inf")):
+                size = file_size(message)
+                return size is None or low <= size <= high
+
+            self._checks.append(("size", sized))
+
+    def check(self, messages):
+        for stage, accepts in self._checks:
+            for message in messages:
+                if not accepts(message):
+                    return stage
+        return None
@@ -0,0 +1,195 @@
+# userbot/routes.py
+
+import logging
+
+import settings
+from matcher import CompiledFilter, KeywordMatcher
+from prefilter import Prefilter, PrefilterSyntaxError, parse as parse_prefilter
+from rules import FilterSyntaxError
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_keywords(keywords):
+    """Robustly get keywords: ensure it's a list, drop None values, lowercase and dedupe."""
+    if keywords is None or not isinstance(keywords, list):
+        return []
+    return sorted({str(k).lower() for k in keywords if k is not None})
+
+
+class Route:
+    """
+    One forwarding rule: messages from `source_id` go to `destination_id`,
+    filtered by the route's own mode: 'all', 'keywords', 'filter' (a compiled filter rule) or
+    'digest' (the messages matching the keywords, or all without keywords, are posted as one
+    summary every `digest_interval` seconds or `digest_max` messages).
+    `delivery` is 'forward' (with the "Forwarded from" header) or 'copy' (re-sent as our own message).
+    A `prefilter` (see prefilter.py) is checked on the message's metadata before the mode looks at its text.
+    """
+
+    def __init__(self, source_id, destination_id, mode="all", keywords=None, matcher=None, delivery="forward", rule=None,
+                 digest_interval=None, digest_max=None, prefilter=None, prefilter_text=None):
+        self.source_id = int(source_id)
+        self.destination_id = int(destination_id)
+        self.mode = str(mode or "all").lower()
+        self.keywords = normalize_keywords(keywords)
+        self.matcher = matcher if matcher is not None else KeywordMatcher(self.keywords)
+        self.delivery = "copy" if str(delivery or "forward").lower() == "copy" else "forward"
+        self.rule = rule
+        self.digest_interval = max(1, int(digest_interval or settings.DIGEST_INTERVAL))
+        self.digest_max = max(1, int(digest_max or settings.DIGEST_MAX_MESSAGES))
+        self.prefilter = prefilter
+        # The prefilter as configured; set without `prefilter` when it didn't parse.
+        self.prefilter_text = prefilter_text or (prefilter.text if prefilter is not None else None)
+
+    @property
+    def batchable(self):
+        """Forwards go out up to 100 per call; copies are sent one message (or album) per call."""
+        return self.delivery == "forward"
+
+    def admits(self, messages):
+        """
+        Returns the prefilter stage that rejects a message (or album) before its text is looked at,
+        or None if it passes. A route whose prefilter didn't parse rejects everything as 'invalid'.
+        """
+        if self.prefilter is not None:
+            return self.prefilter.check(messages)
+        return "invalid" if self.prefilter_text else None
+
+    def accepts(self, text):
+        """Returns True if the route's mode lets a message with `text` through."""
+        if self.mode == "keywords":
+            return bool(self.matcher) and self.matcher.search(text)
+        if self.mode == "filter":
+            return self.rule is not None and self.rule.match(text)
+        if self.mode == "digest" and self.matcher:
+            return self.matcher.search(text)
+        return True
+
+    @property
+    def signature(self):
+        """Everything that defines the route; two routes with equal signatures behave identically."""
+        return (self.source_id, self.destination_id, self.mode, tuple(self.keywords), self.delivery,
+                self.rule.text if self.rule is not None else None,
+                (self.digest_interval, self.digest_max) if self.mode == "digest" else None,
+                self.prefilter_text)
+
+    def __repr__(self):
+        text = f"{self.source_id} -> {self.destination_id} (Mode: {self.mode}"
+        if self.mode in ("keywords", "digest") and self.keywords:
+            text += f", Keywords: {self.keywords}"
+        if self.mode == "digest":
+            text += f", Every: {self.digest_interval}s or {self.digest_max} messages"
+        if self.mode == "filter":
+            text += f", Filter: {self.rule.text if self.rule is not None else None}"
+        if self.prefilter_text:
+            text += f", Prefilter: {self.prefilter_text}"
+        if self.delivery == "copy":
+            text += ", Delivery: copy"
+        return text + ")"
+
+
+class RouteTable:
+    """
+    All routes of one userbot, indexed by source chat id so the handler finds the
+    routes for an incoming message with a single dict lookup.
+    """
+
+    def __init__(self, routes=()):
+        self.routes = list(routes)
+        self._by_source = {}
+        for route in self.routes:
+            self._by_source.setdefault(route.source_id, []).append(route)
+        self.sources = frozenset(self._by_source)
+        self.destinations = frozenset(route.destination_id for route in self.routes)
+
+    def __len__(self):
+        return len(self.routes)
+
+    def __bool__(self):
+        return bool(self.routes)
+
+    def lookup(self, chat_id):
+        """Returns the routes whose source is `chat_id`, or an empty tuple."""
+        return self._by_source.get(chat_id, ())
+
+    @property
+    def signature(self):
+        return frozenset(route.signature for route in self.routes)
+
+    @classmethod
+    def from_config(cls, config, previous=None):
+        """
+        Builds the route table from a 'user_configs' row.
+
+        The row's own source_id/destination_id/mode/keywords form the primary route.
+        Additional routes come from the optional 'routes' column, a list of objects with
+        'source_id', 'destination_id' (or a 'destination_ids' list for fan-out), 'mode', 'keywords',
+        'filter', 'delivery', 'digest_interval', 'digest_max' and 'prefilter'.
+        Keyword matchers and filters of routes that already exist in `previous` are reused, since
+        compiling them is the expensive part of a reload. A filter or prefilter that doesn't parse
+        leaves its route forwarding nothing.
+        """
+        entries = []
+        if config.get("source_id") and config.get("destination_id"):
+            entries.append(config)
+        extra = config.get("routes")
+        if isinstance(extra, list):
+            entries.extend(entry for entry in extra if isinstance(entry, dict))
+
+        matchers = {}
+        rules = {}
+        prefilters = {}
+        if previous is not None:
+            for route in previous.routes:
+                matchers[tuple(route.keywords)] = route.matcher
+                if route.rule is not None:
+                    rules[route.rule.text] = route.rule
+                if route.prefilter is not None:
+                    prefilters[route.prefilter_text] = route.prefilter
+
+        routes = []
+        seen = set()
+        for entry in entries:
+            source_id = entry.get("source_id")
+            destination_ids = entry.get("destination_ids")
+            if not isinstance(destination_ids, list):
+                destination_ids = [entry.get("destination_id")]
+            for destination_id in destination_ids:
+                if not source_id or not destination_id:
+                    continue
+                keywords = normalize_keywords(entry.get("keywords"))
+                key = tuple(keywords)
+                if key not in matchers:
+                    matchers[key] = KeywordMatcher(keywords)
+                rule = None
+                text = str(entry.get("filter") or "").strip()
+                if text:
+                    if text not in rules:
+                        try:
+                            rules[text] = CompiledFilter(text)
+                        except FilterSyntaxError as e:
+                            logger.error(f"Invalid filter {text!r} for route {source_id} -> {destination_id}: {e}")
+                            rules[text] = None
+                    rule = rules[text]
+                prefilter = None
+                prefilter_text = " ".join(str(entry.get("prefilter") or "").split())
+                if prefilter_text:
+                    if prefilter_text not in prefilters:
+                        try:
+                            prefilters[prefilter_text] = Prefilter(parse_prefilter(prefilter_text))
+                        except PrefilterSyntaxError as e:
+                            logger.error(f"Invalid prefilter {prefilter_text!r} for route {source_id} -> {destination_id}: {e}")
+                            prefilters[prefilter_text] = None
+                    prefilter = prefilters[prefilter_text]
+                route = Route(
+                    source_id, destination_id, entry.get("mode", "all"), keywords,
+                    matcher=matchers[key], delivery=entry.get("delivery"), rule=rule,
+                    digest_interval=entry.get("digest_interval"), digest_max=entry.get("digest_max"),
+                    prefilter=prefilter, prefilter_text=prefilter_text,
+                )
+                if route.signature in seen:
+                    continue
+                seen.add(route.signature)
+                routes.append(route)
+        return cls(routes)
@@ -0,0 +1,160 @@
+# rules.py
+#
+# Filter rules shared by the bot and the userbot.
+# The bot parses a rule to validate it before saving it to 'user_configs'; the userbot
+# compiles the parsed rule once per config load (CompiledFilter in its matcher.py) and
+# evaluates it for every message.
+# This file is kept identical in telegram_bot/ and userbot/ since each is deployed on its own.
+#
+# Syntax (operators are case-insensitive, NOT binds tighter than AND, AND tighter than OR):
+#   crypto                  "crypto" anywhere in the message
+#   "bitcoin price"         a phrase anywhere in the message
+#   word:sol                "sol" as a whole word (not "solana")
+#   word:"to the moon"      a phrase as whole words
+#   /\bbtc\s*\d+k\b/        a regular expression
+#   crypto AND NOT airdrop, (btc OR eth) AND word:buy
+# All matching is case-insensitive.
+
+import re
+
+MAX_RULE_LENGTH = 4000
+MAX_TERMS = 200
+
+_OPERATORS = {"and", "or", "not"}
+_TOKEN = re.compile(
+    r"""
+    \s*(?:
+        (?P<open>\()
+      | (?P<close>\))
+      | (?P<word>word:)?"(?P<quoted>(?:[^"\\]|\\.)*)"
+      | /(?P<regex>(?:[^/\\]|\\.)+)/
+      | (?P<word_bare>word:)?(?P<bare>[^\s()"]+)
+    )
+    """,
+    re.VERBOSE,
+)
+# Backreferences and named groups would clash with the groups of the combined pattern.
+_UNSUPPORTED_REGEX = re.compile(r"\\[1-9]|\(\?P[<=]")
+
+
+class FilterSyntaxError(ValueError):
+    pass
+
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if match is None or match.end() == pos:
+            raise FilterSyntaxError(f"unexpected character at position {pos + 1}: {text[pos:pos + 10]!r}")
+        pos = match.end()
+        if match.group("open"):
+            tokens.append(("(", None))
+        elif match.group("close"):
+            tokens.append((")", None))
+        elif match.group("quoted") is not None:
+            value = re.sub(r"\\(.)", r"\1", match.group("quoted")).lower()
+            if not value.strip():
+                raise FilterSyntaxError("empty phrase")
+            tokens.append(("term", ("word" if match.group("word") else "text", value)))
+        elif match.group("regex") is not None:
+            # An escaped slash only delimits the rule syntax; the regex itself needs no escape.
+            value = match.group("regex").replace("\\/", "/")
+            if _UNSUPPORTED_REGEX.search(value):
+                raise FilterSyntaxError(f"backreferences and named groups are not supported: /{value}/")
+            try:
+                re.compile(f"(?=(?P<t>{value}))", re.IGNORECASE)
+            except re.error as e:
+                raise FilterSyntaxError(f"invalid regex /{value}/: {e}") from None
+            tokens.append(("term", ("regex", value)))
+        else:
+            value = match.group("bare")
+            if not match.group("word_bare") and value.lower() in _OPERATORS:
+                tokens.append((value.lower(), None))
+            else:
+                tokens.append(("term", ("word" if match.group("word_bare") else "text", value.lower())))
+    return tokens
+
+
+class _Parser:
+    """Recursive-descent parser producing a tree of ('or'|'and', [children]), ('not', child), ('term', index)."""
+
+    def __init__(self, tokens):
+        self._tokens = tokens
+        self._pos = 0
+        self.terms = []
+
+    def _peek(self):
+        return self._tokens[self._pos][0] if self._pos < len(self._tokens) else None
+
+    def _next(self):
+        token = self._tokens[self._pos]
+        self._pos += 1
+        return token
+
+    def parse(self):
+        if not self._tokens:
+            raise FilterSyntaxError("the rule is empty")
+        tree = self._or()
+        if self._pos < len(self._tokens):
+            raise FilterSyntaxError(f"unexpected {self._describe(self._peek())}; join terms with AND or OR")
+        return tree
+
+    @staticmethod
+    def _describe(kind):
+        if kind in _OPERATORS:
+            return kind.upper()
+        return {"(": "'('", ")": "')'", "term": "term"}.get(kind, "end of rule")
+
+    def _or(self):
+        children = [self._and()]
+        while self._peek() == "or":
+            self._next()
+            children.append(self._and())
+        return children[0] if len(children) == 1 else ("or", children)
+
+    def _and(self):
+        children = [self._not()]
+        while self._peek() == "and":
+            self._next()
+            children.append(self._not())
+        return children[0] if len(children) == 1 else ("and", children)
+
+    def _not(self):
+        if self._peek() == "not":
+            self._next()
+            return ("not", self._not())
+        return self._atom()
+
+    def _atom(self):
+        kind = self._peek()
+        if kind == "(":
+            self._next()
+            tree = self._or()
+            if self._peek() != ")":
+                raise FilterSyntaxError("missing ')'")
+            self._next()
+            return tree
+        if kind == "term":
+            term = self._next()[1]
+            if term not in self.terms:
+                if len(self.terms) >= MAX_TERMS:
+                    raise FilterSyntaxError(f"too many terms (at most {MAX_TERMS})")
+                self.terms.append(term)
+            return ("term", self.terms.index(term))
+        raise FilterSyntaxError(f"expected a term or '(' but found {self._describe(kind)}")
+
+
+def parse(text):
+    """
+    Parses a filter rule. Returns (tree, terms), where terms is the list of distinct
+    (kind, value) pairs the tree refers to by index. Raises FilterSyntaxError.
+    """
+    text = str(text or "").strip()
+    if len(text) > MAX_RULE_LENGTH:
+        raise FilterSyntaxError(f"the rule is too long (at most {MAX_RULE_LENGTH} characters)")
+    parser = _Parser(_tokenize(text))
+    tree = parser.parse()
+    return tree, parser.terms
@@ -0,0 +1,208 @@
+# userbot/sender.py
+
+import asyncio
+import logging
+import time
+
+from telethon.errors import FloodWaitError, RPCError, SlowModeWaitError
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second, holding at most `capacity`.
+    `pause()` empties it until a given time, which is how flood waits are honoured.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Waits until a token is available and takes it."""
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Blocks the bucket for `seconds` and drops any saved-up burst."""
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0
+        self._updated = self._paused_until
+
+
+class SendQueue:
+    """
+    Outbound queue for forwards.
+
+    Every destination gets its own bounded FIFO and worker, so messages keep their order
+    per destination while different destinations are sent in parallel. Each worker is paced
+    by its destination's token bucket plus one bucket shared by all destinations.
+    FloodWaitError pauses the destination for the requested time and the batch is retried;
+    other transient errors are retried with exponential backoff. A full queue makes `put()`
+    wait instead of dropping the forward. `on_failure(route, messages)` is called for a queued
+    batch that was given up on. `send()` delivers a batch right away under the same
+    buckets, for callers that need to know when it went out (history backfills).
+    """
+
+    def __init__(self, send, rate_per_destination=1.0, burst=5, global_rate=20.0,
+                 max_backlog=1000, max_retries=5, backoff_base=1.0, backoff_max=60.0, on_failure=None):
+        self._send = send
+        self._on_failure = on_failure
+        self._rate = rate_per_destination
+        self._burst = burst
+        self._global_bucket = TokenBucket(global_rate, max(1, int(global_rate)))
+        self._max_backlog = max_backlog
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._queues = {}
+        self._buckets = {}
+        self._workers = {}
+        self.metrics = {
+            "enqueued": 0,
+            "sent_batches": 0,
+            "sent_messages": 0,
+            "retries": 0,
+            "flood_waits": 0,
+            "flood_wait_seconds": 0,
+            "failed_batches": 0,
+            "backlog_full_waits": 0,
+        }
+        # Seconds spent in flood waits, per destination.
+        self.destination_flood_wait_seconds = {}
+
+    @property
+    def depth(self):
+        """Number of batches waiting across all destinations."""
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    def destination_depths(self):
+        return {destination_id: queue.qsize() for destination_id, queue in self._queues.items()}
+
+    def _queue(self, destination_id):
+        queue = self._queues.get(destination_id)
+        if queue is None:
+            queue = self._queues[destination_id] = asyncio.Queue(maxsize=self._max_backlog)
+            self._buckets[destination_id] = TokenBucket(self._rate, self._burst)
+            self._workers[destination_id] = asyncio.ensure_future(self._worker(destination_id))
+        return queue
+
+    async def put(self, route, messages):
+        """Queues a batch for `route`, waiting for room if that destination's backlog is full."""
+        destination_id = route.destination_id
+        queue = self._queue(destination_id)
+        if queue.full():
+            self.metrics["backlog_full_waits"] += 1
+            logger.warning(f"Send backlog for {destination_id} is full ({queue.maxsize} batches). Waiting for room...")
+        await queue.put((route, list(messages)))
+        self.metrics["enqueued"] += 1
+
+    async def _worker(self, destination_id):
+        queue = self._queues[destination_id]
+        bucket = self._buckets[destination_id]
+        while True:
+            route, messages = await queue.get()
+            try:
+                if not await self._deliver(bucket, route, messages) and self._on_failure is not None:
+                    self._on_failure(route, messages)
+            except asyncio.CancelledError:
+                # Stopped before the batch was known to be sent.
+                if self._on_failure is not None:
+                    self._on_failure(route, messages)
+                raise
+            finally:
+                queue.task_done()
+
+    async def send(self, route, messages, send):
+        """
+        Delivers a batch with `send(route, messages)` now, paced and retried like queued batches
+        and sharing the destination's bucket with them. Returns True if it was sent, False if it
+        was given up on.
+        """
+        self._queue(route.destination_id)
+        return await self._deliver(self._buckets[route.destination_id], route, list(messages), send)
+
+    async def _deliver(self, bucket, route, messages, send=None):
+        send = send or self._send
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            await self._global_bucket.acquire()
+            try:
+                await send(route, messages)
+                self.metrics["sent_batches"] += 1
+                self.metrics["sent_messages"] += len(messages)
+                return True
+            except (FloodWaitError, SlowModeWaitError) as e:
+                # Flood waits don't count against the retry budget: Telegram tells us exactly when to come back.
+                self.metrics["flood_waits"] += 1
+                self.metrics["flood_wait_seconds"] += e.seconds
+                self.destination_flood_wait_seconds[route.destination_id] = self.destination_flood_wait_seconds.get(route.destination_id, 0) + e.seconds
+                logger.warning(f"Flood wait of {e.seconds}s while forwarding to {route.destination_id}. {len(messages)} message(s) will be retried.")
+                bucket.pause(e.seconds)
+            except RPCError as e:
+                # 4xx errors (no access, message deleted, ...) will not succeed on retry.
+                if e.code is not None and 400 <= e.code < 500:
+                    self.metrics["failed_batches"] += 1
+                    logger.error(f"Error forwarding {len(messages)} message(s) from {route.source_id} to {route.destination_id}: {e}. Contact @DaHormes for help.")
+                    return False
+                attempt = await self._backoff(attempt, route, messages, e)
+                if attempt is None:
+                    return False
+            except Exception as e:
+                attempt = await self._backoff(attempt, route, messages, e)
+                if attempt is None:
+                    return False
+
+    async def _backoff(self, attempt, route, messages, error):
+        """Sleeps before the next retry. Returns the next attempt number, or None once retries are used up."""
+        attempt += 1
+        if attempt > self._max_retries:
+            self.metrics["failed_batches"] += 1
+            logger.error(f"Giving up forwarding {len(messages)} message(s) from {route.source_id} to {route.destination_id} after {self._max_retries} retries: {error}. Contact @DaHormes for help.")
+            return None
+        self.metrics["retries"] += 1
+        delay = min(self._backoff_max, self._backoff_base * 2 ** (attempt - 1))
+        logger.warning(f"Error forwarding to {route.destination_id}: {error}. Retrying in {delay:g}s (attempt {attempt}/{self._max_retries}).")
+        await asyncio.sleep(delay)
+        return attempt
+
+    async def drain(self):
+        """Waits until every queued batch has been delivered or given up on."""
+        for queue in list(self._queues.values()):
+            await queue.join()
+
+    async def close(self):
+        """
+        Stops the workers and gives up on the batches still queued. The queue starts afresh
+        with the next `put()`.
+        """
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for queue in self._queues.values():
+            while not queue.empty():
+                route, messages = queue.get_nowait()
+                if self._on_failure is not None:
+                    self._on_failure(route, messages)
+        self._queues.clear()
+        self._buckets.clear()
+        self._workers.clear()
@@ -0,0 +1,187 @@
+# userbot/sessions.py
+
+import asyncio
+import datetime
+import json
+import logging
+
+from telethon import utils
+from telethon.sessions import MemorySession, StringSession
+from telethon.tl.types import PeerChannel, PeerChat, PeerUser, updates
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+# Entities kept in a session, least recently seen dropped first. The routes' chats are
+# resolved by the peer cache anyway; these only spare Telethon some lookups.
+MAX_ENTITIES = 10000
+
+
+class SnapshotSession(MemorySession):
+    """
+    Telethon session held in memory, so handling updates never writes to disk.
+
+    It starts from a snapshot (see `snapshot()`) or a StringSession string, and sets `dirty`
+    whenever Telethon changes it; a SessionSnapshotter saves it from there. Entities are
+    indexed by id, so looking one up doesn't scan the whole session like MemorySession does.
+    """
+
+    def __init__(self, snapshot=None, max_entities=MAX_ENTITIES):
+        super().__init__()
+        self._max_entities = max_entities
+        # Marked peer id -> (id, hash, username, phone, name), least recently seen first.
+        self._rows = {}
+        self.dirty = False
+        if snapshot:
+            self.restore(snapshot)
+            self.dirty = False
+
+    def restore(self, snapshot):
+        """Loads a snapshot, or the auth key and data center of a StringSession string."""
+        if not snapshot.startswith("{"):
+            string = StringSession(snapshot)
+            self.set_dc(string.dc_id, string.server_address, string.port)
+            self._auth_key = string.auth_key
+            return
+        data = json.loads(snapshot)
+        if data.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"unsupported session snapshot version {data.get('version')!r}")
+        self.restore(data["auth"])
+        for entity_id, (pts, qts, date, seq) in data.get("states", {}).items():
+            self._update_states[int(entity_id)] = updates.State(pts, qts, datetime.datetime.fromtimestamp(date, datetime.timezone.utc), seq, unread_count=0)
+        for row in data.get("entities", []):
+            self._rows[row[0]] = tuple(row)
+
+    def snapshot(self):
+        """Returns the session as a JSON string: auth key, update state and entities."""
+        return json.dumps({
+            "version": SNAPSHOT_VERSION,
+            "auth": StringSession.save(self),
+            "states": {str(entity_id): [state.pts, state.qts, int(state.date.timestamp()), state.seq] for entity_id, state in self._update_states.items()},
+            "entities": list(self._rows.values()),
+        }, separators=(",", ":"))
+
+    def set_dc(self, dc_id, server_address, port):
+        super().set_dc(dc_id, server_address, port)
+        self.dirty = True
+
+    @MemorySession.auth_key.setter
+    def auth_key(self, value):
+        self._auth_key = value
+        self.dirty = True
+
+    def set_update_state(self, entity_id, state):
+        super().set_update_state(entity_id, state)
+        self.dirty = True
+
+    def save(self):
+        # Telethon calls this after changing the session; the snapshotter does the saving.
+        self.dirty = True
+
+    def process_entities(self, tlo):
+        for row in self._entities_to_rows(tlo):
+            if self._rows.get(row[0]) != row:
+                self.dirty = True
+            # Re-inserted at the end, so the least recently seen entity is first in line for eviction.
+            self._rows.pop(row[0], None)
+            self._rows[row[0]] = row
+        while len(self._rows) > self._max_entities:
+            del self._rows[next(iter(self._rows))]
+
+    def _find(self, column, value):
+        return next(((row[0], row[1]) for row in self._rows.values() if row[column] == value), None)
+
+    def get_entity_rows_by_phone(self, phone):
+        return self._find(3, phone)
+
+    def get_entity_rows_by_username(self, username):
+        return self._find(2, username)
+
+    def get_entity_rows_by_name(self, name):
+        return self._find(4, name)
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        ids = (id,) if exact else (utils.get_peer_id(PeerUser(id)), utils.get_peer_id(PeerChat(id)), utils.get_peer_id(PeerChannel(id)))
+        for found_id in ids:
+            row = self._rows.get(found_id)
+            if row is not None:
+                return row[0], row[1]
+        return None
+
+
+class SupabaseSessionStore:
+    """Session snapshots in the Supabase 'userbot_sessions' table, one row per session name."""
+
+    def __init__(self, database, name):
+        self._database = database
+        self.name = name
+
+    async def load(self):
+        return await self._database.get_session(self.name)
+
+    async def save(self, data):
+        await self._database.save_session(self.name, data)
+
+
+class SessionSnapshotter:
+    """
+    Saves a SnapshotSession to its store every `interval` seconds if it changed, and at close().
+    The snapshot is taken on the event loop in one step (about 1 ms per 1000 entities), so it
+    is always consistent; only the upload waits, in the background. A failed save is retried
+    at the next interval.
+    """
+
+    def __init__(self, session, store, interval=60.0):
+        self._session = session
+        self._store = store
+        self._interval = interval
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            await self.save()
+
+    async def save(self):
+        """Saves the session if it changed since the last save."""
+        if not self._session.dirty or not self._session.auth_key:
+            return
+        self._session.dirty = False
+        try:
+            await self._store.save(self._session.snapshot())
+        except Exception as e:
+            self._session.dirty = True
+            logger.error(f"Could not save session '{self._store.name}': {e}")
+
+    async def close(self):
+        """Stops the periodic saves and saves the session one last time. Call after the client disconnected."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.save()
+
+
+async def open_session(backend, name, database=None, string=None, interval=60.0):
+    """
+    Returns (session, snapshotter) for a TelegramClient named `name`.
+
+    - 'sqlite': Telethon's session file `name`.session; no snapshotter.
+    - 'string': a SnapshotSession from `string` (SESSION_STRING), kept in memory only.
+    - 'supabase': a SnapshotSession from the 'userbot_sessions' row `name`, seeded from `string`
+      if there is no row yet, and saved back there by the returned snapshotter.
+    """
+    if backend == "sqlite":
+        return name, None
+    if backend == "string":
+        if not string:
+            logger.warning(f"No session string for '{name}'. A login now is lost on restart; export the session with `python3 main.py --export-session`.")
+        return SnapshotSession(string), None
+    store = SupabaseSessionStore(database, name)
+    snapshot = await store.load()
+    session = SnapshotSession(snapshot or string)
+    # A seeded or freshly logged-in session is saved at the first interval.
+    session.dirty = not snapshot
+    return session, SessionSnapshotter(session, store, interval)
@@ -0,0 +1,125 @@
+# userbot/settings.py
+#
+# Environment settings shared by the single-account entry point (main.py)
+# and the multi-account supervisor (supervisor.py).
+
+import os
+import time
+
+from dotenv import load_dotenv
+
+# Reference point for the startup timings in the logs; this module is imported first.
+STARTED = time.monotonic()
+
+# Load environment variables
+load_dotenv()
+
+# Malformed numeric settings, reported by validate(); each of them keeps its default meanwhile.
+_NUMBER_PROBLEMS = []
+
+
+def _number(name, default, kind=int):
+    """Reads a numeric environment variable, falling back to `default` when it is unset or malformed."""
+    value = (os.getenv(name) or "").strip()
+    if not value:
+        return default
+    try:
+        return kind(value)
+    except ValueError:
+        _NUMBER_PROBLEMS.append(f"{name} {value!r} is not {'a whole number' if kind is int else 'a number'}")
+        return default
+
+
+# Validated by validate(); a missing or malformed API_ID is reported there instead of failing at import.
+API_ID = int(os.getenv("API_ID")) if (os.getenv("API_ID") or "").strip().lstrip("-").isdigit() else None
+API_HASH = os.getenv("API_HASH")
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Safety-net poll interval. With change notifications live the config is only
+# re-read when the bot publishes a change, so this can be long.
+CONFIG_POLL_INTERVAL = _number("CONFIG_POLL_INTERVAL", 900)
+# Poll interval used when change notifications are unavailable.
+CONFIG_FALLBACK_POLL_INTERVAL = 60
+# Seconds to collect a burst of messages per route before forwarding them in one call (0 disables).
+FORWARD_BATCH_WINDOW = _number("FORWARD_BATCH_WINDOW", 0.5, float)
+# Outbound rate limits: forward calls per second to each destination (with a small burst),
+# and across all destinations. Each call carries up to 100 messages.
+SEND_RATE_PER_DESTINATION = _number("SEND_RATE_PER_DESTINATION", 1.0, float)
+SEND_BURST = _number("SEND_BURST", 5)
+SEND_RATE_GLOBAL = _number("SEND_RATE_GLOBAL", 20.0, float)
+# Batches that may wait per destination before new messages have to wait for room.
+SEND_MAX_BACKLOG = _number("SEND_MAX_BACKLOG", 1000)
+# Local file with the last forwarded message id per route, used to catch up after a restart.
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "journal.db")
+# Mirror the journal to the Supabase 'forward_journal' table, for hosts without persistent disk.
+JOURNAL_SUPABASE_SYNC = os.getenv("JOURNAL_SUPABASE_SYNC", "false").lower() == "true"
+# Most messages per source to catch up on after a restart (0 disables catch-up).
+CATCHUP_MAX_MESSAGES = _number("CATCHUP_MAX_MESSAGES", 10000)
+# Seconds to keep sending queued forwards when stopping, before leaving them to the catch-up.
+SHUTDOWN_DRAIN_TIMEOUT = _number("SHUTDOWN_DRAIN_TIMEOUT", 10.0, float)
+
+# Most bytes of media held in memory when a copy route has to re-upload it (protected sources).
+COPY_MAX_BUFFER = _number("COPY_MAX_BUFFER", 50 * 1024 * 1024)
+
+# Port of the Prometheus metrics endpoint on localhost (0 disables it).
+METRICS_PORT = _number("METRICS_PORT", 9464)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Log every Nth per-message line (queued, skipped, forwarded). 0 turns them off; the metrics still count everything.
+MESSAGE_LOG_EVERY = _number("MESSAGE_LOG_EVERY", 1)
+
+# Drop content already sent to the same destination: fingerprints remembered (0 disables),
+# for how many seconds, and the SimHash bit distance (0-3) under which texts count as near-duplicates.
+DEDUP_WINDOW = _number("DEDUP_WINDOW", 0)
+DEDUP_TTL = _number("DEDUP_TTL", 3600.0, float)
+DEDUP_NEAR_DISTANCE = _number("DEDUP_NEAR_DISTANCE", 0)
+
+# History backfills: pages of 100 messages read ahead of the forwards, and seconds between progress saves.
+BACKFILL_PREFETCH_PAGES = _number("BACKFILL_PREFETCH_PAGES", 5)
+BACKFILL_CHECKPOINT_INTERVAL = _number("BACKFILL_CHECKPOINT_INTERVAL", 5.0, float)
+
+# Days a forwarded message stays in the message map, which lets edits and deletions in the source
+# reach its forwards and copies (0 disables edit and delete propagation).
+MESSAGE_MAP_RETENTION_DAYS = _number("MESSAGE_MAP_RETENTION_DAYS", 7.0, float)
+
+# Digest routes: default seconds between digests and messages that post one early (routes can set their own),
+# and characters of each message quoted in a digest.
+DIGEST_INTERVAL = _number("DIGEST_INTERVAL", 3600)
+DIGEST_MAX_MESSAGES = _number("DIGEST_MAX_MESSAGES", 50)
+DIGEST_EXCERPT_CHARS = _number("DIGEST_EXCERPT_CHARS", 200)
+
+# Log level of the userbot (DEBUG, INFO, WARNING, ...).
+LOG_LEVELS = ("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# What logging is configured with: INFO until validate() has reported an unknown LOG_LEVEL.
+SAFE_LOG_LEVEL = LOG_LEVEL if LOG_LEVEL in LOG_LEVELS else "INFO"
+
+# Seconds before a Supabase query is abandoned.
+DB_TIMEOUT = _number("DB_TIMEOUT", 10.0, float)
+
+# Telethon session of the single-account entry point.
+SESSION_NAME = os.getenv("SESSION_NAME", "userbot")
+# Where Telethon sessions live: "sqlite" (<session>.session files), "string" (SESSION_STRING, in memory only)
+# or "supabase" (the 'userbot_sessions' table, seeded from SESSION_STRING), and seconds between Supabase snapshots.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite").strip().lower()
+SESSION_STRING = os.getenv("SESSION_STRING", "").strip()
+SESSION_SNAPSHOT_INTERVAL = _number("SESSION_SNAPSHOT_INTERVAL", 60.0, float)
+# Multi-account supervisor: JSON file listing the accounts, and worker processes to shard them over.
+ACCOUNTS_FILE = os.getenv("ACCOUNTS_FILE", "accounts.json")
+SUPERVISOR_WORKERS = _number("SUPERVISOR_WORKERS", 1)
+
+
+def validate():
+    """Returns a list of problems with the environment; empty if the userbot can start."""
+    problems = list(_NUMBER_PROBLEMS)
+    if API_ID is None:
+        problems.append("API_ID is missing or not a number")
+    for name in ("API_HASH", "SUPABASE_URL", "SUPABASE_KEY"):
+        if not os.getenv(name):
+            problems.append(f"{name} is missing")
+    if LOG_LEVEL not in LOG_LEVELS:
+        problems.append(f"LOG_LEVEL {LOG_LEVEL!r} is not a log level")
+    if not 0 <= DEDUP_NEAR_DISTANCE <= 3:
+        problems.append("DEDUP_NEAR_DISTANCE must be between 0 and 3")
+    if SESSION_BACKEND not in ("sqlite", "string", "supabase"):
+        problems.append(f"SESSION_BACKEND {SESSION_BACKEND!r} must be sqlite, string or supabase")
+    return problems
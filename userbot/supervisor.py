@@ -0,0 +1,235 @@
+# userbot/supervisor.py
+#
+# Runs many userbot accounts from one entry point: every account is its own TelegramClient
+# and Userbot on a shared event loop, and the accounts can be sharded over several worker
+# processes to use more than one core.
+#
+# Accounts are listed in ACCOUNTS_FILE (default accounts.json):
+#   [{"name": "alice", "session": "alice"}, {"name": "bob", "session": "sessions/bob", "api_id": 123, "api_hash": "..."}]
+# 'session' defaults to the name, 'api_id'/'api_hash' to API_ID/API_HASH and 'journal_path'
+# to journal-<name>.db. With SESSION_BACKEND=string, each account needs its own 'session_string';
+# with supabase, 'session' names its 'userbot_sessions' row, seeded from 'session_string' if given.
+# SESSION_STRING is not used here: accounts sharing one session would share one login.
+# Sessions must be logged in beforehand, e.g. with `SESSION_NAME=alice python3 main.py`,
+# since workers can't prompt for a login code.
+# Run from the userbot directory: python3 supervisor.py
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import sys
+import time
+
+#To pause Service on railway
+if os.getenv("PAUSE") == "true":
+    print("🚧 Application is paused. Exiting now.")
+    sys.exit(0)
+
+import settings
+
+logging.basicConfig(level=settings.SAFE_LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(process)d - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Restart delays after an account or worker process fails, doubling up to the maximum.
+RESTART_DELAY = 5
+RESTART_DELAY_MAX = 300
+
+
+def load_accounts(path=settings.ACCOUNTS_FILE):
+    """Reads the account list, filling in defaults. Accounts without a name are skipped."""
+    with open(path) as f:
+        entries = json.load(f)
+    accounts = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get("name"):
+            logger.warning(f"Skipping account entry without a name: {entry!r}")
+            continue
+        name = str(entry["name"])
+        accounts.append({
+            "name": name,
+            "session": entry.get("session") or name,
+            "session_string": entry.get("session_string") or None,
+            "api_id": int(entry.get("api_id") or settings.API_ID),
+            "api_hash": entry.get("api_hash") or settings.API_HASH,
+            "journal_path": entry.get("journal_path") or f"journal-{name}.db",
+        })
+    return accounts
+
+
+def check():
+    """
+    Validates the environment and the account list without touching the network.
+    Returns the process exit code.
+    """
+    problems = settings.validate()
+    try:
+        accounts = load_accounts()
+        if not accounts:
+            problems.append(f"no accounts in {settings.ACCOUNTS_FILE}")
+        if settings.SESSION_BACKEND == "string":
+            problems += [f"account {account['name']!r} has no session_string" for account in accounts if not account["session_string"]]
+    except (OSError, ValueError) as e:
+        problems.append(f"cannot read {settings.ACCOUNTS_FILE}: {e}")
+    for problem in problems:
+        logger.critical(f"Invalid configuration: {problem}.")
+    if not problems:
+        logger.info("Configuration OK.")
+    return 1 if problems else 0
+
+
+async def supervise(userbot, poll_interval, snapshotter=None):
+    """
+    Runs one account and restarts it with a growing delay whenever it fails or disconnects.
+    Failures stay inside this task, so the other accounts on the loop keep forwarding.
+    The account's session `snapshotter`, if any, saves right after every login.
+    """
+    from account import SessionNotAuthorizedError
+
+    delay = RESTART_DELAY
+    while True:
+        started = time.monotonic()
+        try:
+            await userbot.login(interactive=False)
+            if snapshotter is not None:
+                # Saved right away, so what the login changed survives a crash.
+                await snapshotter.save()
+            await userbot.serve(poll_interval)
+            userbot.log.warning(f"Disconnected. Reconnecting in {delay}s...")
+        except SessionNotAuthorizedError as e:
+            userbot.log.error(f"Not starting account: {e}")
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            userbot.log.error(f"Account stopped: {e}. Restarting in {delay}s...", exc_info=True)
+        # An account that ran for a while before failing starts over with the short delay.
+        if time.monotonic() - started > RESTART_DELAY_MAX:
+            delay = RESTART_DELAY
+        await asyncio.sleep(delay)
+        delay = min(RESTART_DELAY_MAX, delay * 2)
+
+
+async def run_accounts(accounts, metrics_port):
+    """Runs `accounts` on this process's event loop, sharing one database client and notifier."""
+    from telethon import TelegramClient
+
+    from account import Userbot
+    from db import Database
+    from metrics import MetricsRegistry, MetricsServer
+    from notify import create_notifier
+    from sessions import open_session
+
+    # The supervisor stops workers with SIGTERM, as Railway stops a single-worker deployment.
+    # Cancelling the task runs the cleanup below (journals, session snapshots) instead of dying mid-way.
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    db = Database(settings.SUPABASE_URL, settings.SUPABASE_KEY, timeout=settings.DB_TIMEOUT)
+    notifier = create_notifier(db)
+    registries = []
+    metrics_server = None
+    if metrics_port:
+        metrics_server = MetricsServer(registries, host=settings.METRICS_HOST, port=metrics_port)
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            logger.warning(f"Could not start metrics endpoint on {settings.METRICS_HOST}:{metrics_port}: {e}. Continuing without it.")
+            metrics_server = None
+
+    if await notifier.start():
+        poll_interval = settings.CONFIG_POLL_INTERVAL
+    else:
+        poll_interval = settings.CONFIG_FALLBACK_POLL_INTERVAL
+
+    userbots = []
+    snapshotters = []
+    for account in accounts:
+        session, snapshotter = await open_session(settings.SESSION_BACKEND, account["session"], db, account["session_string"], settings.SESSION_SNAPSHOT_INTERVAL)
+        if snapshotter is not None:
+            snapshotter.start()
+        snapshotters.append(snapshotter)
+        client = TelegramClient(session, api_id=account["api_id"], api_hash=account["api_hash"])
+        registry = MetricsRegistry({"account": account["name"]})
+        registries.append(registry)
+        userbots.append(Userbot(client, db, notifier, account["journal_path"], account=account["name"], metrics=registry))
+    logger.info(f"Running {len(userbots)} account(s): {', '.join(account['name'] for account in accounts)}")
+
+    try:
+        await asyncio.gather(*(supervise(userbot, poll_interval, snapshotter) for userbot, snapshotter in zip(userbots, snapshotters)))
+    finally:
+        for userbot in userbots:
+            await userbot.client.disconnect()
+        # After the disconnects, which hand Telethon's update state to the sessions.
+        for snapshotter in snapshotters:
+            if snapshotter is not None:
+                await snapshotter.close()
+        await notifier.close()
+        if metrics_server is not None:
+            await metrics_server.close()
+
+
+def worker(accounts, metrics_port):
+    """Entry point of a worker process."""
+    try:
+        asyncio.run(run_accounts(accounts, metrics_port))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+def shard(accounts, workers):
+    """Splits `accounts` round-robin into at most `workers` non-empty shards."""
+    shards = [accounts[i::workers] for i in range(workers)]
+    return [part for part in shards if part]
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main():
+    if "--check" in sys.argv[1:] or settings.validate():
+        sys.exit(check())
+    accounts = load_accounts()
+    if not accounts:
+        logger.critical(f"No accounts found in {settings.ACCOUNTS_FILE}.")
+        return
+    shards = shard(accounts, max(1, settings.SUPERVISOR_WORKERS))
+    if len(shards) == 1:
+        worker(shards[0], settings.METRICS_PORT)
+        return
+
+    # On SIGTERM, stop like on Ctrl+C: the workers are sent SIGTERM in turn and waited for.
+    signal.signal(signal.SIGTERM, _interrupt)
+    # Each worker gets its own metrics port: METRICS_PORT, METRICS_PORT + 1, ...
+    context = multiprocessing.get_context("spawn")
+    ports = [settings.METRICS_PORT + i if settings.METRICS_PORT else 0 for i in range(len(shards))]
+    processes = [None] * len(shards)
+    delays = [RESTART_DELAY] * len(shards)
+    try:
+        while True:
+            for i, accounts in enumerate(shards):
+                process = processes[i]
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None:
+                    logger.error(f"Worker {i} exited with code {process.exitcode}. Restarting it in {delays[i]}s...")
+                    time.sleep(delays[i])
+                    delays[i] = min(RESTART_DELAY_MAX, delays[i] * 2)
+                processes[i] = context.Process(target=worker, args=(accounts, ports[i]), name=f"userbot-worker-{i}", daemon=True)
+                processes[i].start()
+                logger.info(f"Worker {i} (pid {processes[i].pid}) serves {len(accounts)} account(s).")
+            multiprocessing.connection.wait([process.sentinel for process in processes])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+                process.join()
+
+
+if __name__ == "__main__":
+    main()
+    logger.info("Supervisor stopped.")
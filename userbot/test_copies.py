@@ -0,0 +1,25 @@
+# userbot/test_copies.py
+#
+# The modules both services need are copied into telegram_bot/ and userbot/, since each is
+# deployed on its own from its directory. This test fails as soon as a copy drifts.
+# Run from the userbot directory: python3 -m unittest test_copies (or pytest)
+
+import os
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+OTHER = os.path.join(os.path.dirname(HERE), "telegram_bot")
+SHARED_FILES = ("db.py", "notify.py", "rules.py", "prefilter.py", "bench_startup.py")
+
+
+@unittest.skipUnless(os.path.isdir(OTHER), "telegram_bot/ is not next to userbot/")
+class SharedFilesTest(unittest.TestCase):
+    def test_shared_files_are_identical(self):
+        for name in SHARED_FILES:
+            with self.subTest(name=name):
+                with open(os.path.join(HERE, name), "rb") as ours, open(os.path.join(OTHER, name), "rb") as theirs:
+                    self.assertEqual(ours.read(), theirs.read(), f"userbot/{name} and telegram_bot/{name} differ; copy the change to both")
+
+
+if __name__ == "__main__":
+    unittest.main()
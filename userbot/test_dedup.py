@@ -0,0 +1,92 @@
+# userbot/test_dedup.py
+#
+# Tests of message fingerprints and the per-destination dedup window.
+# Run from the userbot directory: python3 -m unittest test_dedup (or pytest)
+
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from dedup import DedupWindow, fingerprint
+
+LONG_TEXT = ("Bitcoin breaks above its previous high as traders pile into the market this morning while analysts warn "
+             "that the rally could fade once the weekend trading volume drops and funding rates reset across the major exchanges")
+
+
+def message(text="", photo_id=None):
+    photo = SimpleNamespace(id=photo_id) if photo_id is not None else None
+    return SimpleNamespace(message=text, photo=photo, document=None)
+
+
+class FingerprintTest(unittest.TestCase):
+    def test_normalized_text_gives_the_same_fingerprint(self):
+        self.assertEqual(fingerprint([message("Hello,  World!")]).digest, fingerprint([message("hello world")]).digest)
+        self.assertNotEqual(fingerprint([message("hello world")]).digest, fingerprint([message("hello there")]).digest)
+
+    def test_media_is_part_of_the_fingerprint(self):
+        self.assertNotEqual(fingerprint([message("caption", 1)]).digest, fingerprint([message("caption", 2)]).digest)
+        self.assertEqual(fingerprint([message("", 1), message("caption", 2)]).digest,
+                         fingerprint([message("", 1), message("caption", 2)]).digest)
+
+    def test_empty_messages_have_no_fingerprint(self):
+        self.assertIsNone(fingerprint([message("  ...  ")]))
+
+    def test_only_long_texts_get_a_simhash(self):
+        self.assertIsNotNone(fingerprint([message(LONG_TEXT)], near=True).simhash)
+        self.assertIsNone(fingerprint([message("short text")], near=True).simhash)
+        self.assertIsNone(fingerprint([message(LONG_TEXT)]).simhash)
+
+
+class DedupWindowTest(unittest.TestCase):
+    def test_repeats_are_dropped_per_destination(self):
+        window = DedupWindow()
+        fp = fingerprint([message("hello")])
+        self.assertFalse(window.check(1, fp))
+        self.assertTrue(window.check(1, fp))
+        self.assertFalse(window.check(2, fp))
+        self.assertFalse(window.check(1, None))
+        self.assertEqual(window.metrics["duplicates"], 1)
+
+    def test_fingerprints_expire_after_the_ttl(self):
+        window = DedupWindow(ttl=10)
+        fp = fingerprint([message("hello")])
+        with mock.patch("dedup.time.monotonic", return_value=100.0):
+            self.assertFalse(window.check(1, fp))
+        with mock.patch("dedup.time.monotonic", return_value=109.0):
+            self.assertTrue(window.check(1, fp))
+        with mock.patch("dedup.time.monotonic", return_value=111.0):
+            self.assertFalse(window.check(1, fp))
+
+    def test_oldest_fingerprints_are_evicted_beyond_maxsize(self):
+        window = DedupWindow(maxsize=2)
+        fps = [fingerprint([message(f"text {i}")]) for i in range(3)]
+        for fp in fps:
+            self.assertFalse(window.check(1, fp))
+        self.assertEqual(len(window), 2)
+        self.assertEqual(window.metrics["evictions"], 1)
+        self.assertFalse(window.check(1, fps[0]))
+
+    def test_forget_lets_the_content_through_again(self):
+        window = DedupWindow()
+        fp = fingerprint([message("hello")])
+        window.check(1, fp)
+        window.forget(1, fp)
+        self.assertFalse(window.check(1, fp))
+
+    def test_near_duplicates(self):
+        # The first edit moves the SimHash by 3 bits, the second by 10.
+        original = fingerprint([message(LONG_TEXT)], near=True)
+        reworded = fingerprint([message(LONG_TEXT.replace("Bitcoin", "BTC"))], near=True)
+        rewritten = fingerprint([message(LONG_TEXT.replace("warn", "caution"))], near=True)
+        window = DedupWindow(max_distance=3)
+        window.check(1, original)
+        self.assertTrue(window.check(1, reworded))
+        self.assertFalse(window.check(1, rewritten))
+        self.assertEqual(window.metrics["near_duplicates"], 1)
+        exact = DedupWindow()
+        exact.check(1, original)
+        self.assertFalse(exact.check(1, reworded))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+# userbot/test_journal.py
+#
+# Tests of the forward journal's checkpoints and in-flight marks, on a temporary SQLite file.
+# Run from the userbot directory: python3 -m unittest test_journal (or pytest)
+
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from journal import ForwardJournal
+
+ROUTE = SimpleNamespace(source_id=-1001, destination_id=-1002)
+OTHER_ROUTE = SimpleNamespace(source_id=-1001, destination_id=-1003)
+
+
+class ForwardJournalTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "journal.db")
+        self.journal = await self.open()
+
+    async def asyncTearDown(self):
+        if self.journal is not None:
+            await self.journal.close()
+        self.directory.cleanup()
+
+    async def open(self):
+        journal = ForwardJournal(self.path, flush_interval=3600)
+        await journal.open()
+        return journal
+
+    async def restart(self, clean=True):
+        """Opens the journal again, after closing it or, with clean=False, as if the process had died."""
+        if not clean:
+            # Lost with the process instead of flushed at close.
+            self.journal._dirty = {}
+        await self.journal.close()
+        self.journal = await self.open()
+
+    def inflight(self):
+        return self.journal._db.execute("SELECT source_id, destination_id, last_id FROM inflight").fetchall()
+
+    async def test_checkpoints_survive_a_restart_and_never_move_back(self):
+        self.assertIsNone(self.journal.get(ROUTE))
+        self.journal.record(ROUTE, 10)
+        self.journal.record(ROUTE, 5)
+        self.journal.record(OTHER_ROUTE, 3)
+        await self.restart()
+        self.assertEqual(self.journal.get(ROUTE), 10)
+        self.assertEqual(self.journal.get(OTHER_ROUTE), 3)
+
+    async def test_unflushed_checkpoints_are_lost_in_a_crash(self):
+        self.journal.record(ROUTE, 10)
+        await self.journal.flush()
+        self.journal.record(ROUTE, 20)
+        await self.restart(clean=False)
+        self.assertEqual(self.journal.get(ROUTE), 10)
+
+    async def test_a_batch_cut_off_mid_send_is_not_sent_again(self):
+        self.journal.record(ROUTE, 10)
+        await self.journal.flush()
+        await self.journal.begin(ROUTE, 15)
+        with self.assertLogs("journal", "WARNING"):
+            await self.restart(clean=False)
+        self.assertEqual(self.journal.get(ROUTE), 15)
+
+    async def test_a_sent_batch_stays_marked_until_its_checkpoint_is_written(self):
+        await self.journal.begin(ROUTE, 15)
+        self.journal.record(ROUTE, 15)
+        self.assertEqual(self.inflight(), [(-1001, -1002, 15)])
+        await self.journal.flush()
+        self.assertEqual(self.inflight(), [])
+        await self.restart(clean=False)
+        self.assertEqual(self.journal.get(ROUTE), 15)
+
+    async def test_a_failed_send_takes_its_mark_back(self):
+        # Nothing sent yet: the mark goes away.
+        await self.journal.begin(ROUTE, 15)
+        await self.journal.abort(ROUTE)
+        self.assertEqual(self.inflight(), [])
+        # A sent batch whose checkpoint isn't written yet stays covered by the mark.
+        await self.journal.begin(ROUTE, 15)
+        self.journal.record(ROUTE, 15)
+        await self.journal.begin(ROUTE, 20)
+        await self.journal.abort(ROUTE)
+        self.assertEqual(self.inflight(), [(-1001, -1002, 15)])
+        await self.restart(clean=False)
+        self.assertEqual(self.journal.get(ROUTE), 15)
+
+
+if __name__ == "__main__":
+    unittest.main()
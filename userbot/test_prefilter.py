@@ -0,0 +1,96 @@
+# userbot/test_prefilter.py
+#
+# Tests of prefilter parsing and checking, on stand-ins for Telethon messages.
+# Run from the userbot directory: python3 -m unittest test_prefilter (or pytest)
+
+import unittest
+from types import SimpleNamespace
+
+from prefilter import Prefilter, PrefilterSyntaxError, describe, media_kind, parse
+
+
+# media_kind() and file_size() only look at class names and attributes, like Telethon's types have.
+class MessageMediaPhoto(SimpleNamespace):
+    pass
+
+
+class MessageMediaDocument(SimpleNamespace):
+    pass
+
+
+class DocumentAttributeVideo(SimpleNamespace):
+    pass
+
+
+class DocumentAttributeAudio(SimpleNamespace):
+    pass
+
+
+def message(media=None, sender_id=1, forwarded=False, grouped_id=None):
+    return SimpleNamespace(media=media, sender_id=sender_id, fwd_from=object() if forwarded else None, grouped_id=grouped_id)
+
+
+def document(size, *attributes):
+    return MessageMediaDocument(document=SimpleNamespace(size=size, attributes=list(attributes)))
+
+
+class ParseTest(unittest.TestCase):
+    def test_parse_and_describe_round_trip(self):
+        spec = parse("album:no  MEDIA:video,document max_size:20MB from:5,3 forwarded:only")
+        self.assertEqual(spec, {"album": "no", "media": ["video", "document"], "max_size": 20 * 1024 ** 2,
+                                "senders": [3, 5], "forwarded": "only"})
+        self.assertEqual(describe(spec), "media:video,document max_size:20MB from:3,5 forwarded:only album:no")
+        self.assertEqual(parse(describe(spec)), spec)
+
+    def test_invalid_prefilters_are_rejected(self):
+        for text in ("", "media:", "media:movie", "max_size:big", "from:abc", "forwarded:yes",
+                     "color:red", "album:no album:only", "min_size:2MB max_size:1MB"):
+            with self.subTest(text=text), self.assertRaises(PrefilterSyntaxError):
+                parse(text)
+
+
+class PrefilterCheckTest(unittest.TestCase):
+    def check(self, text, *messages):
+        return Prefilter(parse(text)).check(messages)
+
+    def test_forwarded_and_album_keep_their_own_setting(self):
+        prefilter = "forwarded:no album:only"
+        self.assertIsNone(self.check(prefilter, message(grouped_id=7)))
+        self.assertEqual(self.check(prefilter, message(forwarded=True, grouped_id=7)), "forwarded")
+        self.assertEqual(self.check(prefilter, message()), "album")
+        prefilter = "forwarded:only album:no"
+        self.assertIsNone(self.check(prefilter, message(forwarded=True)))
+        self.assertEqual(self.check(prefilter, message()), "forwarded")
+        self.assertEqual(self.check(prefilter, message(forwarded=True, grouped_id=7)), "album")
+
+    def test_the_first_failing_stage_is_reported(self):
+        prefilter = "media:video max_size:1MB from:1 forwarded:no"
+        video = DocumentAttributeVideo()
+        self.assertIsNone(self.check(prefilter, message(document(1000, video))))
+        self.assertEqual(self.check(prefilter, message(document(2 * 1024 ** 2, video))), "size")
+        self.assertEqual(self.check(prefilter, message(document(1000))), "media")
+        self.assertEqual(self.check(prefilter, message(document(1000, video), sender_id=2)), "sender")
+        self.assertEqual(self.check(prefilter, message(document(1000), sender_id=2, forwarded=True)), "forwarded")
+
+    def test_every_part_of_an_album_must_pass(self):
+        prefilter = "media:photo,video"
+        photo = message(MessageMediaPhoto(photo=SimpleNamespace(sizes=[])), grouped_id=7)
+        self.assertIsNone(self.check(prefilter, photo, message(document(10, DocumentAttributeVideo()), grouped_id=7)))
+        self.assertEqual(self.check(prefilter, photo, message(document(10), grouped_id=7)), "media")
+
+    def test_size_bounds_let_messages_without_a_file_pass(self):
+        prefilter = "min_size:1KB max_size:2KB"
+        self.assertIsNone(self.check(prefilter, message()))
+        self.assertIsNone(self.check(prefilter, message(document(1500))))
+        self.assertEqual(self.check(prefilter, message(document(100))), "size")
+        self.assertEqual(self.check(prefilter, message(document(4096))), "size")
+
+    def test_media_kinds(self):
+        self.assertEqual(media_kind(message()), "text")
+        self.assertEqual(media_kind(message(document(1, DocumentAttributeAudio(voice=True)))), "voice")
+        self.assertEqual(media_kind(message(document(1, DocumentAttributeAudio(voice=False)))), "audio")
+        self.assertEqual(media_kind(message(document(1))), "document")
+
+
+if __name__ == "__main__":
+    unittest.main()
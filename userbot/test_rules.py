@@ -0,0 +1,78 @@
+# userbot/test_rules.py
+#
+# Tests of filter rule parsing (rules.py) and of compiled rules and keywords (matcher.py).
+# Run from the userbot directory: python3 -m unittest test_rules (or pytest)
+
+import unittest
+
+from matcher import NAIVE_MAX_KEYWORDS, CompiledFilter, KeywordMatcher
+from rules import MAX_TERMS, FilterSyntaxError, parse
+
+
+class ParseTest(unittest.TestCase):
+    def test_precedence_and_terms(self):
+        tree, terms = parse('crypto OR "Bitcoin Price" AND NOT word:sol')
+        self.assertEqual(terms, [("text", "crypto"), ("text", "bitcoin price"), ("word", "sol")])
+        self.assertEqual(tree, ("or", [("term", 0), ("and", [("term", 1), ("not", ("term", 2))])]))
+
+    def test_repeated_terms_are_parsed_once(self):
+        tree, terms = parse("(btc or eth) and not (BTC and airdrop)")
+        self.assertEqual(terms, [("text", "btc"), ("text", "eth"), ("text", "airdrop")])
+        self.assertEqual(tree, ("and", [("or", [("term", 0), ("term", 1)]), ("not", ("and", [("term", 0), ("term", 2)]))]))
+
+    def test_regex_terms(self):
+        _, terms = parse(r"/\bbtc\s*\d+k\b/ or /a\/b/")
+        self.assertEqual(terms, [("regex", r"\bbtc\s*\d+k\b"), ("regex", "a/b")])
+
+    def test_invalid_rules_are_rejected(self):
+        for text in ("", "crypto bitcoin", "crypto AND", "(crypto", "crypto)", 'word:""', "/[unclosed/",
+                     r"/(a)\1/", "/(?P<name>a)/", "x" * 5000, " OR ".join(f"t{i}" for i in range(MAX_TERMS + 1))):
+            with self.subTest(text=text[:40]), self.assertRaises(FilterSyntaxError):
+                parse(text)
+
+
+class CompiledFilterTest(unittest.TestCase):
+    def test_substring_and_whole_word_terms(self):
+        rule = CompiledFilter("word:sol OR solana")
+        self.assertTrue(rule.match("SOL is up"))
+        self.assertTrue(rule.match("all in on Solana"))
+        self.assertFalse(rule.match("console.log"))
+        only_word = CompiledFilter("word:sol")
+        self.assertFalse(only_word.match("solana"))
+        self.assertTrue(only_word.match("buy sol_ or sol!"))
+
+    def test_overlapping_literals_are_all_found(self):
+        rule = CompiledFilter("bit AND bitcoin AND coin")
+        self.assertTrue(rule.match("bitcoin"))
+        self.assertFalse(rule.match("bit coins"))
+
+    def test_boolean_operators(self):
+        rule = CompiledFilter('(btc OR eth) AND NOT airdrop AND NOT "free money"')
+        self.assertTrue(rule.match("ETH breaks out"))
+        self.assertFalse(rule.match("btc airdrop"))
+        self.assertFalse(rule.match("ETH: Free money!"))
+        self.assertFalse(rule.match("doge"))
+
+    def test_regex_terms_hiding_behind_each_other(self):
+        # Both regexes match at the same position; the scan only reports one of them.
+        rule = CompiledFilter(r"/btc\d+/ AND /btc/")
+        self.assertTrue(rule.match("BTC100 now"))
+        self.assertFalse(rule.match("btc now"))
+        self.assertTrue(CompiledFilter(r"crypto OR /\d+k\b/").match("up 50K today"))
+
+
+class KeywordMatcherTest(unittest.TestCase):
+    def test_small_and_large_keyword_sets_agree(self):
+        keywords = ["bit", "bitcoin", "coin", "eth"] + [f"filler{i}" for i in range(NAIVE_MAX_KEYWORDS)]
+        small, large = KeywordMatcher(keywords[:4]), KeywordMatcher(keywords)
+        self.assertTrue(small._naive)
+        self.assertFalse(large._naive)
+        for text in ("Bitcoin rallies", "ETH/BTC", "nothing here", ""):
+            with self.subTest(text=text):
+                self.assertEqual(small.find(text), [k for k in large.find(text) if k in keywords[:4]])
+                self.assertEqual(small.search(text), large.search(text))
+        self.assertEqual(large.find("bitcoin"), ["bit", "bitcoin", "coin"])
+
+
+if __name__ == "__main__":
+    unittest.main()